@@ -0,0 +1,396 @@
+"""
+批量解析并翻译 PDF（无界面）
+
+对一个目录或通配符匹配到的所有 PDF 依次解析并翻译成一种或多种语言。
+每个工作进程启动时预加载 doc_analyze 使用的模型，之后处理的所有文档都复用这些模型，
+避免每个文件重复加载和预热。处理结束后在输出目录写入 manifest.json，
+记录每个文件各阶段的耗时和失败原因。
+
+用法:
+    python batch_translate.py papers/ --languages 中文 日文 --workers 2 --output_dir batch_output
+    python batch_translate.py "papers/**/*.pdf" --languages 中文
+    python batch_translate.py papers/ --languages 中文 日文 --dry_run
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from concurrent_translate import (
+    DEFAULT_CONCURRENCY, DEFAULT_MAX_RETRIES, DEFAULT_RPM, DEFAULT_TPM, Cancelled, check_cancelled
+)
+from parse_cache import DEFAULT_PARSE_CACHE_DIR, DEFAULT_PARSE_CACHE_MAX_BYTES
+from parse_options import DEFAULT_IMAGE_FORMAT, IMAGE_FORMATS, IMAGE_STORE_DIR, LARGE_DOCUMENT_PAGES
+from translation_cache import DEFAULT_CACHE_PATH
+from cost_estimate import add_estimate_arguments, estimate_files, print_estimates, summarize_estimates
+from dedup import ParagraphRegistry
+from metrics import RunMetrics
+
+MANIFEST_FILE = "manifest.json"
+
+# 本批次中由本工作进程缓存了段落译文的段落，在 init_worker 中为每个批次新建
+paragraph_registry = None
+
+# 进度中解析阶段所占的比例，其余按目标语言平分给翻译阶段
+PARSE_PROGRESS_SHARE = 0.3
+
+
+def find_pdfs(source):
+    """列出目录中的 PDF 文件，或展开通配符"""
+    if os.path.isdir(source):
+        pattern = os.path.join(source, "*.pdf")
+    else:
+        pattern = source
+    return sorted(path for path in glob.glob(pattern, recursive=True) if path.lower().endswith(".pdf"))
+
+
+def warm_up_models(log=print):
+    """在工作进程中预加载 doc_analyze 使用的模型（文本模式和 OCR 模式）"""
+    try:
+        from magic_pdf.model.doc_analyze_by_custom_model import ModelSingleton
+        model_manager = ModelSingleton()
+        model_manager.get_model(False, False)
+        model_manager.get_model(True, False)
+    except Exception as e:
+        # 预加载失败不影响处理，doc_analyze 会在第一次使用时自行加载
+        log(f"[{os.getpid()}] 预加载模型失败: {e}")
+
+
+def init_worker():
+    """批量处理的工作进程初始化：新建本批次的段落记录并预加载模型"""
+    global paragraph_registry
+    paragraph_registry = ParagraphRegistry()
+    warm_up_models()
+
+
+def process_in_worker(pdf_file_path, output_dir, languages, settings):
+    """在批量处理的工作进程中处理一个 PDF，同一进程处理的文档共用本批次的段落记录"""
+    return process_one(pdf_file_path, output_dir, languages, settings, registry=paragraph_registry)
+
+
+def duplicate_names(pdf_files):
+    """找出文件名（不含扩展名）相同的 PDF，返回 {文件名: [路径, ...]}"""
+    paths_by_name = {}
+    for pdf_file_path in pdf_files:
+        name_without_suff = os.path.splitext(os.path.basename(pdf_file_path))[0]
+        paths_by_name.setdefault(name_without_suff, []).append(pdf_file_path)
+    return {name: paths for name, paths in paths_by_name.items() if len(paths) > 1}
+
+
+def process_one(pdf_file_path, output_dir, languages, settings, on_progress=None, cancel_event=None,
+                registry=None, output_name=None, parse_lock=None):
+    """解析并翻译一个 PDF，返回该文件的清单记录
+
+    参数:
+        pdf_file_path (str): PDF 文件路径
+        output_dir (str): 输出目录，结果保存在其中的 output_name 子目录
+        languages (list): 目标语言列表
+        settings (dict): 并发、限流、缓存和输出内容档位设置
+        on_progress (callable): 进度回调 on_progress(说明, 0 到 1 之间的完成比例)
+        cancel_event (threading.Event): 设置后在下一个页段或文本块前停止，记录状态为 cancelled
+        registry (ParagraphRegistry): 本批次的段落记录，之前的文档缓存过译文的段落直接复用，为 None 时不跨文档复用
+        output_name (str): 结果子目录名，默认为文件名（不含扩展名）；同名文件需要各自指定不同的子目录名
+        parse_lock (threading.Lock): 多个线程共用模型时传入，解析阶段持有该锁（翻译阶段不持有）
+
+    返回:
+        dict: 清单记录
+    """
+    name_without_suff = os.path.splitext(os.path.basename(pdf_file_path))[0]
+    file_output_dir = os.path.join(output_dir, output_name or name_without_suff)
+    os.makedirs(file_output_dir, exist_ok=True)
+    metrics = RunMetrics(name_without_suff)
+    metrics.set_info(pdf=pdf_file_path, languages=languages)
+    record = {
+        "pdf": pdf_file_path,
+        "output_dir": file_output_dir,
+        "status": "ok",
+        "parse_seconds": None,
+        "translate_seconds": {},
+        "outputs": {},
+        "failures": [],
+        "metrics_file": os.path.join(file_output_dir, "metrics.json"),
+    }
+
+    def report(message, fraction):
+        if on_progress:
+            on_progress(message, fraction)
+
+    try:
+        return _process_one(pdf_file_path, file_output_dir, languages, settings, record, metrics, report,
+                            cancel_event, registry, parse_lock)
+    finally:
+        counters = metrics.snapshot()["counters"]
+        record["dedup_source_tokens"] = counters.get("dedup_source_tokens", 0)
+        record["dedup_saved_tokens"] = counters.get("dedup_saved_tokens", 0)
+        metrics.write_json(record["metrics_file"])
+
+
+def _process_one(pdf_file_path, file_output_dir, languages, settings, record, metrics, report, cancel_event,
+                 registry, parse_lock):
+    """process_one 的主体，各阶段的耗时记录到 metrics"""
+    # 在工作进程中导入，模型和 API 客户端都留在进程内复用
+    from pdf_parse import parse_pdf
+    from parse_cache import ParseCache
+    from translation_cache import TranslationCache
+    from translation_engine import DEFAULT_MODEL, TranslationEngine
+    import translate_md
+
+    name_without_suff = os.path.splitext(os.path.basename(pdf_file_path))[0]
+    try:
+        report("正在解析", 0.0)
+        start = time.perf_counter()
+        parse_cache = None
+        if settings["parse_cache_dir"]:
+            parse_cache = ParseCache(settings["parse_cache_dir"], settings["parse_cache_max_bytes"])
+        if parse_lock is not None:
+            # 等待其他线程解析完成，等待期间可以取消
+            while not parse_lock.acquire(timeout=0.5):
+                check_cancelled(cancel_event)
+        try:
+            md_file_path = parse_pdf(pdf_file_path, file_output_dir, "images", parse_cache=parse_cache,
+                                     artifact_profile=settings["artifact_profile"],
+                                     large_document_pages=settings.get("large_document_pages",
+                                                                       LARGE_DOCUMENT_PAGES),
+                                     image_format=settings.get("image_format", DEFAULT_IMAGE_FORMAT),
+                                     image_quality=settings.get("image_quality"),
+                                     image_store_dir=settings.get("image_store_dir"),
+                                     log=lambda message: print(f"[{name_without_suff}] {message}"),
+                                     cancel_event=cancel_event, metrics=metrics)
+        finally:
+            if parse_lock is not None:
+                parse_lock.release()
+        record["parse_seconds"] = round(time.perf_counter() - start, 3)
+        record["outputs"]["markdown"] = md_file_path
+        report("解析完成", PARSE_PROGRESS_SHARE)
+    except Cancelled:
+        record["status"] = "cancelled"
+        return record
+    except Exception as e:
+        record["status"] = "failed"
+        record["failures"].append({"stage": "parse", "error": str(e), "traceback": traceback.format_exc()})
+        return record
+
+    cache = TranslationCache(settings["cache_path"]) if settings["cache_path"] else None
+    # API 客户端在进程内按服务地址共享，同一进程处理的所有文件复用已建立的连接
+    engine = TranslationEngine(base_url=settings.get("base_url"), cache=cache,
+                               model=settings.get("model", DEFAULT_MODEL))
+    output_template = os.path.join(file_output_dir, f"{name_without_suff}_{{language}}.md")
+    start = time.perf_counter()
+
+    def on_chunk_done(done, total):
+        report(f"已翻译 {done}/{total} 块（{len(languages)} 种语言）",
+               PARSE_PROGRESS_SHARE + done / total * (1 - PARSE_PROGRESS_SHARE))
+
+    # 所有语言共用一次特殊元素保护和分块，请求一起调度
+    try:
+        check_cancelled(cancel_event)
+        with metrics.stage("translate"):
+            language_failures = translate_md.translate_markdown_file(
+                md_file_path, output_template, list(languages),
+                concurrency=settings["concurrency"], rpm=settings["rpm"], tpm=settings["tpm"], cache=cache,
+                on_chunk_done=on_chunk_done, cancel_event=cancel_event, metrics=metrics,
+                max_retries=settings.get("max_retries", DEFAULT_MAX_RETRIES),
+                dedup=settings.get("dedup", True), registry=registry, engine=engine, raise_errors=True,
+            )
+        for language in languages:
+            translated_file_path = translate_md.output_path_for_language(output_template, language)
+            if not os.path.exists(translated_file_path):
+                record["status"] = "failed"
+                record["failures"].append({"stage": f"translate:{language}", "error": "翻译未生成输出文件"})
+                continue
+            record["outputs"][language] = translated_file_path
+            if language_failures[language]:
+                # 译文已生成，但部分文本块保留了原文
+                record["status"] = "failed"
+                record["failures"].append({"stage": f"translate:{language}",
+                                           "error": f"{len(language_failures[language])} 个文本块重试后仍翻译失败",
+                                           "chunks": language_failures[language]})
+    except Cancelled:
+        record["status"] = "cancelled"
+    except Exception as e:
+        record["status"] = "failed"
+        record["failures"].append({"stage": "translate", "error": str(e), "traceback": traceback.format_exc()})
+    # 各语言同时翻译，记录的是共同的总耗时
+    elapsed = round(time.perf_counter() - start, 3)
+    record["translate_seconds"] = {language: elapsed for language in languages}
+    return record
+
+
+def dedup_ratio(records):
+    """所有文件合计的去重比例：去重节省的令牌数占段落总令牌数的比例"""
+    source_tokens = sum(record.get("dedup_source_tokens", 0) for record in records)
+    saved_tokens = sum(record.get("dedup_saved_tokens", 0) for record in records)
+    return round(saved_tokens / source_tokens, 4) if source_tokens else 0.0
+
+
+def run_batch(pdf_files, output_dir, languages, workers=1, settings=None):
+    """用 workers 个常驻工作进程处理所有 PDF，写入并返回清单
+
+    结果按文件名保存在 output_dir 的子目录中，文件名相同的 PDF 会互相覆盖，因此直接抛出 ValueError。
+    """
+    duplicates = duplicate_names(pdf_files)
+    if duplicates:
+        raise ValueError("以下 PDF 文件名相同，结果目录会互相覆盖: " +
+                         "；".join(f"{name}: {', '.join(paths)}" for name, paths in duplicates.items()))
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+    records = []
+    with ProcessPoolExecutor(max_workers=max(1, workers), initializer=init_worker) as executor:
+        futures = {
+            executor.submit(process_in_worker, pdf_file_path, output_dir, languages, settings): pdf_file_path
+            for pdf_file_path in pdf_files
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                record = future.result()
+            except Exception as e:
+                # 工作进程崩溃等情况
+                record = {"pdf": futures[future], "status": "failed",
+                          "failures": [{"stage": "worker", "error": str(e)}]}
+            records.append(record)
+            print(f"[{done}/{len(pdf_files)}] {record['pdf']}: {record['status']}")
+
+    records.sort(key=lambda record: pdf_files.index(record["pdf"]))
+    manifest = {
+        "languages": languages,
+        "workers": workers,
+        "total_seconds": round(time.perf_counter() - start, 3),
+        "succeeded": sum(1 for record in records if record["status"] == "ok"),
+        "failed": sum(1 for record in records if record["status"] != "ok"),
+        "dedup_ratio": dedup_ratio(records),
+        "files": records,
+    }
+    with open(os.path.join(output_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+    return manifest
+
+
+def run_batch_via_service(pdf_files, output_dir, languages, service_url, artifact_profile=None):
+    """把所有 PDF 提交给常驻服务（parse_service.py）处理，等待全部结束后写入并返回清单
+
+    服务已加载好模型，本进程不导入 magic_pdf；结果文件保存在服务的输出目录中。
+    """
+    from parse_service import JOB_SUCCEEDED, submit_job, wait_for_job
+
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+    jobs = [submit_job(service_url, pdf_file_path, languages, artifact_profile) for pdf_file_path in pdf_files]
+    records = []
+    for done, (pdf_file_path, job) in enumerate(zip(pdf_files, jobs), 1):
+        state = wait_for_job(service_url, job["id"])
+        record = {
+            "pdf": pdf_file_path,
+            "job_id": job["id"],
+            "status": "ok" if state["state"] == JOB_SUCCEEDED else state["state"],
+            "parse_seconds": state["parse_seconds"],
+            "translate_seconds": state["translate_seconds"],
+            "outputs": state["outputs"],
+            "failures": state["failures"],
+        }
+        records.append(record)
+        print(f"[{done}/{len(pdf_files)}] {pdf_file_path}: {record['status']}")
+
+    manifest = {
+        "languages": languages,
+        "service_url": service_url,
+        "total_seconds": round(time.perf_counter() - start, 3),
+        "succeeded": sum(1 for record in records if record["status"] == "ok"),
+        "failed": sum(1 for record in records if record["status"] != "ok"),
+        "files": records,
+    }
+    with open(os.path.join(output_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='批量解析并翻译 PDF，模型在工作进程中只加载一次')
+    parser.add_argument('source', help='PDF 所在目录，或通配符（如 "papers/**/*.pdf"）')
+    parser.add_argument('--languages', nargs='+', default=['中文'], help='目标语言列表 (默认为中文)')
+    parser.add_argument('--output_dir', default='batch_output', help='输出目录 (默认为batch_output)')
+    parser.add_argument('--workers', type=int, default=1, help='工作进程数，每个进程各加载一份模型 (默认为1)')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'每个工作进程同时在途的翻译请求数 (默认为{DEFAULT_CONCURRENCY})')
+    parser.add_argument('--rpm', type=int, default=DEFAULT_RPM,
+                        help=f'所有工作进程合计的每分钟请求数上限，0 表示不限制 (默认为{DEFAULT_RPM})')
+    parser.add_argument('--tpm', type=int, default=DEFAULT_TPM,
+                        help='所有工作进程合计的每分钟令牌数上限，0 表示不限制 (默认不限制)')
+    parser.add_argument('--max_retries', type=int, default=DEFAULT_MAX_RETRIES,
+                        help=f'每个文本块失败后最多重试次数 (默认为{DEFAULT_MAX_RETRIES})')
+    parser.add_argument('--base_url', default=None,
+                        help='OpenAI 兼容服务的地址 (默认读取 OPENAI_BASE_URL 环境变量)')
+    parser.add_argument('--cache_path', default=DEFAULT_CACHE_PATH, help='翻译缓存文件路径')
+    parser.add_argument('--no_cache', action='store_true', help='不使用翻译缓存')
+    parser.add_argument('--parse_cache_dir', default=DEFAULT_PARSE_CACHE_DIR, help='解析缓存目录')
+    parser.add_argument('--no_parse_cache', action='store_true', help='不使用解析缓存')
+    parser.add_argument('--artifact_profile', choices=['minimal', 'standard', 'debug'], default='minimal',
+                        help='输出内容档位: minimal 只输出 Markdown 和图片，standard 另外输出 JSON，'
+                             'debug 另外绘制可视化 PDF (默认为minimal)')
+    parser.add_argument('--large_document_pages', type=int, default=LARGE_DOCUMENT_PAGES,
+                        help='页数达到该值的 PDF 按页窗口解析，内存峰值不随页数增长；'
+                             f'0 表示不使用 (默认为{LARGE_DOCUMENT_PAGES})')
+    parser.add_argument('--image_format', choices=IMAGE_FORMATS, default=DEFAULT_IMAGE_FORMAT,
+                        help=f'提取出的图片的保存格式 (默认为{DEFAULT_IMAGE_FORMAT})')
+    parser.add_argument('--image_quality', type=int, default=None,
+                        help='图片重新编码的质量 1-100 (jpeg 默认不重新编码，webp 默认为80)')
+    parser.add_argument('--dry_run', action='store_true',
+                        help='不解析也不翻译，只估算每个文件和合计的请求数、令牌数、费用和耗时；'
+                             '已解析过的 PDF 使用输出目录中的 Markdown，其余按 PDF 文本近似')
+    add_estimate_arguments(parser)
+    parser.add_argument('--service_url', default=None,
+                        help='提交给已启动的 parse_service.py 处理（如 http://127.0.0.1:8600），'
+                             '此时并发、限流和缓存设置以服务为准')
+    args = parser.parse_args()
+
+    pdf_files = find_pdfs(args.source)
+    if not pdf_files:
+        parser.error(f"没有找到 PDF 文件: {args.source}")
+
+    duplicates = duplicate_names(pdf_files)
+    if duplicates and not args.service_url and not args.dry_run:
+        # 本地处理时结果按文件名保存，同名文件会写入同一个目录
+        parser.error("以下 PDF 文件名相同，请分批处理或重命名:\n" +
+                     "\n".join(f"  {name}: {', '.join(paths)}" for name, paths in duplicates.items()))
+
+    workers = max(1, args.workers)
+    if args.dry_run:
+        estimates = estimate_files(pdf_files, args.languages, parsed_dir=args.output_dir)
+        total = summarize_estimates(estimates, args.model, args.price, args.concurrency, args.rpm, args.tpm,
+                                    args.request_latency, args.output_tokens_per_second, workers)
+        print_estimates(estimates, total)
+        sys.exit(0)
+
+    settings = {
+        "concurrency": args.concurrency,
+        # 限流额度在工作进程之间平分
+        "rpm": max(1, args.rpm // workers) if args.rpm else 0,
+        "tpm": max(1, args.tpm // workers) if args.tpm else 0,
+        "max_retries": args.max_retries,
+        "base_url": args.base_url,
+        "model": args.model,
+        "cache_path": None if args.no_cache else args.cache_path,
+        "parse_cache_dir": None if args.no_parse_cache else args.parse_cache_dir,
+        "parse_cache_max_bytes": DEFAULT_PARSE_CACHE_MAX_BYTES,
+        "artifact_profile": args.artifact_profile,
+        "large_document_pages": args.large_document_pages,
+        "image_format": args.image_format,
+        "image_quality": args.image_quality,
+        # 相同的图片在所有文档之间只保存一份
+        "image_store_dir": os.path.join(args.output_dir, IMAGE_STORE_DIR),
+    }
+
+    if args.service_url:
+        print(f"共 {len(pdf_files)} 个 PDF，目标语言: {', '.join(args.languages)}，提交到 {args.service_url}")
+        manifest = run_batch_via_service(pdf_files, args.output_dir, args.languages, args.service_url,
+                                         args.artifact_profile)
+    else:
+        print(f"共 {len(pdf_files)} 个 PDF，目标语言: {', '.join(args.languages)}，工作进程数: {workers}")
+        manifest = run_batch(pdf_files, args.output_dir, args.languages, workers, settings)
+    print(f"完成 {manifest['succeeded']} 个，失败 {manifest['failed']} 个，"
+          f"总耗时 {manifest['total_seconds']:.1f}s，清单: {os.path.join(args.output_dir, MANIFEST_FILE)}")
+    if manifest.get("dedup_ratio"):
+        print(f"重复段落去重节省了约 {manifest['dedup_ratio']:.1%} 的输入令牌")
@@ -0,0 +1,606 @@
+"""
+翻译流程的性能基准
+
+concurrency: 在本地模拟的 OpenAI 兼容服务上测量不同并发数下翻译同一份 Markdown 的耗时，
+             验证总耗时随并发数近似线性下降、且输出顺序不变。
+protection:  在不同大小的合成 Markdown 上对比特殊元素保护/恢复的新旧实现。
+suite:       分阶段计时整个流程：在自带的 TPAMI 论文上计时解析各阶段（需要 magic_pdf），
+             在该论文的 Markdown 和不同大小的合成 Markdown 上计时保护、分块、翻译（本地模拟服务）和恢复。
+             结果（含 CPU 时间和运行环境）写入 JSON；用 --baseline 指定在同一台机器上保存的基线时逐阶段对比，
+             --update_baseline 用本次结果生成或覆盖该基线。
+startup:     用 python -X importtime 测量导入图形界面模块的耗时，列出最慢的模块，
+             并检查启动时是否误导入了 magic_pdf、torch、openai 等重模块；可选测量窗口出现的耗时（需要图形环境）。
+memory:      把自带的论文重复拼接成不同页数的 PDF，分别用整篇模式和大文档模式在子进程中解析，
+             对比常驻内存峰值随页数的变化（需要 magic_pdf）。
+
+用法:
+    python benchmark.py concurrency --chunks 16 --latency 0.5 --concurrency 1 2 4 8
+    python benchmark.py protection --sizes 100 1000 5000
+    python benchmark.py suite --baseline benchmark_baseline.json --update_baseline
+    python benchmark.py suite --baseline benchmark_baseline.json --fail_on_regression
+    python benchmark.py startup --top 15 --window
+    python benchmark.py memory --pages 20 100 400 --window_size 16
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from fake_openai_server import FakeOpenAIServer
+from parse_options import LARGE_DOCUMENT_WINDOW_SIZE
+
+
+def make_synthetic_markdown(paragraphs, paragraph_length=600):
+    """生成由编号段落组成的 Markdown 文本"""
+    body = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. "
+    return "\n\n".join(
+        f"Paragraph {i}. " + (body * (paragraph_length // len(body) + 1))[:paragraph_length]
+        for i in range(paragraphs)
+    )
+
+
+def make_formula_dense_markdown(paragraphs, tables=True):
+    """生成公式、表格和图片密集的合成 Markdown 文本，模拟学术论文"""
+    blocks = []
+    for i in range(paragraphs):
+        blocks.append(f"## Section {i}")
+        blocks.append(
+            f"The loss $L_{{{i}}} = \\sum_j w_j x_j$ depends on $\\alpha$ and $\\beta_{{{i}}}$, "
+            f"while $f(x) = x^2$ is reused."
+        )
+        if i % 3 == 0:
+            blocks.append(f"$$\nE_{{{i}}} = mc^2 + \\int_0^1 g(t) dt\n$$")
+        if tables and i % 5 == 0:
+            blocks.append("| a | b |\n|---|---|\n| 1 | 2 |\n| 3 | 4 |")
+        if i % 7 == 0:
+            blocks.append(f"![Figure {i}](images/fig_{i}.jpg)")
+    return "\n\n".join(blocks)
+
+
+def _legacy_extract_special_elements(text):
+    """旧版实现：每个匹配都重新扫描整个字符串，用于对比"""
+    patterns = [
+        r'\$\$.*?\$\$|\$.*?\$',
+        r'<html>.*?</html>',
+        r'(\|.*\|[\r\n]+)(\|[-:| ]+\|[\r\n]+)((\|.*\|[\r\n]+)+)',
+        r'```.*?```',
+        r'!\[.*?\]\(.*?\)'
+    ]
+    special_elements = []
+    modified_text = text
+    for i, match in enumerate(re.finditer('|'.join(patterns), text, re.DOTALL)):
+        special_elements.append(match.group(0))
+        modified_text = modified_text.replace(match.group(0), f"[PROTECTED_ELEMENT_{i}]", 1)
+    return modified_text, special_elements
+
+
+def _legacy_restore_special_elements(text, special_elements):
+    """旧版实现：每个占位符都重新扫描整个字符串，用于对比"""
+    for i, element in enumerate(special_elements):
+        text = text.replace(f"[PROTECTED_ELEMENT_{i}]", element, 1)
+    return text
+
+
+def bench_protection(sizes):
+    """对比特殊元素保护与恢复的新旧实现耗时
+
+    旧实现的 Markdown 表格模式在 DOTALL 下会从第一张表一直匹配到全文最后一个 |，
+    吞掉大段正文，因此计时对比使用不含表格的文档，保证两者匹配到相同的元素。
+    """
+    from special_elements import extract_special_elements, restore_special_elements
+
+    table_text = make_formula_dense_markdown(sizes[0])
+    _, legacy_elements = _legacy_extract_special_elements(table_text)
+    _, elements = extract_special_elements(table_text)
+    print(f"含表格的文档: 新实现最大元素 {max(map(len, elements))} 字符，"
+          f"旧实现最大元素 {max(map(len, legacy_elements))} 字符（共 {len(table_text)} 字符）")
+
+    results = []
+    for size in sizes:
+        text = make_formula_dense_markdown(size, tables=False)
+
+        start = time.perf_counter()
+        modified, elements = extract_special_elements(text)
+        restored = restore_special_elements(modified, elements)
+        new_elapsed = time.perf_counter() - start
+        assert restored == text, "恢复后的文本与原文不一致"
+
+        start = time.perf_counter()
+        legacy_modified, legacy_elements = _legacy_extract_special_elements(text)
+        _legacy_restore_special_elements(legacy_modified, legacy_elements)
+        legacy_elapsed = time.perf_counter() - start
+        assert len(legacy_elements) == len(elements), "新旧实现匹配到的元素数量不一致"
+
+        results.append((size, len(text), len(elements), new_elapsed, legacy_elapsed))
+        print(f"{size:>6} 节 {len(text) / 1024:>8.0f} KB {len(elements):>7} 个元素: "
+              f"新实现 {new_elapsed * 1000:>8.1f} ms, 旧实现 {legacy_elapsed * 1000:>9.1f} ms")
+    return results
+
+
+def bench_concurrency(chunk_count, latency, concurrency_levels):
+    """测量不同并发数下的翻译耗时"""
+    with FakeOpenAIServer(latency=latency) as server:
+        from translation_engine import TranslationEngine
+        from concurrent_translate import RateLimiter, translate_chunks
+
+        engine = TranslationEngine(api_key="fake", base_url=server.base_url)
+        # 第一个请求要导入 openai、创建客户端并建立连接（约 1 秒），预热后再计时，否则都算在第一个并发数上
+        engine.translate_text("warm up")
+
+        # 每个段落作为一个文本块，块数不受分块预算影响
+        chunks = make_synthetic_markdown(chunk_count, 3900).split("\n\n")
+        results = []
+        for concurrency in concurrency_levels:
+            start = time.perf_counter()
+            translated = translate_chunks(
+                chunks,
+                lambda chunk: engine.translate_text(chunk),
+                concurrency=concurrency,
+                limiter=RateLimiter(rpm=0, tpm=0),
+            )
+            elapsed = time.perf_counter() - start
+            # 模拟服务原样返回，可以直接校验顺序
+            assert translated == chunks, "译文顺序与原文不一致"
+            results.append((concurrency, elapsed))
+            print(f"并发数 {concurrency:>3}: {len(chunks)} 块耗时 {elapsed:.2f}s")
+
+    baseline = results[0][1]
+    for concurrency, elapsed in results[1:]:
+        print(f"并发数 {concurrency} 相对并发数 {results[0][0]} 加速 {baseline / elapsed:.1f}x")
+    return results
+
+
+# suite 使用的默认参数
+DEFAULT_SUITE_PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "2024-tpami-asr-etr.pdf")
+DEFAULT_SUITE_SIZES = [20, 200, 1000]
+DEFAULT_SUITE_LATENCY = 0.05
+# 这些环境信息不同时耗时没有可比性（如分词器不可用时改用估算的令牌数）
+COMPARABLE_ENVIRONMENT_KEYS = ("platform", "cpu_count", "magic_pdf", "tokenizer")
+DEFAULT_TOLERANCE = 0.2
+# 与基线对比时忽略耗时过短的阶段，避免计时噪声造成误报
+MIN_COMPARABLE_SECONDS = 0.01
+
+
+def _max_rss_bytes():
+    """当前进程的常驻内存峰值（字节），不支持时返回 None"""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 上单位是字节，Linux 上是 KB
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class StageRecorder:
+    """记录每个阶段的墙钟时间、CPU 时间和内存峰值，同一阶段多次运行时取中位数"""
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.runs = {}
+
+    @contextmanager
+    def stage(self, name):
+        if self.trace_memory:
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            run = {
+                "wall_seconds": time.perf_counter() - wall_start,
+                "cpu_seconds": time.process_time() - cpu_start,
+                "peak_traced_bytes": None,
+                "max_rss_bytes": _max_rss_bytes(),
+            }
+            if self.trace_memory:
+                run["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            self.runs.setdefault(name, []).append(run)
+
+    def summary(self):
+        stages = {}
+        for name, runs in self.runs.items():
+            peaks = [run["peak_traced_bytes"] for run in runs if run["peak_traced_bytes"] is not None]
+            stages[name] = {
+                "runs": len(runs),
+                "wall_seconds": round(statistics.median(run["wall_seconds"] for run in runs), 6),
+                "cpu_seconds": round(statistics.median(run["cpu_seconds"] for run in runs), 6),
+                "peak_traced_bytes": max(peaks) if peaks else None,
+                "max_rss_bytes": runs[-1]["max_rss_bytes"],
+            }
+        return stages
+
+
+def bench_pdf_stages(pdf_file_path, work_dir, recorder):
+    """计时 PDF 解析的各阶段，返回解析出的 Markdown"""
+    from magic_pdf.data.data_reader_writer import FileBasedDataWriter, FileBasedDataReader
+    from magic_pdf.data.dataset import PymuDocDataset
+    from magic_pdf.model.doc_analyze_by_custom_model import ModelSingleton, doc_analyze
+    from pdf_parse import classify_pages
+
+    local_image_dir = os.path.join(work_dir, "images")
+    os.makedirs(local_image_dir, exist_ok=True)
+    image_writer, md_writer = FileBasedDataWriter(local_image_dir), FileBasedDataWriter(work_dir)
+    pdf_bytes = FileBasedDataReader("").read(pdf_file_path)
+
+    with recorder.stage("classify"):
+        needs_ocr = classify_pages(pdf_bytes)
+        ds = PymuDocDataset(pdf_bytes)
+    ocr = any(needs_ocr)
+
+    # 单独计时模型加载，doc_analyze 的耗时不包含加载
+    with recorder.stage("model_load"):
+        ModelSingleton().get_model(ocr, False)
+    with recorder.stage("doc_analyze"):
+        infer_result = ds.apply(doc_analyze, ocr=ocr)
+    with recorder.stage("pipe_ocr_mode" if ocr else "pipe_txt_mode"):
+        if ocr:
+            pipe_result = infer_result.pipe_ocr_mode(image_writer)
+        else:
+            pipe_result = infer_result.pipe_txt_mode(image_writer)
+    with recorder.stage("get_markdown"):
+        md_content = pipe_result.get_markdown("images")
+    with recorder.stage("dump_md"):
+        pipe_result.dump_md(md_writer, "doc.md", "images")
+    with recorder.stage("draw_model"):
+        infer_result.draw_model(os.path.join(work_dir, "doc_model.pdf"))
+    with recorder.stage("draw_layout"):
+        pipe_result.draw_layout(os.path.join(work_dir, "doc_layout.pdf"))
+    with recorder.stage("draw_span"):
+        pipe_result.draw_span(os.path.join(work_dir, "doc_spans.pdf"))
+    return md_content
+
+
+def bench_markdown_stages(md_content, recorder, translate_func, repeat=1, target_language="中文"):
+    """计时 Markdown 的保护、分块、翻译和恢复阶段"""
+    from special_elements import extract_special_elements, restore_special_elements
+    from chunking import chunk_text
+    from concurrent_translate import RateLimiter, translate_chunks
+
+    for _ in range(max(1, repeat)):
+        with recorder.stage("extract_special_elements"):
+            modified, elements = extract_special_elements(md_content)
+        with recorder.stage("chunk_text"):
+            chunks = chunk_text(modified, target_language=target_language)
+        with recorder.stage("translate"):
+            translated = translate_chunks(chunks, translate_func, limiter=RateLimiter(rpm=0, tpm=0))
+        with recorder.stage("restore_special_elements"):
+            restore_special_elements("\n\n".join(translated), elements)
+    return {"characters": len(md_content), "special_elements": len(elements), "chunks": len(chunks)}
+
+
+def _environment():
+    environment = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    try:
+        from magic_pdf.libs.version import __version__
+        environment["magic_pdf"] = __version__
+    except ImportError:
+        environment["magic_pdf"] = None
+    from chunking import _get_encoding
+    environment["tokenizer"] = bool(_get_encoding())
+    return environment
+
+
+def run_suite(pdf_file_path, sizes, latency, repeat=1, trace_memory=True, skip_pdf=False):
+    """运行分阶段基准，返回可写入 JSON 的结果"""
+    documents = {}
+    # 先加载分词器，避免计入第一次分块的耗时
+    environment = _environment()
+    with FakeOpenAIServer(latency=latency) as server:
+        from translation_engine import TranslationEngine
+
+        engine = TranslationEngine(api_key="fake", base_url=server.base_url)
+
+        def translate_func(chunk):
+            return engine.translate_text(chunk)
+
+        # 预热客户端连接
+        translate_func("warm up")
+
+        if not skip_pdf:
+            recorder = StageRecorder(trace_memory)
+            work_dir = tempfile.mkdtemp(prefix="benchmark-")
+            try:
+                md_content = bench_pdf_stages(pdf_file_path, work_dir, recorder)
+                info = bench_markdown_stages(md_content, recorder, translate_func, repeat)
+                documents["tpami"] = {"source": os.path.basename(pdf_file_path), **info,
+                                      "stages": recorder.summary()}
+            except ImportError as e:
+                print(f"跳过 PDF 解析阶段（未安装 magic_pdf）: {e}")
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+        for size in sizes:
+            recorder = StageRecorder(trace_memory)
+            info = bench_markdown_stages(make_formula_dense_markdown(size), recorder, translate_func, repeat)
+            documents[f"synthetic_{size}"] = {"source": f"make_formula_dense_markdown({size})", **info,
+                                              "stages": recorder.summary()}
+        requests = server.request_count - 1
+
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": environment,
+        "parameters": {"sizes": sizes, "latency": latency, "repeat": repeat, "trace_memory": trace_memory},
+        "requests": requests,
+        "documents": documents,
+    }
+
+
+def print_suite(results):
+    for document, data in results["documents"].items():
+        print(f"\n{document}（{data['characters']} 字符，{data['special_elements']} 个特殊元素，{data['chunks']} 块）")
+        for name, stage in data["stages"].items():
+            peak = stage["peak_traced_bytes"]
+            peak_text = f"{peak / 1024 / 1024:>8.1f} MB" if peak is not None else "       -"
+            print(f"  {name:<26} 墙钟 {stage['wall_seconds'] * 1000:>10.1f} ms  "
+                  f"CPU {stage['cpu_seconds'] * 1000:>10.1f} ms  内存峰值 {peak_text}")
+
+
+def compare_with_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """与基线逐阶段对比墙钟时间，返回变慢超过 tolerance 的阶段列表"""
+    regressions = []
+    print(f"\n与基线（{baseline.get('created_at')}）对比:")
+    for key in COMPARABLE_ENVIRONMENT_KEYS:
+        old, new = baseline.get("environment", {}).get(key), results["environment"].get(key)
+        if old != new:
+            print(f"  注意: 运行环境的 {key} 与基线不同（基线 {old}，本次 {new}），耗时对比仅供参考")
+    for document, data in results["documents"].items():
+        baseline_stages = baseline.get("documents", {}).get(document, {}).get("stages", {})
+        for name, stage in data["stages"].items():
+            if name not in baseline_stages:
+                continue
+            old, new = baseline_stages[name]["wall_seconds"], stage["wall_seconds"]
+            if max(old, new) < MIN_COMPARABLE_SECONDS:
+                continue
+            ratio = new / old if old else float("inf")
+            flag = ""
+            if ratio > 1 + tolerance:
+                flag = "  <-- 变慢"
+                regressions.append({"document": document, "stage": name, "baseline": old, "current": new})
+            elif ratio < 1 - tolerance:
+                flag = "  <-- 变快"
+            print(f"  {document:<16} {name:<26} {old * 1000:>10.1f} -> {new * 1000:>10.1f} ms ({ratio:>5.2f}x){flag}")
+    return regressions
+
+
+# 图形界面启动时不应导入的重模块，它们应当在后台预加载线程或第一次使用时导入
+HEAVY_MODULES = ("magic_pdf", "torch", "openai", "transformers", "paddleocr")
+
+_IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$')
+
+# 在子进程中创建窗口并处理完第一批界面事件，输出从进程内开始计时到窗口出现的秒数
+_WINDOW_SCRIPT = """
+import time
+start = time.perf_counter()
+import tkinter as tk
+import {module} as gui
+root = tk.Tk()
+app = gui.PDFTranslator(root)
+root.update()
+print(time.perf_counter() - start)
+root.destroy()
+"""
+
+
+def parse_importtime(stderr):
+    """解析 -X importtime 的输出，返回 [(模块名, 自身微秒, 累计微秒, 嵌套深度)]"""
+    entries = []
+    for line in stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return entries
+
+
+def bench_startup(module="pdf_translator", top=15, window=False):
+    """测量导入图形界面模块（以及可选的窗口出现）的耗时
+
+    返回:
+        dict: 导入耗时、最慢的模块、启动时导入的重模块和窗口出现耗时
+    """
+    project_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               cwd=project_dir, env=env, capture_output=True, text=True)
+    process_seconds = time.perf_counter() - start
+    if completed.returncode != 0:
+        print(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "导入失败")
+        return None
+
+    entries = parse_importtime(completed.stderr)
+    module_us = next((cumulative for name, _, cumulative, depth in entries if name == module and depth == 0), 0)
+    heavy = sorted({name for name, *_ in entries if name.split(".")[0] in HEAVY_MODULES})
+    slowest = sorted((entry for entry in entries if entry[3] <= 1), key=lambda entry: entry[2], reverse=True)[:top]
+
+    print(f"导入 {module}: {module_us / 1e6:.3f}s（子进程总耗时 {process_seconds:.3f}s，含解释器启动）")
+    print(f"{'模块':<40}{'累计(ms)':>12}{'自身(ms)':>12}")
+    for name, self_us, cumulative_us, depth in slowest:
+        print(f"{'  ' * depth + name:<40}{cumulative_us / 1000:>12.1f}{self_us / 1000:>12.1f}")
+    if heavy:
+        print(f"启动时导入了重模块: {', '.join(heavy)}")
+    else:
+        print(f"启动时没有导入重模块（{', '.join(HEAVY_MODULES)}）")
+
+    window_seconds = None
+    if window:
+        completed = subprocess.run([sys.executable, "-c", _WINDOW_SCRIPT.format(module=module)],
+                                   cwd=project_dir, env=env, capture_output=True, text=True)
+        if completed.returncode == 0:
+            window_seconds = float(completed.stdout.strip().splitlines()[-1])
+            print(f"窗口出现: {window_seconds:.3f}s")
+        else:
+            print(f"无法创建窗口（需要图形环境）: {completed.stderr.strip().splitlines()[-1]}")
+
+    return {
+        "module": module,
+        "import_seconds": round(module_us / 1e6, 6),
+        "process_seconds": round(process_seconds, 6),
+        "window_seconds": window_seconds,
+        "heavy_modules": heavy,
+        "slowest": [{"module": name, "cumulative_ms": cumulative_us / 1000, "self_ms": self_us / 1000}
+                    for name, self_us, cumulative_us, _ in slowest],
+    }
+
+
+_MEMORY_SCRIPT = """
+import tempfile
+from benchmark import _max_rss_bytes
+from pdf_parse import parse_pdf
+with tempfile.TemporaryDirectory() as output_dir:
+    parse_pdf({pdf!r}, output_dir, artifact_profile="minimal", log=lambda message: None,
+              large_document_pages={large_document_pages}, large_document_window_size={window_size})
+print(_max_rss_bytes())
+"""
+
+
+def make_repeated_pdf(source_pdf, page_count, output_path):
+    """把 source_pdf 的页面重复拼接成 page_count 页的 PDF"""
+    import fitz
+
+    with fitz.open(source_pdf) as source, fitz.open() as output:
+        while output.page_count < page_count:
+            last_page = min(source.page_count, page_count - output.page_count) - 1
+            output.insert_pdf(source, from_page=0, to_page=last_page)
+        output.save(output_path)
+
+
+def bench_memory(pdf_file_path, page_counts, window_size):
+    """对比整篇模式和大文档模式解析不同页数的 PDF 时的常驻内存峰值
+
+    每次解析都在新的子进程中进行，模型加载的内存也计入峰值。
+
+    返回:
+        list: 每个页数一项 {"pages", "full_rss_bytes", "large_rss_bytes"}，无法测量的为 None
+    """
+    project_dir = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for page_count in page_counts:
+            path = os.path.join(work_dir, f"doc_{page_count}.pdf")
+            make_repeated_pdf(pdf_file_path, page_count, path)
+            result = {"pages": page_count}
+            for name, large_document_pages in (("full_rss_bytes", 0), ("large_rss_bytes", 1)):
+                script = _MEMORY_SCRIPT.format(pdf=path, large_document_pages=large_document_pages,
+                                               window_size=window_size)
+                completed = subprocess.run([sys.executable, "-c", script], cwd=project_dir,
+                                           capture_output=True, text=True)
+                output = completed.stdout.strip().splitlines()
+                if completed.returncode != 0 or not output or output[-1] == "None":
+                    error = completed.stderr.strip().splitlines()
+                    print(f"{page_count} 页解析失败: {error[-1] if error else '无法测量内存'}")
+                    result[name] = None
+                else:
+                    result[name] = int(output[-1])
+            results.append(result)
+
+    def megabytes(value):
+        return f"{value / 1024 / 1024:.0f}" if value is not None else "-"
+
+    print(f"{'页数':>8}{'整篇模式(MB)':>16}{'大文档模式(MB)':>18}")
+    for result in results:
+        print(f"{result['pages']:>8}{megabytes(result['full_rss_bytes']):>16}"
+              f"{megabytes(result['large_rss_bytes']):>18}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='翻译流程的性能基准')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    concurrency_parser = subparsers.add_parser('concurrency', help='并发翻译耗时')
+    concurrency_parser.add_argument('--chunks', type=int, default=16, help='文本块数量 (默认为16)')
+    concurrency_parser.add_argument('--latency', type=float, default=0.5,
+                                    help='模拟服务每个请求的延迟秒数 (默认为0.5)')
+    concurrency_parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8],
+                                    help='要测量的并发数列表 (默认为 1 2 4 8)')
+
+    protection_parser = subparsers.add_parser('protection', help='特殊元素保护与恢复耗时')
+    protection_parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000],
+                                   help='合成文档的章节数列表 (默认为 100 1000 5000)')
+    suite_parser = subparsers.add_parser('suite', help='分阶段计时整个流程并与基线对比')
+    suite_parser.add_argument('--pdf', default=DEFAULT_SUITE_PDF, help='用于计时解析阶段的 PDF (默认为自带的 TPAMI 论文)')
+    suite_parser.add_argument('--skip_pdf', action='store_true', help='不计时 PDF 解析阶段')
+    suite_parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SUITE_SIZES,
+                              help='合成文档的章节数列表 (默认为 20 200 1000)')
+    suite_parser.add_argument('--latency', type=float, default=DEFAULT_SUITE_LATENCY,
+                              help=f'模拟服务每个请求的延迟秒数 (默认为{DEFAULT_SUITE_LATENCY})')
+    suite_parser.add_argument('--repeat', type=int, default=3, help='Markdown 各阶段的重复次数，取中位数 (默认为3)')
+    suite_parser.add_argument('--no_trace_memory', action='store_true',
+                              help='不用 tracemalloc 统计内存峰值（它会拖慢纯 Python 阶段）')
+    suite_parser.add_argument('--output', default='benchmark_results.json', help='结果 JSON 文件路径')
+    suite_parser.add_argument('--baseline', default=None,
+                              help='基线 JSON 文件路径，提供时逐阶段对比；基线只在生成它的机器和环境上有可比性')
+    suite_parser.add_argument('--update_baseline', action='store_true',
+                              help='用本次结果生成或覆盖 --baseline 指定的基线文件，不做对比')
+    suite_parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                              help='墙钟时间超过基线多少比例算作变慢 (默认为0.2)')
+    suite_parser.add_argument('--fail_on_regression', action='store_true', help='有阶段变慢时以非零状态退出')
+    startup_parser = subparsers.add_parser('startup', help='图形界面启动耗时')
+    startup_parser.add_argument('--module', default='pdf_translator', help='要测量的模块 (默认为pdf_translator)')
+    startup_parser.add_argument('--top', type=int, default=15, help='列出最慢的模块数 (默认为15)')
+    startup_parser.add_argument('--window', action='store_true', help='同时测量窗口出现的耗时（需要图形环境）')
+    startup_parser.add_argument('--max_seconds', type=float, default=1.0,
+                                help='导入耗时上限，超过或导入了重模块时以非零状态退出 (默认为1.0)')
+    memory_parser = subparsers.add_parser('memory', help='解析不同页数的 PDF 时的内存峰值')
+    memory_parser.add_argument('--pdf', default=DEFAULT_SUITE_PDF, help='用于拼接的 PDF (默认为自带的 TPAMI 论文)')
+    memory_parser.add_argument('--pages', type=int, nargs='+', default=[20, 100, 400],
+                               help='要测量的页数列表 (默认为 20 100 400)')
+    memory_parser.add_argument('--window_size', type=int, default=LARGE_DOCUMENT_WINDOW_SIZE,
+                               help=f'大文档模式每个窗口的页数 (默认为{LARGE_DOCUMENT_WINDOW_SIZE})')
+    memory_parser.add_argument('--output', default=None, help='结果 JSON 文件路径')
+    args = parser.parse_args()
+
+    if args.command == 'concurrency':
+        bench_concurrency(args.chunks, args.latency, args.concurrency)
+    elif args.command == 'protection':
+        bench_protection(args.sizes)
+    elif args.command == 'suite':
+        if args.update_baseline and not args.baseline:
+            parser.error("--update_baseline 需要用 --baseline 指定基线文件路径")
+        results = run_suite(args.pdf, args.sizes, args.latency, args.repeat,
+                            trace_memory=not args.no_trace_memory, skip_pdf=args.skip_pdf)
+        print_suite(results)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=4)
+        print(f"\n结果已保存到 {args.output}")
+        if args.update_baseline:
+            with open(args.baseline, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=4)
+            print(f"基线已更新: {args.baseline}")
+        elif args.baseline:
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                regressions = compare_with_baseline(results, json.load(f), args.tolerance)
+            if regressions and args.fail_on_regression:
+                sys.exit(1)
+    elif args.command == 'startup':
+        result = bench_startup(args.module, args.top, args.window)
+        if result is None or result["heavy_modules"] or result["import_seconds"] > args.max_seconds:
+            sys.exit(1)
+    elif args.command == 'memory':
+        results = bench_memory(args.pdf, args.pages, args.window_size)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=4)
+            print(f"\n结果已保存到 {args.output}")
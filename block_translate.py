@@ -0,0 +1,365 @@
+"""
+按内容列表逐块翻译
+
+直接使用 pdf_parse.py 生成的 {name}_content_list.json，不再从拼接后的 Markdown 里用正则找公式和表格：
+只把文本块和标题块按令牌预算打包发送，每个块带有稳定的编号标记；公式、表格和图片原样保留。
+翻译完成后输出译文 Markdown 和译文内容列表 JSON（与原内容列表结构相同）。
+可以只翻译指定的页或章节。
+
+用法:
+    python block_translate.py output/paper_content_list.json --language 中文
+    python block_translate.py output/paper_content_list.json --pages 1-3,5
+    python block_translate.py output/paper_content_list.json --sections Introduction "Related Work"
+"""
+import os
+import re
+import sys
+import json
+import argparse
+
+from concurrent_translate import (
+    DEFAULT_CONCURRENCY, DEFAULT_MAX_RETRIES, DEFAULT_RPM, DEFAULT_TPM, RateLimiter, RetryPolicy, TranslationFailed,
+    format_failures, translate_chunks
+)
+from chunking import DEFAULT_MAX_INPUT_TOKENS, DEFAULT_MAX_OUTPUT_TOKENS, count_tokens, token_budget
+from translation_cache import DEFAULT_CACHE_PATH, TranslationCache
+from translation_journal import TranslationJournal, journal_path_for, plan_hash
+from translation_engine import TranslationEngine
+from metrics import NO_METRICS, add_metrics_arguments, metrics_from_args
+
+# 需要翻译的块类型（magic_pdf 的标题是带 text_level 的 text 块）
+TRANSLATABLE_TYPES = ("text", "title")
+
+# 块翻译使用的提示词版本，与 Markdown 翻译的缓存分开
+BLOCK_PROMPT_VERSION = "block-1"
+
+# 块编号标记，单独占一行
+BLOCK_MARKER = "<<<B{}>>>"
+BLOCK_MARKER_PATTERN = re.compile(r'^[ \t]*<<<B(\d+)>>>[ \t]*$', re.MULTILINE)
+
+CONTENT_LIST_SUFFIX = "_content_list.json"
+
+
+class BlockMismatch(ValueError):
+    """译文中的块标记与请求中的不一致（缺少、重复或多出）"""
+
+
+def block_system_prompt(target_language):
+    """块翻译的系统提示词"""
+    return (f"你是一个专业的学术翻译器。请将每个文本块翻译成{target_language}，保持学术风格和专业术语的准确性。"
+            f"每个文本块以单独一行的 <<<B编号>>> 标记开头，请原样保留所有标记及其顺序，只翻译标记之间的文本，"
+            f"不要合并、拆分或省略文本块。行内公式（$...$）保持不变。只输出翻译结果。")
+
+
+def parse_page_ranges(spec):
+    """把 "1-3,5" 形式的页码范围（从 1 开始）转换为从 0 开始的页序号集合"""
+    pages = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            pages.update(range(int(first) - 1, int(last)))
+        else:
+            pages.add(int(part) - 1)
+    return pages
+
+
+def title_level(block):
+    """标题块的层级，不是标题时返回 None"""
+    if block.get("type") == "title":
+        return block.get("text_level", 1)
+    if block.get("type") == "text" and block.get("text_level"):
+        return block["text_level"]
+    return None
+
+
+def is_translatable(block):
+    return block.get("type") in TRANSLATABLE_TYPES and bool(block.get("text", "").strip())
+
+
+def select_blocks(content_list, pages=None, sections=None):
+    """选出要处理的块
+
+    参数:
+        content_list (list): 内容列表
+        pages (set): 从 0 开始的页序号，为 None 时不按页筛选
+        sections (list): 章节标题关键字（不区分大小写），为 None 时不按章节筛选；
+                         标题匹配的章节一直持续到下一个同级或更高级的标题
+
+    返回:
+        list: 选中的块在内容列表中的序号
+    """
+    keywords = [keyword.lower() for keyword in sections] if sections else None
+    selected = []
+    section_level = None
+    for index, block in enumerate(content_list):
+        if pages is not None and block.get("page_idx") not in pages:
+            continue
+        if keywords is not None:
+            level = title_level(block)
+            if level is not None:
+                if section_level is not None and level <= section_level:
+                    section_level = None
+                if section_level is None and any(keyword in block.get("text", "").lower() for keyword in keywords):
+                    section_level = level
+            if section_level is None:
+                continue
+        selected.append(index)
+    return selected
+
+
+def batch_blocks(content_list, indices, budget):
+    """把要翻译的块按令牌预算打包，返回每批块序号的列表
+
+    单个块超出预算时单独成批。
+    """
+    batches = []
+    current, current_tokens = [], 0
+    for index in indices:
+        if not is_translatable(content_list[index]):
+            continue
+        tokens = count_tokens(content_list[index]["text"]) + count_tokens(BLOCK_MARKER.format(index))
+        if current and current_tokens + tokens > budget:
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def format_batch(content_list, batch):
+    """生成一批块的请求文本：每个块前加上单独一行的编号标记"""
+    return "\n\n".join(f"{BLOCK_MARKER.format(index)}\n{content_list[index]['text'].strip()}" for index in batch)
+
+
+def parse_batch(response, batch):
+    """从译文中按编号标记取出每个块的译文
+
+    返回:
+        dict: {块序号: 译文}
+
+    异常:
+        BlockMismatch: 标记与请求中的块不一致
+    """
+    matches = list(BLOCK_MARKER_PATTERN.finditer(response))
+    ids = [int(match.group(1)) for match in matches]
+    if ids != list(batch):
+        missing = sorted(set(batch) - set(ids))
+        extra = sorted(set(ids) - set(batch))
+        raise BlockMismatch(f"块标记不一致: 缺少 {missing}，多出 {extra}，共返回 {len(ids)}/{len(batch)} 个")
+    translations = {}
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(response)
+        translations[ids[i]] = response[match.end():end].strip()
+    return translations
+
+
+def batch_problems(request, response):
+    """检查一批块的译文中的编号标记，返回问题列表，标记与请求一致时为空列表
+
+    作为 TranslationEngine.translate_text 的 validator，标记不一致的回复不写入缓存。
+    """
+    try:
+        parse_batch(response, [int(match.group(1)) for match in BLOCK_MARKER_PATTERN.finditer(request)])
+    except BlockMismatch as e:
+        return [str(e)]
+    return []
+
+
+def render_markdown(content_list):
+    """把内容列表渲染为 Markdown"""
+    parts = []
+    for block in content_list:
+        block_type = block.get("type")
+        if block_type in TRANSLATABLE_TYPES:
+            text = block.get("text", "").strip()
+            if not text:
+                continue
+            level = title_level(block)
+            parts.append(f"{'#' * level} {text}" if level else text)
+        elif block_type == "equation":
+            parts.append(block.get("text", "").strip())
+        elif block_type == "image":
+            parts.append(f"![]({block['img_path']})" if block.get("img_path") else "")
+            parts.extend(" ".join(block.get(key) or []) for key in ("img_caption", "img_footnote"))
+        elif block_type == "table":
+            parts.append(" ".join(block.get("table_caption") or []))
+            if block.get("table_body"):
+                parts.append(block["table_body"])
+            elif block.get("img_path"):
+                parts.append(f"![]({block['img_path']})")
+            parts.append(" ".join(block.get("table_footnote") or []))
+    return "\n\n".join(part for part in parts if part) + "\n"
+
+
+def translate_content_list(content_list, translate_func, target_language="中文", model="",
+                           pages=None, sections=None, max_input_tokens=DEFAULT_MAX_INPUT_TOKENS,
+                           max_output_tokens=DEFAULT_MAX_OUTPUT_TOKENS, concurrency=DEFAULT_CONCURRENCY,
+                           limiter=None, retry_policy=None, on_chunk_done=None, cancel_event=None,
+                           metrics=NO_METRICS, journal=None):
+    """翻译内容列表中选中的文本块和标题块
+
+    参数:
+        content_list (list): 内容列表
+        translate_func (callable): 发送一批块的请求文本并返回译文的函数，应使用 block_system_prompt() 的提示词，
+                                   使用缓存时应以 batch_problems 作为校验函数，标记不一致的回复不写入缓存
+        target_language (str): 目标语言
+        model (str): 翻译模型，用于计算断点日志的计划哈希
+        pages (set): 只翻译这些页（从 0 开始），为 None 时翻译全部页
+        sections (list): 只翻译标题包含这些关键字的章节，为 None 时不按章节筛选
+        max_input_tokens (int): 每个请求的输入令牌上限
+        max_output_tokens (int): 每个请求的输出令牌上限
+        concurrency (int): 同时在途的请求数上限
+        limiter (RateLimiter): 限流器，为 None 时不限流
+        retry_policy (RetryPolicy): 重试策略
+        on_chunk_done (callable): 每完成一批时回调 on_chunk_done(已完成数, 总数)
+        cancel_event (threading.Event): 设置后停止翻译并抛出 Cancelled
+        metrics (RunMetrics): 运行指标
+        journal (TranslationJournal): 断点日志，为 None 时不记录
+
+    返回:
+        tuple: (选中范围内的译文内容列表, 失败的批次列表, 每批的请求文本列表)；
+               失败批次中的块保留原文，失败记录带有该批的块序号列表 "blocks"
+    """
+    selected = select_blocks(content_list, pages, sections)
+    batches = batch_blocks(content_list, selected, token_budget(target_language, max_input_tokens, max_output_tokens))
+    requests = [format_batch(content_list, batch) for batch in batches]
+    metrics.count("chunks", len(requests))
+    metrics.count("blocks", sum(len(batch) for batch in batches))
+
+    completed, on_result = {}, None
+    if journal is not None:
+        plan_id = plan_hash(requests, target_language, model, max_output_tokens)
+        completed = journal.completed(plan_id)
+        on_result = lambda index, translated: journal.record(plan_id, index, translated)
+        if completed:
+            metrics.count("resumed_chunks", len(completed))
+
+    def translate_batch(request):
+        response = translate_func(request)
+        # 标记不一致时按失败处理，整批保留原文
+        parse_batch(response, [int(match.group(1)) for match in BLOCK_MARKER_PATTERN.finditer(request)])
+        return response
+
+    failures = []
+    try:
+        responses = translate_chunks(requests, translate_batch, concurrency=concurrency, limiter=limiter,
+                                     on_chunk_done=on_chunk_done, cancel_event=cancel_event,
+                                     retry_policy=retry_policy, metrics=metrics,
+                                     completed=completed, on_result=on_result)
+    except TranslationFailed as e:
+        responses, failures = e.results, e.failures
+        for failure in failures:
+            failure["blocks"] = batches[failure["index"]]
+
+    translations = {}
+    for batch, response in zip(batches, responses):
+        translations.update(parse_batch(response, batch))
+
+    translated_list = []
+    for index in selected:
+        block = dict(content_list[index])
+        if index in translations:
+            block["text"] = translations[index]
+        translated_list.append(block)
+    return translated_list, failures, requests
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='按内容列表逐块翻译，公式、表格和图片原样保留')
+    parser.add_argument('content_list', help='pdf_parse.py 生成的 {name}_content_list.json')
+    parser.add_argument('--language', default='中文', help='目标语言 (默认为中文)')
+    parser.add_argument('--output_dir', default=None, help='输出目录 (默认与内容列表相同，图片路径保持有效)')
+    parser.add_argument('--pages', default=None, help='只翻译这些页，如 1-3,5 (页码从 1 开始)')
+    parser.add_argument('--sections', nargs='+', default=None, help='只翻译标题包含这些关键字的章节')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'同时在途的翻译请求数 (默认为{DEFAULT_CONCURRENCY})')
+    parser.add_argument('--rpm', type=int, default=DEFAULT_RPM,
+                        help=f'每分钟请求数上限，0 表示不限制 (默认为{DEFAULT_RPM})')
+    parser.add_argument('--tpm', type=int, default=DEFAULT_TPM,
+                        help='每分钟令牌数上限，0 表示不限制 (默认不限制)')
+    parser.add_argument('--max_input_tokens', type=int, default=DEFAULT_MAX_INPUT_TOKENS,
+                        help=f'每个请求的输入令牌上限 (默认为{DEFAULT_MAX_INPUT_TOKENS})')
+    parser.add_argument('--max_output_tokens', type=int, default=DEFAULT_MAX_OUTPUT_TOKENS,
+                        help=f'每个请求的输出令牌上限 (默认为{DEFAULT_MAX_OUTPUT_TOKENS})')
+    parser.add_argument('--max_retries', type=int, default=DEFAULT_MAX_RETRIES,
+                        help=f'每批失败后最多重试次数 (默认为{DEFAULT_MAX_RETRIES})')
+    parser.add_argument('--base_url', default=None,
+                        help='OpenAI 兼容服务的地址 (默认读取 OPENAI_BASE_URL 环境变量)')
+    parser.add_argument('--cache_path', default=DEFAULT_CACHE_PATH,
+                        help=f'翻译缓存文件路径 (默认为{DEFAULT_CACHE_PATH})')
+    parser.add_argument('--no_cache', action='store_true', help='不使用翻译缓存')
+    parser.add_argument('--no_resume', action='store_true', help='忽略上次中断留下的断点日志，从头翻译')
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    with open(args.content_list, 'r', encoding='utf-8') as f:
+        content_list = json.load(f)
+
+    base_name = os.path.basename(args.content_list)
+    if base_name.endswith(CONTENT_LIST_SUFFIX):
+        name_without_suff = base_name[:-len(CONTENT_LIST_SUFFIX)]
+    else:
+        name_without_suff = os.path.splitext(base_name)[0]
+    output_dir = args.output_dir or os.path.dirname(os.path.abspath(args.content_list))
+    os.makedirs(output_dir, exist_ok=True)
+    md_file_path = os.path.join(output_dir, f"{name_without_suff}_{args.language}.md")
+    json_file_path = os.path.join(output_dir, f"{name_without_suff}_{args.language}{CONTENT_LIST_SUFFIX}")
+
+    cache = None if args.no_cache else TranslationCache(args.cache_path)
+    engine = TranslationEngine(base_url=args.base_url, cache=cache, max_input_tokens=args.max_input_tokens,
+                               max_output_tokens=args.max_output_tokens)
+    metrics = metrics_from_args(args, "block_translate")
+    metrics.set_info(content_list=args.content_list, language=args.language, model=engine.model)
+
+    journal_path = journal_path_for(md_file_path)
+    if args.no_resume and os.path.exists(journal_path):
+        os.remove(journal_path)
+    journal = TranslationJournal(journal_path)
+
+    system_prompt = block_system_prompt(args.language)
+    with metrics.stage("translate"):
+        try:
+            translated_list, failures, requests = translate_content_list(
+                content_list,
+                lambda request: engine.translate_text(request, args.language, metrics, system_prompt,
+                                                      BLOCK_PROMPT_VERSION, validator=batch_problems),
+                target_language=args.language,
+                model=engine.model,
+                pages=parse_page_ranges(args.pages) if args.pages else None,
+                sections=args.sections,
+                max_input_tokens=args.max_input_tokens,
+                max_output_tokens=args.max_output_tokens,
+                concurrency=args.concurrency,
+                limiter=RateLimiter(rpm=args.rpm, tpm=args.tpm),
+                retry_policy=RetryPolicy(args.max_retries),
+                on_chunk_done=lambda done, total: print(f"已翻译 {done}/{total} 批..."),
+                metrics=metrics,
+                journal=journal,
+            )
+        finally:
+            journal.close()
+
+    with open(md_file_path, 'w', encoding='utf-8') as f:
+        f.write(render_markdown(translated_list))
+    with open(json_file_path, 'w', encoding='utf-8') as f:
+        json.dump(translated_list, f, ensure_ascii=False, indent=4)
+
+    if failures:
+        print(f"有 {len(failures)} 批重试后仍翻译失败，这些块保留了原文:")
+        for line in format_failures(failures, requests):
+            print(f"  {line}")
+    else:
+        journal.discard()
+    print(f"已翻译 {len(translated_list)} 个块，结果已保存到 {md_file_path} 和 {json_file_path}")
+
+    if args.metrics_file:
+        metrics.write_json(args.metrics_file)
+        print(f"运行指标已保存到 {args.metrics_file}")
+
+    if failures:
+        sys.exit(1)
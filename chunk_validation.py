@@ -0,0 +1,176 @@
+"""
+译文结构校验与定向重试
+
+系统提示词要求模型保留 [PROTECTED_ELEMENT_X] 占位符，但模型偶尔会丢掉、重复或改写占位符，
+restore_special_elements 随后就会悄悄丢失公式或表格。这里逐块把译文与发送的原文对照：
+- 占位符的集合（含出现次数）必须完全一致；
+- 标题的数量和层级必须一致；
+- 列表项的数量必须一致。
+
+不合格的块只对这一块重试：先用更严格的提示词重新翻译，仍不合格时拆成两半分别重试。
+额外的请求数受 RepairBudget 限制，预算用完或无法再拆分时抛出 InvalidTranslation，
+由 translate_chunks 把这一块记为失败并保留原文（原文中的占位符是完整的，公式和表格不会丢失）。
+TranslationEngine 写入缓存前用同样的 find_problems 检查，不合格的译文不会进入缓存。
+"""
+import re
+import threading
+from collections import Counter
+
+from chunking import split_sentences
+from metrics import NO_METRICS
+from special_elements import PLACEHOLDER_PATTERN
+from translation_cache import PROMPT_VERSION
+
+# 严格提示词的版本，作为缓存键的一部分，与普通提示词的译文分开缓存
+STRICT_PROMPT_VERSION = PROMPT_VERSION + "-strict"
+
+# 每个文档（所有目标语言合计）用于修复的额外请求数上限
+DEFAULT_REPAIR_BUDGET = 20
+# 用严格提示词仍不合格时最多对半拆分的层数
+DEFAULT_MAX_SPLIT_DEPTH = 2
+
+_HEADING_PATTERN = re.compile(r'^[ \t]*(#{1,6})[ \t]+\S', re.MULTILINE)
+_LIST_ITEM_PATTERN = re.compile(r'^[ \t]*(?:[-*+]|\d+[.)])[ \t]+\S', re.MULTILINE)
+_PARAGRAPH_SEPARATOR = re.compile(r'(\n\s*\n)')
+
+
+class InvalidTranslation(ValueError):
+    """修复预算用完后译文结构仍与原文不一致"""
+
+    def __init__(self, problems):
+        super().__init__("译文结构与原文不一致: " + "；".join(problems))
+        self.problems = problems
+
+
+def strict_system_prompt(target_language):
+    """译文结构不合格后重试使用的系统提示词"""
+    return (f"你是一个专业的学术翻译器。请将以下文本翻译成{target_language}，保持学术风格和专业术语的准确性。"
+            f"形如 [PROTECTED_ELEMENT_数字] 的占位符必须逐字原样保留：每个占位符出现且只出现一次，"
+            f"不要翻译、改写、合并、重复或删除占位符，也不要改变其中的数字。"
+            f"保持与原文完全相同的标题数量和层级（# 的个数）以及列表项数量，不要增加或删除段落。只输出翻译结果。")
+
+
+def structure_of(text):
+    """统计文本中的占位符、标题层级和列表项数量
+
+    返回:
+        dict: {"placeholders": 占位符编号计数, "headings": 标题层级列表, "list_items": 列表项数量}
+    """
+    return {
+        "placeholders": Counter(PLACEHOLDER_PATTERN.findall(text)),
+        "headings": [len(match.group(1)) for match in _HEADING_PATTERN.finditer(text)],
+        "list_items": len(_LIST_ITEM_PATTERN.findall(text)),
+    }
+
+
+def find_problems(source, translated):
+    """对照原文检查译文的结构
+
+    参数:
+        source (str): 发送给模型的原文块
+        translated (str): 模型返回的译文
+
+    返回:
+        list: 问题描述列表，译文合格时为空列表
+    """
+    expected = structure_of(source)
+    actual = structure_of(translated)
+    problems = []
+    missing = expected["placeholders"] - actual["placeholders"]
+    extra = actual["placeholders"] - expected["placeholders"]
+    if missing:
+        problems.append(f"缺少占位符 {sorted(map(int, missing.elements()))}")
+    if extra:
+        problems.append(f"多出或重复占位符 {sorted(map(int, extra.elements()))}")
+    if expected["headings"] != actual["headings"]:
+        problems.append(f"标题层级不一致（原文 {expected['headings']}，译文 {actual['headings']}）")
+    if expected["list_items"] != actual["list_items"]:
+        problems.append(f"列表项数量不一致（原文 {expected['list_items']}，译文 {actual['list_items']}）")
+    return problems
+
+
+def split_chunk(chunk):
+    """把文本块拆成大致相等的两半，优先在段落边界拆分，只有一个段落时在句子边界拆分
+
+    返回:
+        tuple: (前半部分, 分隔符, 后半部分)，无法拆分时返回 None；三者拼接即为原文
+    """
+    parts = _PARAGRAPH_SEPARATOR.split(chunk)
+    if len(parts) >= 3:
+        # 奇数位置是分隔符，在中间的分隔符处拆分
+        middle = len(parts) // 2
+        if middle % 2 == 0:
+            middle -= 1
+        return "".join(parts[:middle]), parts[middle], "".join(parts[middle + 1:])
+    sentences = split_sentences(chunk)
+    if len(sentences) < 2:
+        return None
+    middle = len(sentences) // 2
+    first, second = "".join(sentences[:middle]), "".join(sentences[middle:])
+    stripped = second.lstrip()
+    return first, second[:len(second) - len(stripped)], stripped
+
+
+class RepairBudget:
+    """修复译文时额外请求数的预算，可以被多个翻译线程共享"""
+
+    def __init__(self, max_requests=DEFAULT_REPAIR_BUDGET):
+        self.max_requests = max_requests
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def spend(self):
+        """预算充足时占用一次请求并返回 True"""
+        with self._lock:
+            if self.used >= self.max_requests:
+                return False
+            self.used += 1
+            return True
+
+
+class ValidatedTranslator:
+    """校验每个块的译文结构，只对不合格的块定向重试
+
+    参数:
+        translate_func (callable): 普通翻译函数 translate_func(文本, *其他参数)
+        strict_translate_func (callable): 使用严格提示词的翻译函数，参数与 translate_func 相同
+        budget (RepairBudget): 修复用的额外请求预算，为 None 时使用默认预算
+        metrics (RunMetrics): 记录不合格的块数、修复成功的块数和修复请求数
+        max_split_depth (int): 最多对半拆分的层数
+
+    实例可以直接作为 translate_chunks 的 translate_func 使用。
+    """
+
+    def __init__(self, translate_func, strict_translate_func, budget=None, metrics=NO_METRICS,
+                 max_split_depth=DEFAULT_MAX_SPLIT_DEPTH):
+        self.translate_func = translate_func
+        self.strict_translate_func = strict_translate_func
+        self.budget = budget or RepairBudget()
+        self.metrics = metrics
+        self.max_split_depth = max_split_depth
+
+    def __call__(self, chunk, *args):
+        translated = self.translate_func(chunk, *args)
+        problems = find_problems(chunk, translated)
+        if not problems:
+            return translated
+        self.metrics.count("invalid_chunks")
+        translated = self._repair(chunk, args, problems, 0)
+        self.metrics.count("repaired_chunks")
+        return translated
+
+    def _repair(self, chunk, args, problems, depth):
+        """用严格提示词重新翻译；仍不合格时拆成两半分别修复"""
+        if not self.budget.spend():
+            raise InvalidTranslation(problems + ["修复预算已用完"])
+        self.metrics.count("repair_requests")
+        translated = self.strict_translate_func(chunk, *args)
+        problems = find_problems(chunk, translated)
+        if not problems:
+            return translated
+        halves = split_chunk(chunk) if depth < self.max_split_depth else None
+        if halves is None:
+            raise InvalidTranslation(problems)
+        first, separator, second = halves
+        return (self._repair(first, args, problems, depth + 1) + separator
+                + self._repair(second, args, problems, depth + 1))
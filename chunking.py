@@ -0,0 +1,180 @@
+"""
+按令牌数打包文本块
+
+用本地分词器统计令牌数，把段落尽量装满每个请求的输入/输出令牌预算：
+- 预算取输入上限与"输出上限 / 目标语言的令牌膨胀系数"中的较小者，
+  避免中日韩等语言的译文超出 max_tokens 被截断；
+- 超出预算的单个段落在句子边界处拆分，占位符始终跟随它所在的句子；
+- 可以预先统计请求数和令牌数，便于估算一份文档需要多少次 API 调用。
+"""
+import re
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# 默认令牌预算
+DEFAULT_MAX_INPUT_TOKENS = 6000   # 每个请求的输入令牌上限
+DEFAULT_MAX_OUTPUT_TOKENS = 4096  # 每个请求的输出令牌上限（即 API 的 max_tokens）
+OUTPUT_SAFETY_MARGIN = 0.9        # 输出预算只使用 90%，为估算误差留出余量
+
+# 译文令牌数与原文令牌数之比（以英文原文、cl100k_base 分词为基准的经验值）
+OUTPUT_TOKEN_RATIOS = {
+    "中文": 1.3,
+    "日文": 1.5,
+    "韩文": 1.6,
+    "俄文": 1.5,
+}
+DEFAULT_OUTPUT_TOKEN_RATIO = 1.2
+
+# 分词器使用的编码（gpt-4-turbo 使用 cl100k_base）
+TOKENIZER_ENCODING = "cl100k_base"
+
+# 没有分词器时的估算：CJK 字符大致按 1 个令牌计算，其余字符按 4 个字符 1 个令牌
+_CJK_PATTERN = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+
+# 句子边界：英文句末标点后跟空白，或中日文句末标点之后；后面紧跟占位符时不拆分
+_SENTENCE_BOUNDARY = re.compile(
+    r'(?<=[.!?])(?=\s)(?!\s*\[PROTECTED_ELEMENT_)|(?<=[。！？])(?!\s*\[PROTECTED_ELEMENT_)'
+)
+
+# 分词器只在第一次使用时加载；加载失败（未安装或无法下载词表）时记为 False，改用估算
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        _encoding = False
+        if tiktoken is not None:
+            try:
+                _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+            except Exception as e:
+                print(f"加载分词器失败，改用估算的令牌数: {e}")
+    return _encoding
+
+
+def estimate_tokens(text):
+    """在没有分词器时粗略估算文本的令牌数"""
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count) // 4 + 1
+
+
+def count_tokens(text):
+    """统计文本的令牌数，优先使用本地分词器"""
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+
+def output_token_ratio(target_language):
+    """返回目标语言的译文令牌膨胀系数"""
+    return OUTPUT_TOKEN_RATIOS.get(target_language, DEFAULT_OUTPUT_TOKEN_RATIO)
+
+
+def token_budget(target_language="中文", max_input_tokens=DEFAULT_MAX_INPUT_TOKENS,
+                 max_output_tokens=DEFAULT_MAX_OUTPUT_TOKENS):
+    """计算每个文本块的输入令牌预算
+
+    参数:
+        target_language (str): 目标语言
+        max_input_tokens (int): 每个请求的输入令牌上限
+        max_output_tokens (int): 每个请求的输出令牌上限
+
+    返回:
+        int: 每个文本块最多包含的令牌数
+    """
+    output_limited = int(max_output_tokens * OUTPUT_SAFETY_MARGIN / output_token_ratio(target_language))
+    return max(1, min(max_input_tokens, output_limited))
+
+
+def split_sentences(paragraph):
+    """在句子边界处拆分段落，拆分后的片段直接拼接即可还原段落"""
+    pieces = []
+    start = 0
+    for match in _SENTENCE_BOUNDARY.finditer(paragraph):
+        if match.start() > start:
+            pieces.append(paragraph[start:match.start()])
+            start = match.start()
+    pieces.append(paragraph[start:])
+    return pieces
+
+
+def _split_oversized(paragraph, budget):
+    """把超出预算的段落拆成不超过预算的片段（单个句子超出预算时再按行拆分）"""
+    pieces = []
+    for sentence in split_sentences(paragraph):
+        if count_tokens(sentence) > budget and "\n" in sentence:
+            lines = sentence.split("\n")
+            pieces.extend(line + "\n" for line in lines[:-1])
+            pieces.append(lines[-1])
+        else:
+            pieces.append(sentence)
+    return pieces
+
+
+def chunk_text(text, max_tokens=None, target_language="中文"):
+    """将文本按令牌数打包成适合 API 调用的块
+
+    按段落（空行）分割文本，把段落依次装入当前块，直到再加一段就会超出令牌预算。
+    超出预算的单个段落在句子边界处拆分后再装入。
+
+    参数:
+        text (str): 需要分割的文本
+        max_tokens (int): 每个块的令牌上限，为 None 时按目标语言计算默认预算
+        target_language (str): 目标语言，用于计算默认预算
+
+    返回:
+        list: 文本块列表
+    """
+    budget = max_tokens or token_budget(target_language)
+
+    chunks = []
+    current_parts = []
+    current_tokens = 0
+
+    def flush():
+        chunk = "".join(current_parts).strip()
+        if chunk:
+            chunks.append(chunk)
+
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph_tokens = count_tokens(paragraph)
+        if paragraph_tokens <= budget:
+            units = [(paragraph, paragraph_tokens)]
+        else:
+            units = [(piece, count_tokens(piece)) for piece in _split_oversized(paragraph, budget)]
+
+        for i, (unit, unit_tokens) in enumerate(units):
+            # 段落的第一个片段前需要段落分隔符，同一段落的后续片段直接拼接
+            separator = "\n\n" if i == 0 and current_parts else ""
+            if current_tokens + unit_tokens > budget and current_parts:
+                flush()
+                current_parts, current_tokens = [], 0
+                separator = ""
+            current_parts.append(separator + unit)
+            current_tokens += unit_tokens
+
+    flush()
+    return chunks
+
+
+def summarize_chunks(chunks, target_language="中文"):
+    """统计文本块的请求数和令牌数
+
+    参数:
+        chunks (list): 文本块列表
+        target_language (str): 目标语言，用于预测输出令牌数
+
+    返回:
+        dict: 请求数、输入令牌数和预测的输出令牌数
+    """
+    input_tokens = sum(count_tokens(chunk) for chunk in chunks)
+    return {
+        "requests": len(chunks),
+        "input_tokens": input_tokens,
+        "predicted_output_tokens": int(input_tokens * output_token_ratio(target_language)),
+    }
+
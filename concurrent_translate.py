@@ -0,0 +1,441 @@
+import time
+import queue
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from chunking import count_tokens
+from metrics import NO_METRICS
+
+# 默认并发与限流参数
+DEFAULT_CONCURRENCY = 4  # 同时在途的翻译请求数
+DEFAULT_RPM = 60         # 每分钟请求数上限
+DEFAULT_TPM = 0          # 每分钟令牌数上限，0 表示不限制
+
+# 默认重试参数
+DEFAULT_MAX_RETRIES = 5      # 每个文本块最多重试次数
+DEFAULT_BASE_DELAY = 1.0     # 第一次重试的退避上限（秒），之后每次翻倍
+DEFAULT_MAX_DELAY = 60.0     # 单次退避的最长时间（秒）
+
+# 可以重试的 HTTP 状态码：请求超时、冲突、限流和服务端错误
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+
+class Cancelled(Exception):
+    """任务被用户取消"""
+
+
+def check_cancelled(cancel_event):
+    """cancel_event 已设置时抛出 Cancelled"""
+    if cancel_event is not None and cancel_event.is_set():
+        raise Cancelled()
+
+
+class TranslationFailed(Exception):
+    """重试后仍有文本块翻译失败
+
+    results 中失败的块保留原文，failures 列出每个失败块的序号、错误和尝试次数。
+    """
+
+    def __init__(self, results, failures):
+        count = sum(map(len, failures.values())) if isinstance(failures, dict) else len(failures)
+        super().__init__(f"{count} 个文本块翻译失败")
+        self.results = results
+        self.failures = failures
+
+
+def status_code_of(error):
+    """取出 API 错误的 HTTP 状态码，没有时返回 None"""
+    status_code = getattr(error, "status_code", None)
+    if status_code is None and getattr(error, "response", None) is not None:
+        status_code = getattr(error.response, "status_code", None)
+    return status_code
+
+
+def retry_after_of(error):
+    """从错误响应的 Retry-After（或 retry-after-ms）头中取出建议的等待秒数，没有时返回 None"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            # HTTP 日期格式
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """判断错误是否可以重试，并计算带随机抖动的指数退避时间
+
+    限流（429）、服务端错误（5xx）、超时和连接错误可以重试；其余错误（如 400、401）直接失败。
+    服务端给出 Retry-After 时至少等待该时长。
+    """
+
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def is_retryable(self, error):
+        status_code = status_code_of(error)
+        if status_code is not None:
+            return status_code in RETRYABLE_STATUS_CODES or status_code >= 500
+        # 没有状态码的是网络层错误（openai 的 APIConnectionError、APITimeoutError 等）
+        return isinstance(error, (ConnectionError, TimeoutError)) or type(error).__name__ in (
+            "APIConnectionError", "APITimeoutError")
+
+    def is_throttle(self, error):
+        """是否是服务端过载的信号，需要降低并发"""
+        status_code = status_code_of(error)
+        return status_code is not None and (status_code == 429 or status_code >= 500)
+
+    def delay(self, attempt, error=None):
+        """第 attempt 次重试（从 0 开始）前的等待秒数：完全抖动的指数退避，且不少于 Retry-After"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        retry_after = retry_after_of(error) if error is not None else None
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+class AdaptiveConcurrency:
+    """按 AIMD 调整同时在途的请求数
+
+    每个请求成功后上限加 1/上限（约每一轮请求加 1），遇到限流或服务端错误时上限减半；
+    一次减半后的短时间内不再减半，避免同一批并发请求的失败把上限一路降到 1。
+    """
+
+    def __init__(self, max_limit, min_limit=1, cooldown=1.0):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = float(self.max_limit)
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self, cancel_event=None):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                check_cancelled(cancel_event)
+                self._condition.wait(timeout=0.5)
+            self.in_flight += 1
+
+    def release(self, success=True, throttled=False):
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                now = time.monotonic()
+                if now - self.last_decrease >= self.cooldown:
+                    self.limit = max(float(self.min_limit), self.limit / 2)
+                    self.last_decrease = now
+            elif success:
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class TokenBucket:
+    """令牌桶
+
+    容量为每分钟的配额，按固定速率连续补充。rate_per_minute 为 0 或 None 时不限制。
+    """
+
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute or 0)
+        self.tokens = self.capacity
+        self.refill_rate = self.capacity / 60.0  # 每秒补充的令牌数
+        self.updated_at = time.monotonic()
+
+    @property
+    def unlimited(self):
+        return self.capacity <= 0
+
+    def refill(self, now):
+        """按经过的时间补充令牌"""
+        if self.unlimited:
+            return
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_rate)
+        self.updated_at = now
+
+    def wait_time(self, amount):
+        """返回攒够 amount 个令牌还需要等待的秒数"""
+        if self.unlimited or self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_rate
+
+    def consume(self, amount):
+        if not self.unlimited:
+            self.tokens -= amount
+
+
+class RateLimiter:
+    """按每分钟请求数（RPM）和每分钟令牌数（TPM）限流
+
+    每个请求在发出前调用 acquire()，两个令牌桶都有余量时才放行，否则阻塞等待。
+    可以被多个工作线程共享。
+    """
+
+    def __init__(self, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM):
+        self.request_bucket = TokenBucket(rpm)
+        self.token_bucket = TokenBucket(tpm)
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=0, cancel_event=None):
+        """阻塞直到可以发出一个消耗 tokens 个令牌的请求，等待期间 cancel_event 被设置时抛出 Cancelled"""
+        # 单个请求超过整桶容量时按整桶计算，避免永远等不到
+        if not self.token_bucket.unlimited:
+            tokens = min(tokens, self.token_bucket.capacity)
+        while True:
+            check_cancelled(cancel_event)
+            with self._lock:
+                now = time.monotonic()
+                self.request_bucket.refill(now)
+                self.token_bucket.refill(now)
+                wait = max(self.request_bucket.wait_time(1), self.token_bucket.wait_time(tokens))
+                if wait <= 0:
+                    self.request_bucket.consume(1)
+                    self.token_bucket.consume(tokens)
+                    return
+            if cancel_event is not None:
+                cancel_event.wait(wait)
+            else:
+                time.sleep(wait)
+
+
+def translate_chunks(chunks, translate_func, concurrency=DEFAULT_CONCURRENCY, limiter=None,
+                     on_chunk_done=None, cancel_event=None, retry_policy=None, metrics=NO_METRICS,
+                     completed=None, on_result=None, text_of=None, keep_results=True):
+    """并发翻译文本块，输出顺序与输入顺序一致
+
+    使用有界线程池，同时在途的请求数按 AIMD 在 1 到 concurrency 之间调整，每个请求发出前先经过限流器。
+    失败的请求按重试策略退避后重试；重试用尽或错误不可重试的块在全部完成后通过 TranslationFailed 报告。
+
+    参数:
+        chunks (list): 文本块列表
+        translate_func (callable): 翻译单个文本块的函数，接收文本返回译文，失败时抛出异常
+        concurrency (int): 同时在途的请求数上限
+        limiter (RateLimiter): 限流器，为 None 时不限流
+        on_chunk_done (callable): 每完成一块（包括最终失败的块）时在调用线程中回调 on_chunk_done(已完成数, 总数)
+        cancel_event (threading.Event): 设置后不再发出新的请求，丢弃尚未开始的块并抛出 Cancelled
+        retry_policy (RetryPolicy): 重试策略，为 None 时使用默认策略
+        metrics (RunMetrics): 运行指标，记录重试、限流和失败的块数
+        completed (dict): 已经翻译好的块 {序号: 译文}，这些块不再发出请求（例如从断点日志恢复）
+        on_result (callable): 每个块翻译成功时在调用线程中回调 on_result(序号, 译文)，例如写入断点日志
+        text_of (callable): chunks 中的元素不是文本时，用它取出文本（用于预留令牌和失败时保留原文）
+        keep_results (bool): 为 False 时翻译成功的块交给 on_result 后不再保留（返回列表中为 None），
+                             由 on_result 边翻译边写出译文时不必把全部译文留在内存中
+
+    返回:
+        list: 与 chunks 一一对应的译文列表
+
+    异常:
+        TranslationFailed: 有文本块最终失败，异常中带有其余块的译文（失败块为原文）
+        Cancelled: cancel_event 被设置
+    """
+    retry_policy = retry_policy or RetryPolicy()
+    text_of = text_of or (lambda chunk: chunk)
+    adaptive = AdaptiveConcurrency(concurrency)
+    results = [None] * len(chunks)
+    failures = []
+    completed = completed or {}
+    for index, translated in completed.items():
+        results[index] = translated
+    pending = [i for i in range(len(chunks)) if i not in completed]
+
+    def wait(seconds):
+        if cancel_event is not None:
+            cancel_event.wait(seconds)
+        else:
+            time.sleep(seconds)
+
+    def worker(chunk):
+        for attempt in range(retry_policy.max_retries + 1):
+            check_cancelled(cancel_event)
+            adaptive.acquire(cancel_event)
+            try:
+                if limiter is not None:
+                    # 预留输入和大致等量的输出令牌
+                    limiter.acquire(count_tokens(text_of(chunk)) * 2, cancel_event)
+                check_cancelled(cancel_event)
+                translated = translate_func(chunk)
+            except Cancelled:
+                adaptive.release(success=False)
+                raise
+            except Exception as e:
+                throttled = retry_policy.is_throttle(e)
+                adaptive.release(success=False, throttled=throttled)
+                if throttled:
+                    metrics.count("api_throttled")
+                if not retry_policy.is_retryable(e) or attempt == retry_policy.max_retries:
+                    return None, e, attempt + 1
+                metrics.count("api_retries")
+                wait(retry_policy.delay(attempt, e))
+                continue
+            adaptive.release(success=True)
+            return translated, None, attempt + 1
+
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+    try:
+        futures = {executor.submit(worker, chunks[i]): i for i in pending}
+        for done, future in enumerate(as_completed(futures), len(completed) + 1):
+            index = futures[future]
+            translated, error, attempts = future.result()
+            check_cancelled(cancel_event)
+            if error is None:
+                if keep_results:
+                    results[index] = translated
+                if on_result:
+                    on_result(index, translated)
+            else:
+                results[index] = text_of(chunks[index])
+                failures.append({"index": index, "error": f"{type(error).__name__}: {error}", "attempts": attempts})
+            if on_chunk_done:
+                on_chunk_done(done, len(chunks))
+    finally:
+        # 出错或取消时丢弃尚未开始的块，只等待已在途的请求结束
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    metrics.set_info(final_concurrency_limit=int(adaptive.limit))
+    if failures:
+        failures.sort(key=lambda failure: failure["index"])
+        metrics.count("failed_chunks", len(failures))
+        raise TranslationFailed(results, failures)
+
+    return results
+
+
+def translate_chunks_for_languages(chunks, languages, translate_func, concurrency=DEFAULT_CONCURRENCY, limiter=None,
+                                  on_chunk_done=None, cancel_event=None, retry_policy=None, metrics=NO_METRICS,
+                                  completed=None, on_result=None, keep_results=True):
+    """把同一组文本块翻译成多个目标语言
+
+    所有语言的请求放进同一个队列，共享同一组并发控制、限流器和重试策略；
+    按语言依次排队，先排队的语言先完成。
+
+    参数:
+        chunks (list): 文本块列表，所有语言共用
+        languages (list): 目标语言列表
+        translate_func (callable): translate_func(文本块, 目标语言) 返回译文，失败时抛出异常
+        on_chunk_done (callable): 每完成一个请求时回调 on_chunk_done(已完成数, 所有语言的请求总数)
+        completed (dict): 已经翻译好的块 {目标语言: {序号: 译文}}
+        on_result (callable): 每个块翻译成功时回调 on_result(目标语言, 序号, 译文)
+        其余参数同 translate_chunks
+
+    返回:
+        dict: {目标语言: 与 chunks 一一对应的译文列表}
+
+    异常:
+        TranslationFailed: 有文本块最终失败，results 和 failures 都是按目标语言的字典，failures 中的序号是块序号
+        Cancelled: cancel_event 被设置
+    """
+    tasks = [(language, index) for language in languages for index in range(len(chunks))]
+    completed = completed or {}
+    task_completed = {task_index: completed[language][index]
+                      for task_index, (language, index) in enumerate(tasks)
+                      if index in completed.get(language, {})}
+
+    failures = []
+    try:
+        results = translate_chunks(
+            tasks,
+            lambda task: translate_func(chunks[task[1]], task[0]),
+            concurrency=concurrency,
+            limiter=limiter,
+            on_chunk_done=on_chunk_done,
+            cancel_event=cancel_event,
+            retry_policy=retry_policy,
+            metrics=metrics,
+            completed=task_completed,
+            on_result=(lambda task_index, translated: on_result(*tasks[task_index], translated)) if on_result else None,
+            text_of=lambda task: chunks[task[1]],
+            keep_results=keep_results,
+        )
+    except TranslationFailed as e:
+        results, failures = e.results, e.failures
+
+    count = len(chunks)
+    results_by_language = {language: results[i * count:(i + 1) * count] for i, language in enumerate(languages)}
+    if failures:
+        failures_by_language = {language: [] for language in languages}
+        for failure in failures:
+            language, index = tasks[failure["index"]]
+            failures_by_language[language].append(dict(failure, index=index))
+        raise TranslationFailed(results_by_language, failures_by_language)
+    return results_by_language
+
+
+def format_failures(failures, chunks, preview_length=60):
+    """把失败的文本块整理成便于阅读的行：序号、开头的内容、尝试次数和错误"""
+    lines = []
+    for failure in failures:
+        preview = " ".join(chunks[failure["index"]].split())[:preview_length]
+        lines.append(f"第 {failure['index'] + 1} 块（尝试 {failure['attempts']} 次）: {failure['error']} | {preview}")
+    return lines
+
+
+def iter_in_background(iterable, prefetch=2):
+    """在后台线程中运行迭代器，使生产与消费重叠进行
+
+    后台线程最多提前生产 prefetch 个结果；生产过程中的异常会在消费端重新抛出。
+    消费端提前停止（break、异常或关闭返回的生成器）时通知后台线程，后台线程在生产完当前结果后退出，
+    并在后台线程中关闭 iterable，执行其中的清理代码（如关闭 PDF 文档、等待图片写出）。
+
+    参数:
+        iterable (iterable): 生产结果的迭代器，例如逐窗口解析 PDF 的生成器
+        prefetch (int): 队列中最多缓存的结果数
+
+    返回:
+        generator: 按原顺序产出 iterable 的结果
+    """
+    done = object()
+    results = queue.Queue(maxsize=max(1, prefetch))
+    stop = threading.Event()
+
+    def put(entry):
+        # 队列满时定期检查消费端是否已经停止，停止后丢弃结果并返回 False
+        while not stop.is_set():
+            try:
+                results.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def producer():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put((item, None)):
+                    return
+        except BaseException as e:
+            put((None, e))
+            return
+        finally:
+            # 生成器只能在运行它的线程中关闭
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+        put((done, None))
+
+    threading.Thread(target=producer, daemon=True).start()
+    try:
+        while True:
+            item, error = results.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
@@ -0,0 +1,249 @@
+"""
+翻译前估算请求数、令牌数、费用和耗时（不调用 API）
+
+对每个文档执行与正式翻译相同的特殊元素保护、去重和分块，在本地统计令牌数，
+再按模型单价算出费用，按并发数和 RPM/TPM 限流算出大致耗时。
+
+耗时取以下三者中最长的：
+- 请求数受 RPM 限制所需的时间（令牌桶开始时是满的，第一分钟的配额可以立即用掉）；
+- 预留的令牌数受 TPM 限制所需的时间（每个请求按输入令牌数的两倍预留，与 translate_chunks 一致）；
+- 按每个请求的固定延迟加上输出令牌的生成时间，并发数个请求同时进行所需的时间。
+不包括解析 PDF 的时间，也不考虑翻译缓存命中和失败重试。每个文档按单独去重计算：批量处理时跨文档复用的
+段落译文只来自翻译缓存，只会减少请求，因此估算值是上限。
+
+估算 PDF 时优先使用已经解析出的 Markdown，没有时用 PyMuPDF 提取的文本近似（不含公式和表格的结构，结果偏低）。
+
+用法:
+    python cost_estimate.py docs/ --language 中文 日文 --concurrency 8 --rpm 500
+    python cost_estimate.py "docs/**/*.md" --model gpt-4o --workers 8
+"""
+import os
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from concurrent_translate import DEFAULT_CONCURRENCY, DEFAULT_RPM, DEFAULT_TPM
+from chunking import DEFAULT_MAX_INPUT_TOKENS, DEFAULT_MAX_OUTPUT_TOKENS, count_tokens, output_token_ratio
+from translation_engine import DEFAULT_MODEL, TranslationEngine, default_system_prompt
+
+# 各模型每百万令牌的价格（美元）：(输入, 输出)
+MODEL_PRICES = {
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "gpt-3.5-turbo": (0.5, 1.5),
+}
+
+# 每条消息的格式开销令牌数（角色标记等），每个请求有系统和用户两条消息
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 估算耗时使用的默认值：每个请求的固定延迟（秒）和每秒生成的输出令牌数
+DEFAULT_REQUEST_LATENCY = 1.0
+DEFAULT_OUTPUT_TOKENS_PER_SECOND = 50
+
+# 文件数达到该值时用多进程估算
+PARALLEL_THRESHOLD = 16
+
+
+def estimate_markdown(content, target_languages, max_input_tokens=DEFAULT_MAX_INPUT_TOKENS,
+                      max_output_tokens=DEFAULT_MAX_OUTPUT_TOKENS, dedup=True):
+    """统计一段 Markdown 翻译成各目标语言需要的请求数和令牌数
+
+    返回:
+        dict: 所有语言合计的 requests、input_tokens、output_tokens（预测值），
+              限流器预留的令牌数 reserved_tokens，以及 languages: {目标语言: 同样三项}
+    """
+    engine = TranslationEngine(max_input_tokens=max_input_tokens, max_output_tokens=max_output_tokens)
+    chunks = engine.prepare_markdown(content, target_languages, dedup=dedup)[0]
+    chunk_tokens = sum(count_tokens(chunk) for chunk in chunks)
+
+    estimate = {"requests": 0, "input_tokens": 0, "output_tokens": 0, "languages": {}}
+    for language in target_languages:
+        prompt_tokens = count_tokens(default_system_prompt(language)) + 2 * MESSAGE_OVERHEAD_TOKENS
+        language_estimate = {
+            "requests": len(chunks),
+            "input_tokens": chunk_tokens + prompt_tokens * len(chunks),
+            "output_tokens": int(chunk_tokens * output_token_ratio(language)),
+        }
+        estimate["languages"][language] = language_estimate
+        for key, value in language_estimate.items():
+            estimate[key] += value
+    # 限流器按每块输入令牌数的两倍预留
+    estimate["reserved_tokens"] = 2 * chunk_tokens * len(target_languages)
+    return estimate
+
+
+def estimate_cost(input_tokens, output_tokens, model=DEFAULT_MODEL, prices=None):
+    """按模型单价计算费用（美元），没有该模型的单价时返回 None"""
+    price = prices or MODEL_PRICES.get(model)
+    if price is None:
+        return None
+    return (input_tokens * price[0] + output_tokens * price[1]) / 1_000_000
+
+
+def estimate_seconds(requests, output_tokens, reserved_tokens, concurrency=DEFAULT_CONCURRENCY, rpm=DEFAULT_RPM,
+                     tpm=DEFAULT_TPM, request_latency=DEFAULT_REQUEST_LATENCY,
+                     output_tokens_per_second=DEFAULT_OUTPUT_TOKENS_PER_SECOND):
+    """估算在并发数和限流下完成所有请求需要的秒数"""
+    if not requests:
+        return 0.0
+    rpm_seconds = max(0, requests - rpm) / rpm * 60 if rpm else 0.0
+    tpm_seconds = max(0, reserved_tokens - tpm) / tpm * 60 if tpm else 0.0
+    busy_seconds = requests * request_latency + output_tokens / output_tokens_per_second
+    concurrency_seconds = busy_seconds / max(1, min(concurrency, requests))
+    return max(rpm_seconds, tpm_seconds, concurrency_seconds)
+
+
+def read_document(path, parsed_dir=None):
+    """读取要估算的文档内容
+
+    参数:
+        path (str): Markdown 或 PDF 文件路径
+        parsed_dir (str): 批量处理的输出目录，PDF 已解析时 Markdown 位于 parsed_dir/<文件名>/<文件名>.md
+
+    返回:
+        tuple: (文本内容, 来源)，来源为 markdown、parsed（已解析的 Markdown）或 pdf_text（近似）
+    """
+    if not path.lower().endswith(".pdf"):
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read(), "markdown"
+    name_without_suff = os.path.splitext(os.path.basename(path))[0]
+    if parsed_dir:
+        md_file_path = os.path.join(parsed_dir, name_without_suff, f"{name_without_suff}.md")
+        if os.path.exists(md_file_path):
+            with open(md_file_path, 'r', encoding='utf-8') as f:
+                return f.read(), "parsed"
+    import fitz
+
+    with fitz.open(path) as doc:
+        return "\n\n".join(page.get_text() for page in doc), "pdf_text"
+
+
+def _estimate_file(task):
+    """在工作进程中估算一个文件，读取失败时返回带 error 的记录"""
+    path, target_languages, max_input_tokens, max_output_tokens, dedup, parsed_dir = task
+    try:
+        content, source = read_document(path, parsed_dir)
+    except Exception as e:
+        return {"file": path, "error": str(e)}
+    estimate = estimate_markdown(content, target_languages, max_input_tokens, max_output_tokens, dedup)
+    return dict(estimate, file=path, source=source)
+
+
+def estimate_files(paths, target_languages, max_input_tokens=DEFAULT_MAX_INPUT_TOKENS,
+                   max_output_tokens=DEFAULT_MAX_OUTPUT_TOKENS, dedup=True, workers=None, parsed_dir=None):
+    """估算多个 Markdown 或 PDF 文件，文件较多时用多进程并行分块和统计令牌
+
+    返回:
+        list: 与 paths 一一对应的估算记录（见 estimate_markdown，另有 file 和 source；读取失败时只有 file 和 error）
+    """
+    tasks = [(path, list(target_languages), max_input_tokens, max_output_tokens, dedup, parsed_dir)
+             for path in paths]
+    if len(tasks) < PARALLEL_THRESHOLD or workers == 1:
+        return [_estimate_file(task) for task in tasks]
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_estimate_file, tasks, chunksize=max(1, len(tasks) // (workers * 4))))
+
+
+def summarize_estimates(estimates, model=DEFAULT_MODEL, prices=None, concurrency=DEFAULT_CONCURRENCY,
+                        rpm=DEFAULT_RPM, tpm=DEFAULT_TPM, request_latency=DEFAULT_REQUEST_LATENCY,
+                        output_tokens_per_second=DEFAULT_OUTPUT_TOKENS_PER_SECOND, workers=1):
+    """给每个估算记录加上费用和耗时，并返回合计
+
+    每个文档的耗时按单独翻译它计算；合计按所有请求共用同一组限流计算，
+    workers 个进程同时处理文档时并发数为 concurrency × workers。
+
+    返回:
+        dict: 合计的 documents、requests、input_tokens、output_tokens、cost、seconds
+    """
+    timing = dict(concurrency=concurrency, rpm=rpm, tpm=tpm, request_latency=request_latency,
+                  output_tokens_per_second=output_tokens_per_second)
+    total = {"documents": 0, "requests": 0, "input_tokens": 0, "output_tokens": 0, "reserved_tokens": 0}
+    for estimate in estimates:
+        if "error" in estimate:
+            continue
+        estimate["cost"] = estimate_cost(estimate["input_tokens"], estimate["output_tokens"], model, prices)
+        estimate["seconds"] = estimate_seconds(estimate["requests"], estimate["output_tokens"],
+                                               estimate["reserved_tokens"], **timing)
+        total["documents"] += 1
+        for key in ("requests", "input_tokens", "output_tokens", "reserved_tokens"):
+            total[key] += estimate[key]
+    total["cost"] = estimate_cost(total["input_tokens"], total["output_tokens"], model, prices)
+    timing["concurrency"] = concurrency * max(1, workers)
+    total["seconds"] = estimate_seconds(total["requests"], total["output_tokens"], total["reserved_tokens"], **timing)
+    return total
+
+
+def format_estimate(estimate):
+    """把一条估算（或合计）整理成一行文字"""
+    cost = "未知单价" if estimate["cost"] is None else f"${estimate['cost']:.2f}"
+    return (f"{estimate['requests']} 个请求，输入约 {estimate['input_tokens']} 令牌，"
+            f"输出约 {estimate['output_tokens']} 令牌，{cost}，约 {estimate['seconds'] / 60:.1f} 分钟")
+
+
+def print_estimates(estimates, total, show_documents=True):
+    """打印每个文档和合计的估算"""
+    if show_documents:
+        for estimate in estimates:
+            name = estimate["file"]
+            if "error" in estimate:
+                print(f"{name}: 读取失败: {estimate['error']}")
+            else:
+                note = "（按 PDF 文本近似）" if estimate.get("source") == "pdf_text" else ""
+                print(f"{name}: {format_estimate(estimate)}{note}")
+    print(f"合计 {total['documents']} 个文档: {format_estimate(total)}")
+
+
+def add_estimate_arguments(parser):
+    """添加估算费用和耗时使用的命令行参数"""
+    parser.add_argument('--model', default=DEFAULT_MODEL, help=f'翻译使用的模型，按该模型的单价估算费用 (默认为{DEFAULT_MODEL})')
+    parser.add_argument('--price', type=float, nargs=2, metavar=('INPUT', 'OUTPUT'), default=None,
+                        help='每百万输入、输出令牌的价格（美元），覆盖内置的模型单价')
+    parser.add_argument('--request_latency', type=float, default=DEFAULT_REQUEST_LATENCY,
+                        help=f'估算耗时时每个请求的固定延迟秒数 (默认为{DEFAULT_REQUEST_LATENCY})')
+    parser.add_argument('--output_tokens_per_second', type=float, default=DEFAULT_OUTPUT_TOKENS_PER_SECOND,
+                        help=f'估算耗时时每秒生成的输出令牌数 (默认为{DEFAULT_OUTPUT_TOKENS_PER_SECOND})')
+
+
+def find_markdown_files(sources):
+    """列出目录中（递归）的 Markdown 文件，或展开通配符"""
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            pattern = os.path.join(source, "**", "*.md")
+        else:
+            pattern = source
+        paths.extend(path for path in glob.glob(pattern, recursive=True) if path.lower().endswith(".md"))
+    return sorted(set(paths))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='估算翻译 Markdown 文件的请求数、令牌数、费用和耗时，不调用 API')
+    parser.add_argument('sources', nargs='+', help='Markdown 文件、目录（递归查找 .md）或通配符')
+    parser.add_argument('--language', nargs='+', default=['中文'], help='目标语言，可以指定多个 (默认为中文)')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'同时在途的翻译请求数 (默认为{DEFAULT_CONCURRENCY})')
+    parser.add_argument('--rpm', type=int, default=DEFAULT_RPM,
+                        help=f'每分钟请求数上限，0 表示不限制 (默认为{DEFAULT_RPM})')
+    parser.add_argument('--tpm', type=int, default=DEFAULT_TPM,
+                        help='每分钟令牌数上限，0 表示不限制 (默认不限制)')
+    parser.add_argument('--max_input_tokens', type=int, default=DEFAULT_MAX_INPUT_TOKENS,
+                        help=f'每个请求的输入令牌上限 (默认为{DEFAULT_MAX_INPUT_TOKENS})')
+    parser.add_argument('--max_output_tokens', type=int, default=DEFAULT_MAX_OUTPUT_TOKENS,
+                        help=f'每个请求的输出令牌上限 (默认为{DEFAULT_MAX_OUTPUT_TOKENS})')
+    parser.add_argument('--no_dedup', action='store_true', help='不对重复段落去重')
+    parser.add_argument('--workers', type=int, default=None, help='估算使用的进程数 (默认为 CPU 核数)')
+    parser.add_argument('--summary_only', action='store_true', help='只打印合计')
+    add_estimate_arguments(parser)
+    args = parser.parse_args()
+
+    paths = find_markdown_files(args.sources)
+    if not paths:
+        parser.error(f"没有找到 Markdown 文件: {' '.join(args.sources)}")
+
+    estimates = estimate_files(paths, args.language, args.max_input_tokens, args.max_output_tokens,
+                               dedup=not args.no_dedup, workers=args.workers)
+    total = summarize_estimates(estimates, args.model, args.price, args.concurrency, args.rpm, args.tpm,
+                                args.request_latency, args.output_tokens_per_second)
+    print_estimates(estimates, total, show_documents=not args.summary_only)
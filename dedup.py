@@ -0,0 +1,211 @@
+"""
+重复段落去重
+
+论文和报告中有大量重复文本：解析后残留的页眉页脚、版权声明、重复的图注和相同的参考文献条目。
+在分块之前把重复出现的段落换成占位符，每个不同的段落只翻译一次，翻译后再把译文填回每一处出现的位置。
+需要翻译的重复段落和其他文本一样按令牌预算打包成块（每个段落前加上它的占位符作为标记），
+不会因为去重增加请求数，过长的段落也会照常拆分；译文按标记拆回各个段落。
+
+重复段落的译文还会按段落写入翻译缓存。批量处理多个文档时，ParagraphRegistry 记录本批次中
+已经缓存了段落译文的段落（数量有上限），后续文档中只出现一次的段落如果在记录中并且各目标语言都能
+在缓存中找到译文，就直接使用缓存的译文；找不到时留在原处和上下文一起翻译，不会单独发出请求。
+
+占位符沿用 special_elements 的格式，编号接在特殊元素之后，翻译提示词中已经要求保留这类占位符。
+"""
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+
+from chunking import count_tokens
+from special_elements import PLACEHOLDER_PATTERN, PLACEHOLDER_TEMPLATE
+from translation_cache import PROMPT_VERSION, normalize_text
+
+# 段落分隔符（保留在拆分结果中，以便原样拼回）
+_PARAGRAPH_SEPARATOR = re.compile(r'(\n\s*\n)')
+_WHITESPACE = re.compile(r'\s+')
+
+# 按段落缓存的重复段落译文使用的提示词版本，与按块缓存的译文分开
+PARAGRAPH_PROMPT_VERSION = PROMPT_VERSION + "-paragraph"
+
+# ParagraphRegistry 最多记录的段落数，超出时丢弃最久未用到的
+DEFAULT_REGISTRY_SIZE = 10000
+
+
+def paragraph_key(paragraph):
+    """规范化段落（统一换行和空白）后计算哈希"""
+    normalized = _WHITESPACE.sub(" ", normalize_text(paragraph))
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def needs_translation(paragraph):
+    """段落中除占位符外是否还有文字"""
+    return bool(PLACEHOLDER_PATTERN.sub("", paragraph).strip())
+
+
+class ParagraphRegistry:
+    """记录本批次中已经缓存了段落译文的段落，可以被多个线程共享
+
+    每个批次（或任务队列的一轮处理）使用一个新的记录，最多记录 max_size 个段落，
+    超出时丢弃最久未用到的。
+    """
+
+    def __init__(self, max_size=DEFAULT_REGISTRY_SIZE):
+        self.max_size = max_size
+        self.keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            if key not in self.keys:
+                return False
+            self.keys.move_to_end(key)
+            return True
+
+    def __len__(self):
+        with self._lock:
+            return len(self.keys)
+
+    def update(self, keys):
+        with self._lock:
+            for key in keys:
+                self.keys[key] = True
+                self.keys.move_to_end(key)
+            while len(self.keys) > self.max_size:
+                self.keys.popitem(last=False)
+
+
+def deduplicate_paragraphs(text, base_index, registry=None, lookup=None):
+    """把重复出现的段落换成占位符
+
+    在本文档中出现两次及以上的段落会被替换，每个不同的段落只保留一份原文。
+    只出现一次的段落只有在 registry 中有记录、并且 lookup 能找到各目标语言的译文时才会被替换。
+
+    参数:
+        text (str): 已经用占位符保护了特殊元素的文本
+        base_index (int): 第一个占位符的编号，即特殊元素的数量
+        registry (ParagraphRegistry): 本批次已缓存段落译文的段落记录，为 None 时只在本文档内去重
+        lookup (callable): lookup(段落) 返回 {目标语言: 缓存的译文}，有语言找不到时返回 None
+
+    返回:
+        tuple: (替换后的文本, 被替换的段落列表, {段落序号: {目标语言: 缓存的译文}}, 统计信息)；
+               第 i 个段落对应占位符编号 base_index + i，有缓存译文的段落不需要翻译
+    """
+    parts = _PARAGRAPH_SEPARATOR.split(text)
+    # 奇数位置是分隔符，偶数位置是段落
+    keys = [paragraph_key(part) if i % 2 == 0 and needs_translation(part) else None
+            for i, part in enumerate(parts)]
+    counts = {}
+    for key in keys:
+        if key is not None:
+            counts[key] = counts.get(key, 0) + 1
+
+    ids = {}
+    repeated = []
+    known = {}
+    source_tokens = saved_tokens = 0
+    for i, key in enumerate(keys):
+        if key is None:
+            continue
+        paragraph = parts[i]
+        tokens = count_tokens(paragraph)
+        source_tokens += tokens
+        if counts[key] < 2:
+            # 之前的文档中出现过的段落只复用缓存的译文，没有缓存时和上下文一起翻译
+            if registry is None or lookup is None or key not in registry:
+                continue
+            translations = lookup(paragraph.strip())
+            if translations is None:
+                continue
+            known[len(repeated)] = translations
+            saved_tokens += tokens
+        if key in ids:
+            saved_tokens += tokens
+        else:
+            ids[key] = len(repeated)
+            repeated.append(paragraph.strip())
+        # 保留段落首尾的空白，只替换正文
+        stripped = paragraph.strip()
+        start = paragraph.find(stripped)
+        parts[i] = (paragraph[:start] + PLACEHOLDER_TEMPLATE.format(base_index + ids[key])
+                    + paragraph[start + len(stripped):])
+
+    stats = {
+        "paragraphs": sum(counts.values()),
+        "unique_paragraphs": len(counts),
+        "repeated_paragraphs": len(repeated) - len(known),
+        "cached_paragraphs": len(known),
+        "source_tokens": source_tokens,
+        "saved_tokens": saved_tokens,
+        "dedup_ratio": round(saved_tokens / source_tokens, 4) if source_tokens else 0.0,
+    }
+    return "".join(parts), repeated, known, stats
+
+
+def pack_repeated(repeated, base_index, known=()):
+    """把需要翻译的重复段落拼成一段文本，由调用方按令牌预算分块
+
+    每个段落前单独一行放它的占位符作为标记，标记和段落之间没有空行，分块时不会被分开。
+
+    参数:
+        repeated (list): deduplicate_paragraphs 返回的段落列表
+        base_index (int): 第一个占位符的编号
+        known (dict): 已有缓存译文的段落序号，这些段落不需要翻译
+
+    返回:
+        str: 拼接后的文本，没有需要翻译的段落时为空字符串
+    """
+    return "\n\n".join(f"{PLACEHOLDER_TEMPLATE.format(base_index + i)}\n{paragraph}"
+                        for i, paragraph in enumerate(repeated) if i not in known)
+
+
+def unpack_repeated(translated_chunks, repeated, base_index):
+    """按标记把重复段落所在块的译文拆回各个段落
+
+    译文中找不到标记的段落（模型丢掉了标记）保留原文。
+
+    参数:
+        translated_chunks (list): pack_repeated 的文本分块后各块的译文，按原顺序排列
+        repeated (list): 重复段落列表
+        base_index (int): 第一个占位符的编号
+
+    返回:
+        tuple: (译文列表, 找到了标记的段落序号集合)；译文列表的第 i 项是第 i 个重复段落的译文
+    """
+    text = "\n\n".join(translated_chunks)
+    # 只取编号属于重复段落的标记，段落中特殊元素的占位符不受影响
+    markers = [match for match in PLACEHOLDER_PATTERN.finditer(text)
+               if 0 <= int(match.group(1)) - base_index < len(repeated)]
+    translations = list(repeated)
+    found = set()
+    for i, match in enumerate(markers):
+        index = int(match.group(1)) - base_index
+        if index in found:
+            continue
+        end = markers[i + 1].start() if i + 1 < len(markers) else len(text)
+        translations[index] = text[match.end():end].strip()
+        found.add(index)
+    return translations, found
+
+
+def restore_repeated(text, translations, base_index):
+    """把重复段落的占位符替换为译文，特殊元素的占位符保持不变
+
+    需要在 restore_special_elements 之前调用，因为段落译文中可能还包含特殊元素的占位符。
+    """
+    def replace(match):
+        index = int(match.group(1)) - base_index
+        if 0 <= index < len(translations):
+            return translations[index]
+        return match.group(0)
+
+    return PLACEHOLDER_PATTERN.sub(replace, text)
+
+
+def record_dedup_stats(metrics, stats):
+    """把去重统计累加到运行指标"""
+    metrics.count("dedup_paragraphs", stats["paragraphs"])
+    metrics.count("dedup_repeated_paragraphs", stats["repeated_paragraphs"])
+    metrics.count("dedup_cached_paragraphs", stats["cached_paragraphs"])
+    metrics.count("dedup_source_tokens", stats["source_tokens"])
+    metrics.count("dedup_saved_tokens", stats["saved_tokens"])
@@ -0,0 +1,147 @@
+"""
+本地模拟的 OpenAI 兼容服务，用于在不消耗 API 额度的情况下测量翻译流程的耗时。
+
+收到 /v1/chat/completions 请求后等待固定延迟，然后原样返回用户消息作为"译文"。
+设置 drop_placeholder_rate 时按该概率删掉回复中的第一个占位符，用于测试译文校验和定向重试。
+请求中 stream 为 true 时按 SSE 格式每 4 个字符发送一个增量，最后发送令牌用量。
+
+用法:
+    python fake_openai_server.py --port 8765 --latency 0.5
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=fake python translate_md.py paper.md
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+_PLACEHOLDER = re.compile(r'\[PROTECTED_ELEMENT_\d+\]')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        self.server.request_count += 1
+        time.sleep(self.server.latency)
+
+        # 把最后一条用户消息原样作为回复
+        content = ""
+        for message in request.get("messages", []):
+            if message.get("role") == "user":
+                content = message.get("content", "")
+        if random.random() < self.server.drop_placeholder_rate:
+            content = _PLACEHOLDER.sub("", content, count=1)
+        prompt_tokens = sum(len(m.get("content", "")) for m in request.get("messages", [])) // 4
+        completion_tokens = len(content) // 4
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        if request.get("stream"):
+            self._send_stream(request, content, usage)
+            return
+        body = json.dumps({
+            "id": f"chatcmpl-fake-{self.server.request_count}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        }).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, request, content, usage):
+        """按 SSE 格式逐段发送回复"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+
+        def send(choices, usage=None):
+            event = {
+                "id": f"chatcmpl-fake-{self.server.request_count}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": choices,
+                "usage": usage,
+            }
+            self.wfile.write(b"data: " + json.dumps(event).encode("utf-8") + b"\n\n")
+
+        for start in range(0, len(content), 4):
+            send([{"index": 0, "delta": {"content": content[start:start + 4]}, "finish_reason": None}])
+        send([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (request.get("stream_options") or {}).get("include_usage"):
+            send([], usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        # 不输出访问日志
+        pass
+
+
+class FakeOpenAIServer:
+    """在后台线程中运行的模拟服务，可用作上下文管理器"""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.5, drop_placeholder_rate=0.0):
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.latency = latency
+        self.httpd.drop_placeholder_rate = drop_placeholder_rate
+        self.httpd.request_count = 0
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def request_count(self):
+        return self.httpd.request_count
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='本地模拟的 OpenAI 兼容服务')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址 (默认为127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口 (默认为8765)')
+    parser.add_argument('--latency', type=float, default=0.5, help='每个请求的模拟延迟秒数 (默认为0.5)')
+    parser.add_argument('--drop_placeholder_rate', type=float, default=0.0,
+                        help='回复中删掉一个占位符的概率，用于测试译文校验 (默认为0)')
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(args.host, args.port, args.latency, args.drop_placeholder_rate)
+    print(f"模拟服务已启动: {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,164 @@
+"""
+异步、按内容寻址的图片写入器
+
+处理管道在裁剪每张图片和表格图像后调用 image_writer.write(文件名, 图片字节)，
+FileBasedDataWriter 在调用线程中同步写盘，而且按页号和位置命名，同一张图片（重复的徽标、
+在多页或多个文档中复用的插图）会被反复保存。这里的写入器：
+- write() 只计算内容哈希并提交到后台线程池就返回，重新编码和写盘在后台进行；
+- 按内容哈希命名文件，内容相同的图片只编码和保存一次；
+- 可以重新编码为指定质量的 JPEG 或 WebP；
+- 生成 Markdown、内容列表和中间 JSON 后，用 rewrite_links() 把处理管道给出的文件名换成实际保存的文件名，
+  图片链接仍然指向输出目录中的文件。
+
+提供 store_dir 时（例如批量处理的所有文档共用一个目录），图片只在 store_dir 中保存一份，
+各文档的图片目录中是指向它的硬链接（文件系统不支持硬链接时复制）。
+"""
+import io
+import os
+import re
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from metrics import NO_METRICS
+from parse_options import DEFAULT_IMAGE_FORMAT, DEFAULT_WEBP_QUALITY
+
+# 各格式的文件扩展名
+IMAGE_EXTENSIONS = {"jpeg": ".jpg", "webp": ".webp"}
+# 后台编码和写盘的线程数
+DEFAULT_IMAGE_WORKERS = 2
+
+
+class ContentAddressedImageWriter:
+    """在后台线程中编码并写入图片，按内容哈希去重
+
+    可以直接作为处理管道的 image_writer 使用（只需要 write 方法）。
+
+    参数:
+        image_dir (str): 图片输出目录，Markdown 中的图片链接指向这里
+        image_format (str): 保存格式，取值为 jpeg、webp
+        quality (int): 重新编码的质量（1-100）；jpeg 为 None 时直接保存处理管道编码的图片
+        store_dir (str): 多个文档共用的图片目录，为 None 时直接保存在 image_dir
+        workers (int): 后台线程数
+        metrics (RunMetrics): 运行指标，记录图片数和去重的图片数
+    """
+
+    def __init__(self, image_dir, image_format=DEFAULT_IMAGE_FORMAT, quality=None, store_dir=None,
+                 workers=DEFAULT_IMAGE_WORKERS, metrics=NO_METRICS):
+        if image_format not in IMAGE_EXTENSIONS:
+            raise ValueError(f"不支持的图片格式: {image_format}")
+        if image_format == "webp":
+            if Image is None:
+                raise ValueError("保存为 WebP 需要安装 Pillow")
+            quality = quality or DEFAULT_WEBP_QUALITY
+        self.image_dir = image_dir
+        self.image_format = image_format
+        self.quality = quality
+        self.store_dir = store_dir
+        self.metrics = metrics
+        os.makedirs(image_dir, exist_ok=True)
+        if store_dir:
+            os.makedirs(store_dir, exist_ok=True)
+        # 格式和质量参与哈希，不同设置编码出的文件不会重名
+        self._settings = f"{image_format}:{quality}".encode("utf-8")
+        self._names = {}    # 处理管道给出的文件名 -> 保存任务
+        self._stored = {}   # 内容哈希 -> 保存任务
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="image-writer")
+
+    def write(self, path, data):
+        """提交一张图片后立即返回，path 是处理管道给出的文件名（相对于 image_dir）"""
+        key = hashlib.sha256(self._settings + data).hexdigest()
+        with self._lock:
+            future = self._stored.get(key)
+            if future is None:
+                future = self._executor.submit(self._store, key, data)
+                self._stored[key] = future
+            else:
+                self.metrics.count("images_deduplicated")
+            self._names[path] = future
+        self.metrics.count("images")
+
+    def _encode(self, data):
+        if self.image_format == "jpeg":
+            if self.quality is None:
+                return data
+            import fitz  # 与处理管道使用相同的 JPEG 编码器
+
+            return fitz.Pixmap(data).tobytes("jpeg", jpg_quality=self.quality)
+        with Image.open(io.BytesIO(data)) as image:
+            output = io.BytesIO()
+            image.save(output, format="WEBP", quality=self.quality)
+            return output.getvalue()
+
+    def _store(self, key, data):
+        name = key + IMAGE_EXTENSIONS[self.image_format]
+        target = os.path.join(self.store_dir or self.image_dir, name)
+        if not os.path.exists(target):
+            # 先写临时文件再改名，其他线程或进程不会读到写了一半的文件
+            temp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(self._encode(data))
+            os.replace(temp_path, target)
+        if self.store_dir:
+            link_path = os.path.join(self.image_dir, name)
+            if not os.path.exists(link_path):
+                try:
+                    os.link(target, link_path)
+                except FileExistsError:
+                    pass
+                except OSError:
+                    shutil.copyfile(target, link_path)
+        return name
+
+    def flush(self):
+        """等待已提交的图片全部写完，返回 {处理管道给出的文件名: 实际保存的文件名}
+
+        有图片写入失败时抛出该错误。
+        """
+        with self._lock:
+            names = dict(self._names)
+        return {os.path.basename(path): future.result() for path, future in names.items()}
+
+    def _link_replacer(self):
+        """等待图片写完，返回把处理管道给出的文件名换成实际保存的文件名的函数"""
+        mapping = {name: stored for name, stored in self.flush().items() if name != stored}
+        if not mapping:
+            return lambda text: text
+        pattern = re.compile("|".join(map(re.escape, mapping)))
+        return lambda text: pattern.sub(lambda match: mapping[match.group(0)], text)
+
+    def rewrite_links(self, text):
+        """等待图片写完，把文本中处理管道给出的文件名换成实际保存的文件名"""
+        return self._link_replacer()(text)
+
+    def rewrite_content_list(self, content_list):
+        """替换内容列表中各项的图片路径（img_path），返回同一个列表"""
+        replace = self._link_replacer()
+        for item in content_list:
+            if item.get("img_path"):
+                item["img_path"] = replace(item["img_path"])
+        return content_list
+
+    def close(self):
+        """等待图片全部写完并停止后台线程"""
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            # 已经在处理其他异常时不再报告图片写入错误
+            self._executor.shutdown(wait=True)
@@ -0,0 +1,324 @@
+"""
+运行指标
+
+记录一次运行中各阶段的墙钟时间和 CPU 时间、计数器（页数、文本块数、令牌用量、缓存命中、重试次数等）
+和直方图（API 延迟），运行结束后写入 JSON 文件，也可以通过 HTTP 以 Prometheus 文本格式提供。
+可以对指定阶段开启 cProfile 或 tracemalloc，单独定位某个阶段的热点。
+两者都是进程级的状态，只在最外层请求它们的阶段开始和停止：嵌套在其中（或在其他线程同时进行）
+的阶段照常计时，但不再单独分析，避免内层阶段结束时停止外层阶段的测量。
+
+CPU 时间是整个进程的 CPU 时间，包含该阶段期间其他线程（例如并发翻译的线程池）消耗的时间。
+"""
+import os
+import json
+import time
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# API 延迟直方图的桶上界（秒）
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Prometheus 指标名前缀和默认端口
+METRIC_PREFIX = "pdf_translator"
+DEFAULT_METRICS_PORT = 9464
+
+# tracemalloc 报告中保留的分配位置数
+TRACEMALLOC_TOP = 10
+
+# 正在进行的 cProfile / tracemalloc 测量，同一时刻每种只能有一个阶段在测量
+_active_measurements = set()
+_measurements_lock = threading.Lock()
+
+
+def _claim_measurement(kind):
+    """没有其他阶段在进行 kind 测量时占用它并返回 True"""
+    with _measurements_lock:
+        if kind in _active_measurements:
+            return False
+        # tracemalloc 可能已经由调用方（如 benchmark.py）开启，不能在阶段结束时停止它
+        if kind == "tracemalloc" and tracemalloc.is_tracing():
+            return False
+        _active_measurements.add(kind)
+        return True
+
+
+def _release_measurement(kind):
+    with _measurements_lock:
+        _active_measurements.discard(kind)
+
+
+class Histogram:
+    """固定桶的直方图"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        for i, count in enumerate(other.bucket_counts):
+            self.bucket_counts[i] += count
+        self.sum += other.sum
+        self.count += other.count
+
+    def cumulative(self):
+        """返回 [(上界, 不超过该上界的观测数)]，最后一项上界为 +Inf"""
+        result, total = [], 0
+        for bound, count in zip(self.buckets, self.bucket_counts):
+            total += count
+            result.append((bound, total))
+        result.append((float("inf"), self.count))
+        return result
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else None,
+            "buckets": {("+Inf" if bound == float("inf") else str(bound)): count
+                        for bound, count in self.cumulative()},
+        }
+
+
+class RunMetrics:
+    """一次运行的指标，可在多个线程中同时记录
+
+    参数:
+        name (str): 运行名称，写入 JSON
+        profile_stages (iterable): 用 cProfile 分析的阶段名，结果写入 profile_dir/<阶段名>.prof
+        trace_memory_stages (iterable): 用 tracemalloc 统计内存峰值和主要分配位置的阶段名
+        profile_dir (str): cProfile 结果目录
+        enabled (bool): 为 False 时所有记录操作都不做任何事
+    """
+
+    def __init__(self, name="run", profile_stages=(), trace_memory_stages=(), profile_dir=".", enabled=True):
+        self.name = name
+        self.enabled = enabled
+        self.profile_stages = set(profile_stages)
+        self.trace_memory_stages = set(trace_memory_stages)
+        self.profile_dir = profile_dir
+        self.started_at = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.histograms = {}
+        self.memory = {}
+        self.info = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """记录一个阶段的耗时；同名阶段多次出现时累加"""
+        if not self.enabled:
+            yield
+            return
+
+        # 外层阶段已经在分析时，本阶段只计时
+        profiler = None
+        if name in self.profile_stages and _claim_measurement("cProfile"):
+            profiler = cProfile.Profile()
+            profiler.enable()
+        trace_memory = name in self.trace_memory_stages and _claim_measurement("tracemalloc")
+        if trace_memory:
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            if profiler is not None:
+                profiler.disable()
+                _release_measurement("cProfile")
+                os.makedirs(self.profile_dir, exist_ok=True)
+                profiler.dump_stats(os.path.join(self.profile_dir, f"{name}.prof"))
+            memory = None
+            if trace_memory:
+                top = tracemalloc.take_snapshot().statistics("lineno")[:TRACEMALLOC_TOP]
+                memory = {
+                    "peak_bytes": tracemalloc.get_traced_memory()[1],
+                    "top_allocations": [{"location": str(stat.traceback), "bytes": stat.size} for stat in top],
+                }
+                tracemalloc.stop()
+                _release_measurement("tracemalloc")
+            with self.lock:
+                stage = self.stages.setdefault(name, {"count": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0})
+                stage["count"] += 1
+                stage["wall_seconds"] += wall
+                stage["cpu_seconds"] += cpu
+                if memory is not None:
+                    self.memory[name] = memory
+
+    def count(self, name, value=1):
+        """累加计数器"""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS):
+        """向直方图记录一个观测值"""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.histograms.setdefault(name, Histogram(buckets)).observe(value)
+
+    def set_info(self, **info):
+        """记录运行的描述信息（文件名、目标语言等）"""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.info.update(info)
+
+    def merge(self, other):
+        """把另一次运行的阶段耗时、计数器和直方图累加到本对象"""
+        with self.lock, other.lock:
+            for name, stage in other.stages.items():
+                total = self.stages.setdefault(name, {"count": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0})
+                for key in total:
+                    total[key] += stage[key]
+            for name, value in other.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, histogram in other.histograms.items():
+                self.histograms.setdefault(name, Histogram(histogram.buckets)).merge(histogram)
+
+    def snapshot(self):
+        """返回可写入 JSON 的指标"""
+        with self.lock:
+            stages = {name: {"count": stage["count"],
+                             "wall_seconds": round(stage["wall_seconds"], 6),
+                             "cpu_seconds": round(stage["cpu_seconds"], 6)}
+                      for name, stage in self.stages.items()}
+            counters = dict(self.counters)
+            derived = {}
+            parse_seconds = self.stages.get("parse", {}).get("wall_seconds")
+            if counters.get("pages") and parse_seconds:
+                derived["pages_per_second"] = round(counters["pages"] / parse_seconds, 4)
+            lookups = counters.get("cache_hits", 0) + counters.get("cache_misses", 0)
+            if lookups:
+                derived["cache_hit_ratio"] = round(counters.get("cache_hits", 0) / lookups, 4)
+            if counters.get("dedup_source_tokens"):
+                derived["dedup_ratio"] = round(counters.get("dedup_saved_tokens", 0) / counters["dedup_source_tokens"], 4)
+            return {
+                "name": self.name,
+                "started_at": self.started_at,
+                "elapsed_seconds": round(time.time() - self.started_at, 3),
+                "info": dict(self.info),
+                "stages": stages,
+                "counters": counters,
+                "derived": derived,
+                "histograms": {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+                "memory": dict(self.memory),
+            }
+
+    def write_json(self, path):
+        """把指标写入 JSON 文件"""
+        if not self.enabled:
+            return
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=4)
+
+    def to_prometheus(self):
+        """按 Prometheus 文本格式输出指标"""
+        lines = []
+        with self.lock:
+            for kind in ("wall", "cpu"):
+                metric = f"{METRIC_PREFIX}_stage_{kind}_seconds_total"
+                lines.append(f"# TYPE {metric} counter")
+                for name, stage in sorted(self.stages.items()):
+                    lines.append(f'{metric}{{stage="{name}"}} {stage[f"{kind}_seconds"]}')
+            metric = f"{METRIC_PREFIX}_stage_runs_total"
+            lines.append(f"# TYPE {metric} counter")
+            for name, stage in sorted(self.stages.items()):
+                lines.append(f'{metric}{{stage="{name}"}} {stage["count"]}')
+            for name, value in sorted(self.counters.items()):
+                metric = f"{METRIC_PREFIX}_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {value}")
+            for name, histogram in sorted(self.histograms.items()):
+                metric = f"{METRIC_PREFIX}_{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                for bound, count in histogram.cumulative():
+                    le = "+Inf" if bound == float("inf") else bound
+                    lines.append(f'{metric}_bucket{{le="{le}"}} {count}')
+                lines.append(f"{metric}_sum {histogram.sum}")
+                lines.append(f"{metric}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+# 不记录任何内容的指标对象，用作未提供 metrics 参数时的默认值
+NO_METRICS = RunMetrics(enabled=False)
+
+
+class _PrometheusHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.get_metrics().to_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 不输出访问日志
+        pass
+
+
+def serve_prometheus(get_metrics, port=DEFAULT_METRICS_PORT, host="127.0.0.1"):
+    """在后台线程中通过 http://host:port/metrics 提供 Prometheus 文本格式的指标
+
+    参数:
+        get_metrics (callable): 每次请求时调用，返回要输出的 RunMetrics
+        port (int): 监听端口
+        host (str): 监听地址
+
+    返回:
+        ThreadingHTTPServer: 已启动的服务，调用 shutdown() 停止
+    """
+    httpd = ThreadingHTTPServer((host, port), _PrometheusHandler)
+    httpd.daemon_threads = True
+    httpd.get_metrics = get_metrics
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def add_metrics_arguments(parser):
+    """为命令行工具添加指标相关的参数"""
+    parser.add_argument('--metrics_file', default=None, help='运行结束后把指标写入该 JSON 文件')
+    parser.add_argument('--metrics_port', type=int, default=None,
+                        help='运行期间在该端口的 /metrics 以 Prometheus 文本格式提供指标')
+    parser.add_argument('--profile_stage', action='append', default=[],
+                        help='用 cProfile 分析的阶段名，可重复指定，结果写入 --profile_dir')
+    parser.add_argument('--trace_memory_stage', action='append', default=[],
+                        help='用 tracemalloc 统计内存峰值的阶段名，可重复指定，结果写入指标文件')
+    parser.add_argument('--profile_dir', default='profiles', help='cProfile 结果目录 (默认为profiles)')
+
+
+def metrics_from_args(args, name):
+    """根据命令行参数创建指标对象，需要时启动 Prometheus 服务"""
+    metrics = RunMetrics(name, profile_stages=args.profile_stage, trace_memory_stages=args.trace_memory_stage,
+                         profile_dir=args.profile_dir)
+    if args.metrics_port:
+        serve_prometheus(lambda: metrics, args.metrics_port)
+        print(f"指标: http://127.0.0.1:{args.metrics_port}/metrics")
+    return metrics
@@ -0,0 +1,198 @@
+"""
+PDF 解析结果缓存
+
+以 PDF 内容的 SHA-256 和 magic-pdf.json 中影响解析结果的模型设置为键，
+保存中间 JSON、内容列表、Markdown 和提取出的图片。
+同一份 PDF 再次处理（例如翻译成另一种语言）时直接复用，跳过 doc_analyze 等模型推理。
+缓存总大小超过上限时按最近使用时间淘汰。
+"""
+import os
+import re
+import json
+import shutil
+import hashlib
+import tempfile
+
+# 默认缓存目录和大小上限（字节）
+DEFAULT_PARSE_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".pdf_translator_parse_cache")
+DEFAULT_PARSE_CACHE_MAX_BYTES = 5 * 1024 * 1024 * 1024
+
+# magic-pdf.json 中影响解析结果的设置项
+RELEVANT_CONFIG_KEYS = [
+    "models-dir",
+    "layoutreader-model-dir",
+    "device-mode",
+    "layout-config",
+    "formula-config",
+    "table-config",
+    "config_version",
+]
+
+# 缓存条目中的文件名
+MD_FILE = "doc.md"
+CONTENT_LIST_FILE = "content_list.json"
+MIDDLE_JSON_FILE = "middle.json"
+MODEL_JSON_FILE = "model.json"
+IMAGES_DIR = "images"
+
+# Markdown 中的图片引用
+_IMAGE_LINK_PATTERN = re.compile(r'!\[[^\]\n]*\]\(([^)\n]+)\)')
+
+
+def load_model_settings(config_path=None):
+    """读取 magic-pdf.json 中影响解析结果的设置
+
+    未指定路径时与 magic_pdf 相同：优先使用 MINERU_TOOLS_CONFIG_JSON 环境变量，
+    否则使用用户主目录下的 magic-pdf.json。
+    """
+    if config_path is None:
+        config_path = os.getenv("MINERU_TOOLS_CONFIG_JSON") or os.path.join(os.path.expanduser("~"), "magic-pdf.json")
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    settings = {key: config.get(key) for key in RELEVANT_CONFIG_KEYS}
+    # 大模型辅助只记录是否启用和使用的模型，不记录 API 密钥
+    settings["llm-aided-config"] = {
+        name: {"enable": item.get("enable"), "model": item.get("model")}
+        for name, item in (config.get("llm-aided-config") or {}).items()
+    }
+    try:
+        from magic_pdf.libs.version import __version__
+        settings["magic_pdf_version"] = __version__
+    except ImportError:
+        pass
+    return settings
+
+
+def collect_image_names(md_content, content_list, image_dir):
+    """找出 Markdown 和内容列表中引用的 image_dir 下的图片文件名"""
+    paths = set(_IMAGE_LINK_PATTERN.findall(md_content))
+    for block in content_list:
+        if block.get("img_path"):
+            paths.add(block["img_path"])
+    prefix = image_dir.rstrip("/") + "/"
+    return sorted(path[len(prefix):] for path in paths if path.startswith(prefix))
+
+
+class ParseCache:
+    """基于目录的解析结果缓存，每个条目是缓存目录下以键命名的子目录"""
+
+    def __init__(self, cache_dir=DEFAULT_PARSE_CACHE_DIR, max_bytes=DEFAULT_PARSE_CACHE_MAX_BYTES,
+                 model_settings=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.model_settings = load_model_settings() if model_settings is None else model_settings
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def make_key(self, pdf_bytes, options=None):
+        """根据 PDF 内容、模型设置和影响解析结果的解析选项计算缓存键"""
+        settings = json.dumps({**self.model_settings, **(options or {})}, sort_keys=True, ensure_ascii=False)
+        digest = hashlib.sha256(pdf_bytes)
+        digest.update(hashlib.sha256(settings.encode("utf-8")).digest())
+        return digest.hexdigest()
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        """返回缓存条目目录，未命中时返回 None"""
+        path = self.entry_dir(key)
+        if not os.path.exists(os.path.join(path, MIDDLE_JSON_FILE)):
+            return None
+        # 更新访问时间，用于按最近使用时间淘汰
+        os.utime(path)
+        return path
+
+    def put(self, key, md_content, content_list, middle_json, local_image_dir, image_dir, model_json=None):
+        """保存一份解析结果
+
+        参数:
+            key (str): 缓存键
+            md_content (str): Markdown 内容
+            content_list (list): 内容列表
+            middle_json (str): 中间 JSON 字符串
+            local_image_dir (str): 图片实际所在的目录
+            image_dir (str): Markdown 中引用图片使用的相对目录名
+            model_json (list): 模型推理结果，用于事后绘制模型结果可视化
+        """
+        # 先写入临时目录再整体改名，避免中断时留下不完整的条目
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=self.cache_dir)
+        try:
+            with open(os.path.join(tmp_dir, MD_FILE), 'w', encoding='utf-8') as f:
+                f.write(md_content)
+            with open(os.path.join(tmp_dir, CONTENT_LIST_FILE), 'w', encoding='utf-8') as f:
+                json.dump(content_list, f, ensure_ascii=False, indent=4)
+            with open(os.path.join(tmp_dir, MIDDLE_JSON_FILE), 'w', encoding='utf-8') as f:
+                f.write(middle_json)
+            if model_json is not None:
+                with open(os.path.join(tmp_dir, MODEL_JSON_FILE), 'w', encoding='utf-8') as f:
+                    json.dump(model_json, f, ensure_ascii=False)
+            os.makedirs(os.path.join(tmp_dir, IMAGES_DIR))
+            for name in collect_image_names(md_content, content_list, image_dir):
+                source = os.path.join(local_image_dir, name)
+                if os.path.exists(source):
+                    shutil.copy2(source, os.path.join(tmp_dir, IMAGES_DIR, name))
+
+            path = self.entry_dir(key)
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            os.replace(tmp_dir, path)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        self.evict()
+
+    def restore(self, key, local_md_dir, local_image_dir, name_without_suff, include_json=True):
+        """把缓存条目恢复到输出目录，文件名与正常解析时一致
+
+        include_json 为 False 时只恢复 Markdown 和图片。
+
+        返回:
+            bool: 是否命中缓存
+        """
+        path = self.get(key)
+        if path is None:
+            return False
+        os.makedirs(local_image_dir, exist_ok=True)
+        shutil.copyfile(os.path.join(path, MD_FILE), os.path.join(local_md_dir, f"{name_without_suff}.md"))
+        if include_json:
+            shutil.copyfile(os.path.join(path, CONTENT_LIST_FILE),
+                            os.path.join(local_md_dir, f"{name_without_suff}_content_list.json"))
+            shutil.copyfile(os.path.join(path, MIDDLE_JSON_FILE),
+                            os.path.join(local_md_dir, f"{name_without_suff}_middle.json"))
+            if os.path.exists(os.path.join(path, MODEL_JSON_FILE)):
+                shutil.copyfile(os.path.join(path, MODEL_JSON_FILE),
+                                os.path.join(local_md_dir, f"{name_without_suff}_model.json"))
+        images_path = os.path.join(path, IMAGES_DIR)
+        for name in os.listdir(images_path):
+            shutil.copyfile(os.path.join(images_path, name), os.path.join(local_image_dir, name))
+        return True
+
+    def invalidate(self, key):
+        """删除一个缓存条目"""
+        shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+
+    def evict(self):
+        """总大小超过上限时，按最近使用时间从旧到新删除条目"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith(".tmp-") or not os.path.isdir(path):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(root, file))
+                for root, _, files in os.walk(path) for file in files
+            )
+            entries.append((os.path.getmtime(path), size, path))
+            total += size
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+        return total
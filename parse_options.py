@@ -0,0 +1,31 @@
+"""
+解析相关的常量
+
+不依赖 magic_pdf，图形界面等需要快速启动的入口可以直接导入，不会加载模型代码。
+"""
+
+# 流式解析时每个窗口包含的页数
+DEFAULT_WINDOW_SIZE = 4
+
+# 页数达到该值的文档使用大文档模式：按页窗口分析，每个窗口处理完就释放页面图像和推理结果，
+# 中间结果写到磁盘，内存峰值不随页数增长。0 表示不使用大文档模式
+LARGE_DOCUMENT_PAGES = 200
+# 大文档模式每个窗口包含的页数
+LARGE_DOCUMENT_WINDOW_SIZE = 16
+
+# 输出内容档位
+# minimal:  只输出 Markdown 和图片
+# standard: 另外输出内容列表、中间 JSON 和模型推理结果 JSON（可用于事后绘制调试可视化）
+# debug:    另外绘制模型、布局和文本片段的可视化 PDF
+ARTIFACT_PROFILES = ("minimal", "standard", "debug")
+DEFAULT_ARTIFACT_PROFILE = "standard"
+
+# 提取出的图片的保存格式：jpeg 默认保留处理管道编码的图片，指定质量时重新编码；webp 总是重新编码
+IMAGE_FORMATS = ("jpeg", "webp")
+DEFAULT_IMAGE_FORMAT = "jpeg"
+DEFAULT_WEBP_QUALITY = 80
+# 批量处理时所有文档共用的图片目录（位于输出目录下），各文档的图片目录中是指向它的硬链接
+IMAGE_STORE_DIR = ".image_store"
+
+# 调试可视化的种类
+VISUALIZATION_KINDS = ("model", "layout", "spans")
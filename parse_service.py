@@ -0,0 +1,466 @@
+"""
+本地 PDF 解析与翻译服务
+
+常驻进程只在启动时加载一次 doc_analyze 使用的模型，之后通过 HTTP 接收任务，
+省去每次运行脚本时重新导入 magic_pdf 和加载模型的几十秒。
+任务由固定数量的工作线程处理，排队任务数达到上限时拒绝新任务（503，附带 Retry-After）。
+magic_pdf 的模型单例没有声明线程安全，所有工作线程共用一把解析锁，同一时刻只有一个任务在解析 PDF；
+多个工作线程的并发只用于翻译和文件读写（解析一个任务的同时翻译其他任务）。
+
+接口:
+    POST   /jobs                      提交任务。JSON 请求体 {"path": ..., "languages": [...], "artifact_profile": ...}
+                                      （Content-Type: application/json）按本地路径提交；
+                                      其他请求体视为上传的 PDF，参数放在查询字符串中
+                                      （name、languages 用逗号分隔、artifact_profile）
+    GET    /jobs                      列出任务
+    GET    /jobs/<id>                 任务状态和进度
+    GET    /jobs/<id>/events          逐行推送任务状态（JSON Lines），直到任务结束
+    GET    /jobs/<id>/result          下载结果，language 参数指定译文语言，默认为解析出的 Markdown
+    DELETE /jobs/<id>                 取消任务
+    GET    /health                    模型是否已加载、排队和处理中的任务数
+
+用法:
+    python parse_service.py --port 8600 --workers 1 --max_queue 16
+    curl -X POST -H "Content-Type: application/json" -d '{"path": "paper.pdf", "languages": ["中文"]}' http://127.0.0.1:8600/jobs
+    curl -X POST --data-binary @paper.pdf "http://127.0.0.1:8600/jobs?name=paper.pdf&languages=中文,日文"
+    curl http://127.0.0.1:8600/jobs/1/events
+    curl -o paper_中文.md "http://127.0.0.1:8600/jobs/1/result?language=中文"
+"""
+import os
+import json
+import time
+import queue
+import shutil
+import argparse
+import threading
+import traceback
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from batch_translate import process_one, warm_up_models
+from concurrent_translate import DEFAULT_CONCURRENCY, DEFAULT_RPM, DEFAULT_TPM
+from parse_cache import DEFAULT_PARSE_CACHE_DIR, DEFAULT_PARSE_CACHE_MAX_BYTES
+from parse_options import IMAGE_STORE_DIR, LARGE_DOCUMENT_PAGES
+from translation_cache import DEFAULT_CACHE_PATH
+
+DEFAULT_PORT = 8600
+DEFAULT_MAX_QUEUE = 16
+DEFAULT_MAX_UPLOAD_BYTES = 200 * 1024 * 1024
+RETRY_AFTER_SECONDS = 10
+
+# 最多保留的已结束任务数，超出时删除最早结束的任务记录（不删除输出文件）
+MAX_FINISHED_JOBS = 1000
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINAL_STATES = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)
+
+# 下载结果时每次写出的字节数
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+class Job:
+    """一个解析与翻译任务，状态变化时通知等待者"""
+
+    def __init__(self, job_id, pdf_file_path, languages, artifact_profile=None):
+        self.id = job_id
+        self.pdf_file_path = pdf_file_path
+        self.languages = languages
+        self.artifact_profile = artifact_profile
+        self.state = JOB_QUEUED
+        self.progress = 0.0
+        self.message = "排队中"
+        self.record = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.condition = threading.Condition()
+        self.version = 0
+
+    @property
+    def finished(self):
+        return self.state in FINAL_STATES
+
+    def update(self, **changes):
+        with self.condition:
+            for name, value in changes.items():
+                setattr(self, name, value)
+            self.version += 1
+            self.condition.notify_all()
+
+    def wait_for_update(self, version, timeout=None):
+        """等待状态在 version 之后发生变化，返回 (新版本号, 状态)"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version, timeout)
+            return self.version, self.to_dict()
+
+    def to_dict(self):
+        record = self.record or {}
+        return {
+            "id": self.id,
+            "pdf": self.pdf_file_path,
+            "languages": self.languages,
+            "state": self.state,
+            "progress": round(self.progress, 4),
+            "message": self.message,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "parse_seconds": record.get("parse_seconds"),
+            "translate_seconds": record.get("translate_seconds", {}),
+            "outputs": sorted(record.get("outputs", {})),
+            "failures": [{"stage": f["stage"], "error": f["error"]} for f in record.get("failures", [])],
+        }
+
+
+class ParseService:
+    """任务队列和常驻工作线程，模型在所有任务之间共享"""
+
+    def __init__(self, output_dir, settings, workers=1, max_queue=DEFAULT_MAX_QUEUE):
+        self.output_dir = output_dir
+        self.settings = settings
+        self.workers = max(1, workers)
+        self.queue = queue.Queue(maxsize=max(1, max_queue))
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.ready = threading.Event()
+        # 共享的模型不保证线程安全，解析阶段在工作线程之间串行
+        self.parse_lock = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+
+    def start(self):
+        """在后台加载模型并启动工作线程；模型加载完成前提交的任务会排队等待"""
+        def warm_up():
+            start = time.perf_counter()
+            warm_up_models()
+            self.ready.set()
+            print(f"模型加载完成，用时 {time.perf_counter() - start:.1f}s")
+
+        threading.Thread(target=warm_up, daemon=True).start()
+        for _ in range(self.workers):
+            threading.Thread(target=self.worker_loop, daemon=True).start()
+
+    def has_capacity(self):
+        return not self.queue.full()
+
+    def upload_path(self, name):
+        """为上传的 PDF 分配保存路径"""
+        name = os.path.basename(name or "upload.pdf")
+        if not name.lower().endswith(".pdf"):
+            name += ".pdf"
+        with self.lock:
+            upload_dir = os.path.join(self.output_dir, "uploads", f"{self.next_id}-{time.time_ns()}")
+        os.makedirs(upload_dir, exist_ok=True)
+        return os.path.join(upload_dir, name)
+
+    def submit(self, pdf_file_path, languages, artifact_profile=None):
+        """提交任务，队列已满时抛出 queue.Full"""
+        with self.lock:
+            job = Job(str(self.next_id), pdf_file_path, languages, artifact_profile)
+            self.queue.put_nowait(job)
+            self.next_id += 1
+            self.jobs[job.id] = job
+            self.prune()
+        return job
+
+    def prune(self):
+        finished = sorted((job for job in self.jobs.values() if job.finished), key=lambda job: job.finished_at)
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job.id]
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return [job.to_dict() for job in self.jobs.values()]
+
+    def cancel(self, job_id):
+        """取消任务：排队中的任务不再处理，处理中的任务在下一个页段或文本块前停止"""
+        job = self.get(job_id)
+        if job is not None and not job.finished:
+            job.cancel_event.set()
+            job.update(message="正在取消")
+        return job
+
+    def health(self):
+        with self.lock:
+            running = sum(1 for job in self.jobs.values() if job.state == JOB_RUNNING)
+        return {"ready": self.ready.is_set(), "queued": self.queue.qsize(), "running": running,
+                "workers": self.workers, "max_queue": self.queue.maxsize}
+
+    def worker_loop(self):
+        while True:
+            job = self.queue.get()
+            if job.cancel_event.is_set():
+                job.update(state=JOB_CANCELLED, message="已取消", finished_at=time.time())
+                continue
+            self.ready.wait()
+            job.update(state=JOB_RUNNING, message="开始处理")
+            settings = dict(self.settings)
+            if job.artifact_profile:
+                settings["artifact_profile"] = job.artifact_profile
+            try:
+                # 每个任务使用单独的结果目录，上传的同名文件不会互相覆盖
+                name_without_suff = os.path.splitext(os.path.basename(job.pdf_file_path))[0]
+                record = process_one(
+                    job.pdf_file_path, self.output_dir, job.languages, settings,
+                    on_progress=lambda message, fraction: job.update(message=message, progress=fraction),
+                    cancel_event=job.cancel_event,
+                    output_name=f"{job.id}-{name_without_suff}",
+                    parse_lock=self.parse_lock,
+                )
+                state = {"ok": JOB_SUCCEEDED, "cancelled": JOB_CANCELLED}.get(record["status"], JOB_FAILED)
+            except Exception as e:
+                record = {"status": "failed", "outputs": {},
+                          "failures": [{"stage": "worker", "error": str(e), "traceback": traceback.format_exc()}]}
+                state = JOB_FAILED
+            message = {JOB_SUCCEEDED: "完成", JOB_CANCELLED: "已取消", JOB_FAILED: "失败"}[state]
+            job.update(state=state, message=message, record=record, finished_at=time.time(),
+                       progress=1.0 if state == JOB_SUCCEEDED else job.progress)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def parse_path(self):
+        url = urllib.parse.urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        query = {name: values[-1] for name, values in urllib.parse.parse_qs(url.query).items()}
+        return parts, query
+
+    def find_job(self, job_id):
+        job = self.server.service.get(job_id)
+        if job is None:
+            self.send_json(404, {"error": f"任务不存在: {job_id}"})
+        return job
+
+    def reject_busy(self):
+        self.send_json(503, {"error": "任务队列已满，请稍后重试"}, {"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+    def do_POST(self):
+        parts, query = self.parse_path()
+        if parts != ["jobs"]:
+            self.send_json(404, {"error": "未知的接口"})
+            return
+        service = self.server.service
+        # 队列已满时不读取上传内容，直接拒绝
+        if not service.has_capacity():
+            self.reject_busy()
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            try:
+                request = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                request = None
+            if not isinstance(request, dict):
+                self.send_json(400, {"error": "请求体不是 JSON 对象"})
+                return
+            pdf_file_path = request.get("path")
+            languages = request.get("languages", ["中文"])
+            artifact_profile = request.get("artifact_profile")
+            if not pdf_file_path or not os.path.isfile(pdf_file_path):
+                self.send_json(400, {"error": f"PDF 文件不存在: {pdf_file_path}"})
+                return
+            pdf_file_path = os.path.abspath(pdf_file_path)
+        else:
+            if length > self.server.max_upload_bytes:
+                self.send_json(413, {"error": "上传的文件过大"})
+                return
+            languages = [language for language in query.get("languages", "中文").split(",") if language]
+            artifact_profile = query.get("artifact_profile")
+            pdf_file_path = service.upload_path(query.get("name"))
+            with open(pdf_file_path, 'wb') as f:
+                remaining = length
+                while remaining > 0:
+                    block = self.rfile.read(min(STREAM_BLOCK_SIZE, remaining))
+                    if not block:
+                        break
+                    f.write(block)
+                    remaining -= len(block)
+
+        try:
+            job = service.submit(pdf_file_path, languages, artifact_profile)
+        except queue.Full:
+            self.reject_busy()
+            return
+        self.send_json(202, job.to_dict(), {"Location": f"/jobs/{job.id}"})
+
+    def do_DELETE(self):
+        parts, _ = self.parse_path()
+        if len(parts) != 2 or parts[0] != "jobs":
+            self.send_json(404, {"error": "未知的接口"})
+            return
+        job = self.find_job(parts[1])
+        if job is not None:
+            self.send_json(200, self.server.service.cancel(job.id).to_dict())
+
+    def do_GET(self):
+        parts, query = self.parse_path()
+        service = self.server.service
+        if parts == ["health"]:
+            self.send_json(200, service.health())
+        elif parts == ["jobs"]:
+            self.send_json(200, service.list())
+        elif len(parts) == 2 and parts[0] == "jobs":
+            job = self.find_job(parts[1])
+            if job is not None:
+                self.send_json(200, job.to_dict())
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "events":
+            job = self.find_job(parts[1])
+            if job is not None:
+                self.stream_events(job)
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "result":
+            job = self.find_job(parts[1])
+            if job is not None:
+                self.stream_result(job, query.get("language", "markdown"))
+        else:
+            self.send_json(404, {"error": "未知的接口"})
+
+    def stream_events(self, job):
+        """每当任务状态变化时写出一行 JSON，任务结束后关闭连接"""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        version, state = job.version, job.to_dict()
+        while True:
+            self.wfile.write((json.dumps(state, ensure_ascii=False) + "\n").encode("utf-8"))
+            self.wfile.flush()
+            if state["state"] in FINAL_STATES:
+                break
+            version, state = job.wait_for_update(version, timeout=15)
+
+    def stream_result(self, job, language):
+        path = (job.record or {}).get("outputs", {}).get(language)
+        if path is None or not os.path.exists(path):
+            self.send_json(404, {"error": f"没有 {language} 的结果", "state": job.state})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/markdown; charset=utf-8")
+        self.send_header("Content-Length", str(os.path.getsize(path)))
+        self.send_header("Content-Disposition",
+                         f"attachment; filename*=UTF-8''{urllib.parse.quote(os.path.basename(path))}")
+        self.end_headers()
+        with open(path, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile, STREAM_BLOCK_SIZE)
+
+    def handle_one_request(self):
+        try:
+            super().handle_one_request()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前断开（例如停止读取进度推送）
+            pass
+
+    def log_message(self, format, *args):
+        # 不输出访问日志
+        pass
+
+
+def create_server(service, host="127.0.0.1", port=DEFAULT_PORT, max_upload_bytes=DEFAULT_MAX_UPLOAD_BYTES):
+    httpd = ThreadingHTTPServer((host, port), _Handler)
+    httpd.daemon_threads = True
+    httpd.service = service
+    httpd.max_upload_bytes = max_upload_bytes
+    return httpd
+
+
+def submit_job(service_url, pdf_file_path, languages, artifact_profile=None):
+    """按本地路径向服务提交任务，返回任务状态；队列已满时等待 Retry-After 后重试"""
+    body = json.dumps({"path": os.path.abspath(pdf_file_path), "languages": languages,
+                       "artifact_profile": artifact_profile}).encode("utf-8")
+    while True:
+        request = urllib.request.Request(f"{service_url.rstrip('/')}/jobs", data=body, method="POST",
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as e:
+            if e.code != 503:
+                raise
+            time.sleep(int(e.headers.get("Retry-After", RETRY_AFTER_SECONDS)))
+
+
+def wait_for_job(service_url, job_id, on_update=None):
+    """读取任务的进度推送直到任务结束，返回最终状态"""
+    with urllib.request.urlopen(f"{service_url.rstrip('/')}/jobs/{job_id}/events") as response:
+        state = None
+        for line in response:
+            state = json.loads(line)
+            if on_update:
+                on_update(state)
+        return state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='常驻的 PDF 解析与翻译服务，模型只加载一次')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址 (默认为127.0.0.1)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'监听端口 (默认为{DEFAULT_PORT})')
+    parser.add_argument('--output_dir', default='service_output', help='输出目录 (默认为service_output)')
+    parser.add_argument('--workers', type=int, default=1, help='同时处理的任务数，PDF 解析始终逐个进行，其余工作线程同时翻译 (默认为1)')
+    parser.add_argument('--max_queue', type=int, default=DEFAULT_MAX_QUEUE,
+                        help=f'最多排队的任务数，超出时拒绝新任务 (默认为{DEFAULT_MAX_QUEUE})')
+    parser.add_argument('--max_upload_mb', type=int, default=DEFAULT_MAX_UPLOAD_BYTES // (1024 * 1024),
+                        help='上传 PDF 的大小上限（MB）(默认为200)')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'每个任务同时在途的翻译请求数 (默认为{DEFAULT_CONCURRENCY})')
+    parser.add_argument('--rpm', type=int, default=DEFAULT_RPM,
+                        help=f'所有任务合计的每分钟请求数上限，0 表示不限制 (默认为{DEFAULT_RPM})')
+    parser.add_argument('--tpm', type=int, default=DEFAULT_TPM,
+                        help='所有任务合计的每分钟令牌数上限，0 表示不限制 (默认不限制)')
+    parser.add_argument('--base_url', default=None,
+                        help='OpenAI 兼容服务的地址 (默认读取 OPENAI_BASE_URL 环境变量)')
+    parser.add_argument('--cache_path', default=DEFAULT_CACHE_PATH, help='翻译缓存文件路径')
+    parser.add_argument('--no_cache', action='store_true', help='不使用翻译缓存')
+    parser.add_argument('--parse_cache_dir', default=DEFAULT_PARSE_CACHE_DIR, help='解析缓存目录')
+    parser.add_argument('--no_parse_cache', action='store_true', help='不使用解析缓存')
+    parser.add_argument('--artifact_profile', choices=['minimal', 'standard', 'debug'], default='minimal',
+                        help='默认的输出内容档位，任务可以单独指定 (默认为minimal)')
+    parser.add_argument('--large_document_pages', type=int, default=LARGE_DOCUMENT_PAGES,
+                        help='页数达到该值的 PDF 按页窗口解析，内存峰值不随页数增长；'
+                             f'0 表示不使用 (默认为{LARGE_DOCUMENT_PAGES})')
+    args = parser.parse_args()
+
+    workers = max(1, args.workers)
+    settings = {
+        "concurrency": args.concurrency,
+        # 限流额度在同时处理的任务之间平分
+        "rpm": max(1, args.rpm // workers) if args.rpm else 0,
+        "tpm": max(1, args.tpm // workers) if args.tpm else 0,
+        "base_url": args.base_url,
+        "cache_path": None if args.no_cache else args.cache_path,
+        "parse_cache_dir": None if args.no_parse_cache else args.parse_cache_dir,
+        "parse_cache_max_bytes": DEFAULT_PARSE_CACHE_MAX_BYTES,
+        "artifact_profile": args.artifact_profile,
+        "large_document_pages": args.large_document_pages,
+        # 相同的图片在所有任务之间只保存一份
+        "image_store_dir": os.path.join(args.output_dir, IMAGE_STORE_DIR),
+    }
+
+    service = ParseService(args.output_dir, settings, workers, args.max_queue)
+    service.start()
+    httpd = create_server(service, args.host, args.port, args.max_upload_mb * 1024 * 1024)
+    print(f"服务已启动: http://{args.host}:{args.port}，工作线程数 {workers}，排队上限 {args.max_queue}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
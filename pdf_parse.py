@@ -1,75 +1,571 @@
 """
 pip install -U "magic-pdf[full]" -i https://mirrors.aliyun.com/pypi/simple
 """
+import gc
 import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
 
 from magic_pdf.data.data_reader_writer import FileBasedDataWriter, FileBasedDataReader
 from magic_pdf.data.dataset import PymuDocDataset
 from magic_pdf.model.doc_analyze_by_custom_model import doc_analyze
 from magic_pdf.config.enums import SupportedPdfParseMethod
+from magic_pdf.operators.models import InferenceResult
+from magic_pdf.operators.pipes import PipeResult
 
-# 设置参数
-pdf_file_name = "2024-tpami-asr-etr.pdf"  # 替换为实际的PDF文件路径
-name_without_suff = pdf_file_name.split(".")[0]  # 获取不带后缀的文件名，用于后续生成输出文件
+from parse_cache import DEFAULT_PARSE_CACHE_DIR, DEFAULT_PARSE_CACHE_MAX_BYTES, ParseCache
+from concurrent_translate import check_cancelled
+from metrics import NO_METRICS, add_metrics_arguments, metrics_from_args
+from image_writer import ContentAddressedImageWriter
+from parse_options import (
+    ARTIFACT_PROFILES, DEFAULT_ARTIFACT_PROFILE, DEFAULT_IMAGE_FORMAT, DEFAULT_WINDOW_SIZE, IMAGE_FORMATS,
+    LARGE_DOCUMENT_PAGES, LARGE_DOCUMENT_WINDOW_SIZE, VISUALIZATION_KINDS
+)
 
-# 准备环境
-local_image_dir, local_md_dir = "output/images", "output"  # 设置图像和Markdown输出目录
-image_dir = str(os.path.basename(local_image_dir))  # 获取图像目录的基本名称
+# 逐页判断文本层是否可用：去掉空白后少于该字符数，或无法解码的字符占比过高的页面需要 OCR
+MIN_TEXT_CHARS = 50
+MAX_GARBLED_RATIO = 0.1
 
-os.makedirs(local_image_dir, exist_ok=True)  # 创建图像输出目录，如果已存在则不报错
 
-# 创建文件写入器实例，用于保存图像和 Markdown 文件
-image_writer, md_writer = FileBasedDataWriter(local_image_dir), FileBasedDataWriter(local_md_dir)
+def classify_pages(pdf):
+    """逐页判断是否需要 OCR
 
-# 读取PDF文件内容
-reader1 = FileBasedDataReader("")  # 创建文件读取器实例
-pdf_bytes = reader1.read(pdf_file_name)  # 读取 PDF 文件内容为字节流
+    参数:
+        pdf (bytes 或 str): PDF 文件内容，或 PDF 文件路径（按路径打开时逐页读取，不把整个文件读入内存）
 
-# 处理PDF
-## 创建数据集实例
-ds = PymuDocDataset(pdf_bytes)  # 使用 PDF 字节流创建数据集实例
+    返回:
+        list: 每页一个布尔值，True 表示该页没有可用的文本层，需要 OCR
+    """
+    import fitz  # PyMuPDF，magic_pdf 的依赖
 
-## 推理处理
-if ds.classify() == SupportedPdfParseMethod.OCR:  # 判断 PDF 是否需要 OCR 处理
-    # 如果需要 OCR 处理（图像型PDF）
-    infer_result = ds.apply(doc_analyze, ocr=True)  # 应用文档分析，启用 OCR
+    needs_ocr = []
+    with (fitz.open(pdf) if isinstance(pdf, str) else fitz.open("pdf", pdf)) as doc:
+        for page in doc:
+            text = page.get_text("text")
+            char_count = len("".join(text.split()))
+            garbled_count = text.count("\ufffd")
+            needs_ocr.append(char_count < MIN_TEXT_CHARS or garbled_count > char_count * MAX_GARBLED_RATIO)
+    return needs_ocr
 
-    # === OCR 处理管道 ===
-    pipe_result = infer_result.pipe_ocr_mode(image_writer)  # 使用 OCR 模式处理管道
 
-else:
-    # 如果不需要 OCR 处理（文本型PDF）
-    infer_result = ds.apply(doc_analyze, ocr=False)  # 应用文档分析，不启用OCR
+def group_page_runs(needs_ocr, start_page_id=0, end_page_id=None):
+    """把页面范围按处理模式分成连续的段，返回 [(起始页, 结束页, 是否OCR), ...]"""
+    if end_page_id is None:
+        end_page_id = len(needs_ocr) - 1
+    runs = []
+    for page_id in range(start_page_id, end_page_id + 1):
+        ocr = needs_ocr[page_id]
+        if runs and runs[-1][2] == ocr:
+            runs[-1][1] = page_id
+        else:
+            runs.append([page_id, page_id, ocr])
+    return [tuple(run) for run in runs]
 
-    # === TXT 处理管道 ===
-    pipe_result = infer_result.pipe_txt_mode(image_writer)  # 使用文本模式处理管道
 
-### 在每一页上绘制: 模型结果
-infer_result.draw_model(os.path.join(local_md_dir, f"{name_without_suff}_model.pdf"))  # 保存模型分析结果的可视化 PDF
+def analyze_pages(ds, image_writer, needs_ocr, start_page_id=0, end_page_id=None, log=print, cancel_event=None,
+                  metrics=NO_METRICS, page_offset=0):
+    """按页路由分析文档：只有需要 OCR 的页走 OCR 模式，其余页走文本模式
 
-### 获取模型推理结果
-model_inference_result = infer_result.get_infer_res()  # 获取模型推理的原始结果数据
+    每个连续的同模式页段分别调用 doc_analyze 和对应的处理管道，
+    再按页号把各段的推理结果和中间结果合并成一个完整的结果。
 
-### 在每一页上绘制: 布局结果
-pipe_result.draw_layout(os.path.join(local_md_dir, f"{name_without_suff}_layout.pdf"))  # 保存布局分析结果的可视化 PDF
+    参数:
+        ds (PymuDocDataset): 数据集
+        image_writer (DataWriter): 图片写入器
+        needs_ocr (list): classify_pages 的结果
+        start_page_id (int): 起始页（从 0 开始）
+        end_page_id (int): 结束页（包含），为 None 时到最后一页
+        log (callable): 日志输出函数
+        cancel_event (threading.Event): 设置后在下一个页段开始前抛出 Cancelled
+        metrics (RunMetrics): 运行指标，记录 doc_analyze 和处理管道的耗时
+        page_offset (int): ds 只包含原文档的一部分页时，第一页在原文档中的页号（只用于日志）
 
-### 在每一页上绘制: 文本片段结果
-pipe_result.draw_span(os.path.join(local_md_dir, f"{name_without_suff}_spans.pdf"))  # 保存文本片段分析结果的可视化 PDF
+    返回:
+        tuple: (InferenceResult, PipeResult)
+    """
+    runs = group_page_runs(needs_ocr, start_page_id, end_page_id)
+    infer_pages, pipe_res = None, None
+    for run_start, run_end, ocr in runs:
+        check_cancelled(cancel_event)
+        log(f"第{page_offset + run_start + 1}-{page_offset + run_end + 1}页使用{'OCR' if ocr else '文本'}模式")
+        with metrics.stage("parse.doc_analyze"):
+            infer_result = ds.apply(doc_analyze, ocr=ocr, start_page_id=run_start, end_page_id=run_end)
+        with metrics.stage("parse.pipe"):
+            if ocr:
+                pipe_result = infer_result.pipe_ocr_mode(image_writer, start_page_id=run_start, end_page_id=run_end)
+            else:
+                pipe_result = infer_result.pipe_txt_mode(image_writer, start_page_id=run_start, end_page_id=run_end)
+        if len(runs) == 1:
+            return infer_result, pipe_result
 
-### 获取 Markdown 内容
-md_content = pipe_result.get_markdown(image_dir)  # 生成包含 图像引用 的 Markdown 内容
+        # 范围外的页在各段结果中都是空页，按页号取各段自己负责的页
+        run_infer_pages = infer_result.get_infer_res()
+        run_pipe_res = json.loads(pipe_result.get_middle_json())
+        if infer_pages is None:
+            infer_pages, pipe_res = run_infer_pages, run_pipe_res
+        else:
+            for page_id in range(run_start, run_end + 1):
+                infer_pages[page_id] = run_infer_pages[page_id]
+                pipe_res["pdf_info"][page_id] = run_pipe_res["pdf_info"][page_id]
+    return InferenceResult(infer_pages, ds), PipeResult(pipe_res, ds)
 
-### 保存 Markdown 文件
-pipe_result.dump_md(md_writer, f"{name_without_suff}.md", image_dir)  # 将Markdown内容写入文件
 
-### 获取内容列表
-content_list_content = pipe_result.get_content_list(image_dir)  # 获取文档内容的结构化列表
+def count_pages(pdf_file_path):
+    """PDF 的页数（只读取文档结构，不读入页面内容）"""
+    import fitz
 
-### 保存内容列表
-pipe_result.dump_content_list(md_writer, f"{name_without_suff}_content_list.json", image_dir)  # 将内容列表保存为 JSON 文件
+    with fitz.open(pdf_file_path) as doc:
+        return doc.page_count
 
-### 获取中间 JSON 数据
-middle_json_content = pipe_result.get_middle_json()  # 获取处理过程中的中间JSON数据
 
-### 保存中间 JSON 数据
-pipe_result.dump_middle_json(md_writer, f'{name_without_suff}_middle.json')  # 将中间 JSON 数据保存到文件
\ No newline at end of file
+def extract_page_window(doc, start_page_id, end_page_id):
+    """把文档中第 start_page_id 到 end_page_id 页（包含）复制成一个独立的 PDF，返回其字节"""
+    import fitz
+
+    with fitz.open() as window_doc:
+        window_doc.insert_pdf(doc, from_page=start_page_id, to_page=end_page_id)
+        return window_doc.tobytes()
+
+
+def release_memory():
+    """回收已处理窗口的页面图像和推理结果，magic_pdf 已经加载 torch 时同时清空显存缓存"""
+    gc.collect()
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def iter_page_windows(pdf_file_path, image_writer, needs_ocr, window_size, log=print, cancel_event=None,
+                      metrics=NO_METRICS):
+    """按页窗口分析文档，同一时间只有一个窗口的页在内存中
+
+    按路径打开 PDF，由 PyMuPDF 按需读取页面，不把整个文件读入内存；每个窗口的页复制成一个只含这些页的
+    小 PDF 交给 doc_analyze。调用方处理完一个窗口后应删除对结果的引用，继续迭代时该窗口的数据集、
+    页面图像和推理结果随即被释放。
+
+    参数:
+        pdf_file_path (str): PDF 文件路径
+        image_writer (DataWriter): 图片写入器
+        needs_ocr (list): classify_pages 的结果
+        window_size (int): 每个窗口的页数
+        log (callable): 日志输出函数
+        cancel_event (threading.Event): 设置后在下一个页段开始前抛出 Cancelled
+        metrics (RunMetrics): 运行指标
+
+    返回:
+        generator: 依次产出 (起始页, 结束页, InferenceResult, PipeResult)，起止页是原文档中的页号
+                   （从 0 开始且包含结束页），结果中的页号是窗口内的页号
+    """
+    import fitz
+
+    with fitz.open(pdf_file_path) as doc:
+        page_count = doc.page_count
+        for start_page_id in range(0, page_count, window_size):
+            end_page_id = min(start_page_id + window_size, page_count) - 1
+            check_cancelled(cancel_event)
+            with metrics.stage("parse.extract_window"):
+                ds = PymuDocDataset(extract_page_window(doc, start_page_id, end_page_id))
+            infer_result, pipe_result = analyze_pages(ds, image_writer, needs_ocr[start_page_id:end_page_id + 1],
+                                                      log=log, cancel_event=cancel_event, metrics=metrics,
+                                                      page_offset=start_page_id)
+            yield start_page_id, end_page_id, infer_result, pipe_result
+            del ds, infer_result, pipe_result
+            release_memory()
+            metrics.count("parse_windows")
+
+
+def render_visualizations(pdf_file_path, middle_json_path, model_json_path=None, output_dir=None,
+                          kinds=VISUALIZATION_KINDS, log=print):
+    """根据保存的中间 JSON 和模型推理结果 JSON 绘制调试可视化 PDF，不需要重新分析文档
+
+    参数:
+        pdf_file_path (str): 原始 PDF 文件路径
+        middle_json_path (str): 中间 JSON 文件路径（{name}_middle.json）
+        model_json_path (str): 模型推理结果 JSON 文件路径（{name}_model.json），绘制 model 时需要
+        output_dir (str): 输出目录，默认与中间 JSON 相同
+        kinds (tuple): 要绘制的种类，取值为 model、layout、spans
+
+    返回:
+        list: 生成的 PDF 文件路径
+    """
+    name_without_suff = os.path.splitext(os.path.basename(pdf_file_path))[0]
+    output_dir = output_dir or os.path.dirname(middle_json_path)
+    ds = PymuDocDataset(FileBasedDataReader("").read(pdf_file_path))
+
+    outputs = []
+    if "layout" in kinds or "spans" in kinds:
+        with open(middle_json_path, 'r', encoding='utf-8') as f:
+            pipe_result = PipeResult(json.load(f), ds)
+        if "layout" in kinds:
+            outputs.append(os.path.join(output_dir, f"{name_without_suff}_layout.pdf"))
+            pipe_result.draw_layout(outputs[-1])
+        if "spans" in kinds:
+            outputs.append(os.path.join(output_dir, f"{name_without_suff}_spans.pdf"))
+            pipe_result.draw_span(outputs[-1])
+    if "model" in kinds:
+        if model_json_path and os.path.exists(model_json_path):
+            with open(model_json_path, 'r', encoding='utf-8') as f:
+                infer_result = InferenceResult(json.load(f), ds)
+            outputs.append(os.path.join(output_dir, f"{name_without_suff}_model.pdf"))
+            infer_result.draw_model(outputs[-1])
+        else:
+            log("没有模型推理结果 JSON，跳过模型结果可视化")
+    return outputs
+
+
+def parse_pdf(pdf_file_path, local_md_dir, image_dir="images", parse_cache=None, force_refresh=False,
+              page_routing=True, artifact_profile=DEFAULT_ARTIFACT_PROFILE, log=print, cancel_event=None,
+              metrics=NO_METRICS, large_document_pages=LARGE_DOCUMENT_PAGES,
+              large_document_window_size=LARGE_DOCUMENT_WINDOW_SIZE, image_format=DEFAULT_IMAGE_FORMAT,
+              image_quality=None, image_store_dir=None):
+    """解析 PDF 文件，按输出内容档位输出 Markdown、图片以及内容列表、中间 JSON 和调试可视化
+
+    提供解析缓存时，先按 PDF 内容和模型设置查询缓存，命中则直接恢复输出文件，跳过模型推理。
+    页数达到 large_document_pages 的文档使用大文档模式（见 _parse_pdf_large），内存峰值不随页数增长。
+    图片在后台线程中写入，按内容哈希命名，相同的图片只保存一次（见 ContentAddressedImageWriter）。
+
+    参数:
+        pdf_file_path (str): PDF 文件路径
+        local_md_dir (str): 输出目录
+        image_dir (str): 图片子目录名，Markdown 中的图片引用使用该相对路径
+        parse_cache (ParseCache): 解析缓存，为 None 时不使用缓存
+        force_refresh (bool): 忽略已有缓存，重新解析并更新缓存
+        page_routing (bool): 逐页选择 OCR/文本模式；为 False 时整篇文档统一按 ds.classify() 的结果处理
+        artifact_profile (str): 输出内容档位，取值为 minimal、standard、debug
+        log (callable): 日志输出函数
+        cancel_event (threading.Event): 设置后在下一个页段开始前抛出 Cancelled
+        metrics (RunMetrics): 运行指标，记录各阶段耗时、页数和解析缓存命中情况
+        large_document_pages (int): 页数达到该值时使用大文档模式，0 表示不使用
+        large_document_window_size (int): 大文档模式每个窗口的页数
+        image_format (str): 图片保存格式，取值为 jpeg、webp
+        image_quality (int): 图片重新编码的质量（1-100），jpeg 为 None 时保留处理管道编码的图片
+        image_store_dir (str): 多个文档共用的图片目录，各文档的图片目录中是指向它的硬链接；为 None 时不共用
+
+    返回:
+        str: 生成的 Markdown 文件路径
+    """
+    with metrics.stage("parse"), ContentAddressedImageWriter(
+            os.path.join(local_md_dir, image_dir), image_format, image_quality, image_store_dir,
+            metrics=metrics) as image_writer:
+        if large_document_pages and count_pages(pdf_file_path) >= large_document_pages:
+            return _parse_pdf_large(pdf_file_path, local_md_dir, image_dir, image_writer, large_document_window_size,
+                                    artifact_profile, log, cancel_event, metrics)
+        # 图片设置不是默认值时才参与缓存键，默认设置下已有的缓存仍然有效
+        cache_options = {"page_routing": page_routing}
+        if image_format != DEFAULT_IMAGE_FORMAT or image_quality is not None:
+            cache_options.update(image_format=image_format, image_quality=image_quality)
+        return _parse_pdf(pdf_file_path, local_md_dir, image_dir, image_writer, parse_cache, cache_options,
+                          force_refresh, page_routing, artifact_profile, log, cancel_event, metrics)
+
+
+def _parse_pdf(pdf_file_path, local_md_dir, image_dir, image_writer, parse_cache, cache_options, force_refresh,
+               page_routing, artifact_profile, log, cancel_event, metrics):
+    # 准备环境
+    name_without_suff = os.path.splitext(os.path.basename(pdf_file_path))[0]  # 获取不带后缀的文件名，用于后续生成输出文件
+    local_image_dir = os.path.join(local_md_dir, image_dir)  # 图像输出目录
+    os.makedirs(local_image_dir, exist_ok=True)  # 创建图像输出目录，如果已存在则不报错
+    md_file_path = os.path.join(local_md_dir, f"{name_without_suff}.md")
+    middle_json_path = os.path.join(local_md_dir, f"{name_without_suff}_middle.json")
+    model_json_path = os.path.join(local_md_dir, f"{name_without_suff}_model.json")
+    save_json = artifact_profile in ("standard", "debug")
+
+    # 读取PDF文件内容
+    reader1 = FileBasedDataReader("")  # 创建文件读取器实例
+    pdf_bytes = reader1.read(pdf_file_path)  # 读取 PDF 文件内容为字节流
+
+    # 查询解析缓存
+    cache_key = None
+    if parse_cache is not None:
+        cache_key = parse_cache.make_key(pdf_bytes, cache_options)
+        with metrics.stage("parse.cache_restore"):
+            hit = not force_refresh and parse_cache.restore(cache_key, local_md_dir, local_image_dir,
+                                                            name_without_suff, include_json=save_json)
+        metrics.count("parse_cache_hits" if hit else "parse_cache_misses")
+        if hit:
+            log("命中解析缓存，跳过文档分析")
+            if artifact_profile == "debug":
+                with metrics.stage("parse.draw"):
+                    render_visualizations(pdf_file_path, middle_json_path, model_json_path, local_md_dir, log=log)
+            return md_file_path
+
+    # 创建文件写入器实例，用于保存 Markdown 和 JSON 文件（图片由 image_writer 在后台写入）
+    md_writer = FileBasedDataWriter(local_md_dir)
+
+    # 处理PDF
+    ## 创建数据集实例
+    ds = PymuDocDataset(pdf_bytes)  # 使用 PDF 字节流创建数据集实例
+    metrics.count("pages", len(ds))
+
+    ## 推理处理
+    log("正在进行文档分析...")
+    if page_routing:
+        # 逐页判断，只有没有可用文本层的页走 OCR
+        with metrics.stage("parse.classify"):
+            needs_ocr = classify_pages(pdf_bytes)
+        metrics.count("ocr_pages", sum(needs_ocr))
+        log(f"共{len(needs_ocr)}页，其中{sum(needs_ocr)}页需要OCR")
+        infer_result, pipe_result = analyze_pages(ds, image_writer, needs_ocr, log=log, cancel_event=cancel_event,
+                                                  metrics=metrics)
+
+    elif ds.classify() == SupportedPdfParseMethod.OCR:  # 判断 PDF 是否需要 OCR 处理
+        # 如果需要 OCR 处理（图像型PDF）
+        log("检测到图像型PDF，使用OCR模式")
+        metrics.count("ocr_pages", len(ds))
+        with metrics.stage("parse.doc_analyze"):
+            infer_result = ds.apply(doc_analyze, ocr=True)  # 应用文档分析，启用 OCR
+
+        # === OCR 处理管道 ===
+        with metrics.stage("parse.pipe"):
+            pipe_result = infer_result.pipe_ocr_mode(image_writer)  # 使用 OCR 模式处理管道
+
+    else:
+        # 如果不需要 OCR 处理（文本型PDF）
+        log("检测到文本型PDF，使用文本模式")
+        with metrics.stage("parse.doc_analyze"):
+            infer_result = ds.apply(doc_analyze, ocr=False)  # 应用文档分析，不启用OCR
+
+        # === TXT 处理管道 ===
+        with metrics.stage("parse.pipe"):
+            pipe_result = infer_result.pipe_txt_mode(image_writer)  # 使用文本模式处理管道
+
+    check_cancelled(cancel_event)
+
+    with metrics.stage("parse.markdown"):
+        ### 获取 Markdown 内容，图片链接换成实际保存的文件名
+        md_content = image_writer.rewrite_links(pipe_result.get_markdown(image_dir))  # 生成包含 图像引用 的 Markdown 内容
+
+        ### 保存 Markdown 文件
+        md_writer.write_string(f"{name_without_suff}.md", md_content)  # 将Markdown内容写入文件
+
+    if save_json or parse_cache is not None:
+        with metrics.stage("parse.json"):
+            ### 获取内容列表
+            content_list = pipe_result.get_content_list(image_dir)  # 获取文档内容的结构化列表
+            if isinstance(content_list, str):
+                content_list = json.loads(content_list)
+            image_writer.rewrite_content_list(content_list)
+
+            ### 获取中间 JSON 数据
+            middle_json_content = image_writer.rewrite_links(pipe_result.get_middle_json())  # 获取处理过程中的中间JSON数据
+
+            ### 获取模型推理结果
+            model_inference_result = infer_result.get_infer_res()  # 获取模型推理的原始结果数据
+
+            if save_json:
+                ### 保存内容列表
+                md_writer.write_string(f"{name_without_suff}_content_list.json",
+                                       json.dumps(content_list, ensure_ascii=False, indent=4))  # 将内容列表保存为 JSON 文件
+
+                ### 保存中间 JSON 数据
+                md_writer.write_string(f'{name_without_suff}_middle.json', middle_json_content)  # 将中间 JSON 数据保存到文件
+
+                ### 保存模型推理结果，之后可以用 render_debug.py 绘制可视化
+                md_writer.write_string(f"{name_without_suff}_model.json", json.dumps(model_inference_result, ensure_ascii=False))
+
+    if artifact_profile == "debug":
+        with metrics.stage("parse.draw"):
+            ### 在每一页上绘制: 模型结果
+            infer_result.draw_model(os.path.join(local_md_dir, f"{name_without_suff}_model.pdf"))  # 保存模型分析结果的可视化 PDF
+
+            ### 在每一页上绘制: 布局结果
+            pipe_result.draw_layout(os.path.join(local_md_dir, f"{name_without_suff}_layout.pdf"))  # 保存布局分析结果的可视化 PDF
+
+            ### 在每一页上绘制: 文本片段结果
+            pipe_result.draw_span(os.path.join(local_md_dir, f"{name_without_suff}_spans.pdf"))  # 保存文本片段分析结果的可视化 PDF
+
+    ### 保存到解析缓存
+    if parse_cache is not None:
+        with metrics.stage("parse.cache_store"):
+            parse_cache.put(cache_key, md_content, content_list, middle_json_content, local_image_dir, image_dir,
+                            model_json=model_inference_result)
+
+    return md_file_path
+
+
+def _parse_pdf_large(pdf_file_path, local_md_dir, image_dir, image_writer, window_size, artifact_profile, log,
+                     cancel_event, metrics):
+    """大文档模式：按页窗口分析，每个窗口的结果先写到磁盘，全部完成后逐个窗口拼接成输出文件
+
+    同一时间只有一个窗口的页面图像和推理结果在内存中，合并时也只读入一个窗口的结果。
+    总是逐页选择 OCR/文本模式；不使用解析缓存，也不绘制调试可视化（可以之后用 render_debug.py 绘制）。
+    """
+    name_without_suff = os.path.splitext(os.path.basename(pdf_file_path))[0]
+    save_json = artifact_profile in ("standard", "debug")
+
+    with metrics.stage("parse.classify"):
+        needs_ocr = classify_pages(pdf_file_path)
+    metrics.count("pages", len(needs_ocr))
+    metrics.count("ocr_pages", sum(needs_ocr))
+    log(f"大文档模式: 共{len(needs_ocr)}页，其中{sum(needs_ocr)}页需要OCR，每{window_size}页一个窗口")
+
+    with tempfile.TemporaryDirectory(prefix=f".{name_without_suff}_windows_", dir=local_md_dir) as spill_dir:
+        spilled = []
+        for start_page_id, _, infer_result, pipe_result in iter_page_windows(
+                pdf_file_path, image_writer, needs_ocr, window_size, log=log, cancel_event=cancel_event,
+                metrics=metrics):
+            with metrics.stage("parse.spill"):
+                prefix = os.path.join(spill_dir, f"{len(spilled):05d}")
+                _spill_window(prefix, start_page_id, infer_result, pipe_result, image_writer, image_dir, save_json)
+                spilled.append(prefix)
+            del infer_result, pipe_result
+
+        check_cancelled(cancel_event)
+        with metrics.stage("parse.merge"):
+            md_file_path = os.path.join(local_md_dir, f"{name_without_suff}.md")
+            with open(md_file_path, 'w', encoding='utf-8') as out:
+                for index, prefix in enumerate(spilled):
+                    if index:
+                        out.write("\n\n")
+                    with open(prefix + ".md", 'r', encoding='utf-8') as f:
+                        shutil.copyfileobj(f, out)
+            if save_json:
+                for suffix, key in (("_content_list.json", None), ("_middle.json", "pdf_info"), ("_model.json", None)):
+                    _concat_json_lists([prefix + suffix for prefix in spilled],
+                                       os.path.join(local_md_dir, f"{name_without_suff}{suffix}"), key)
+
+    if artifact_profile == "debug":
+        log("大文档模式不绘制调试可视化，可以之后用 render_debug.py 根据保存的 JSON 绘制")
+    return md_file_path
+
+
+def _spill_window(prefix, page_offset, infer_result, pipe_result, image_writer, image_dir, save_json):
+    """把一个窗口的 Markdown 和 JSON 结果写到 prefix 开头的文件，JSON 中的页号换算成原文档的页号"""
+    with open(prefix + ".md", 'w', encoding='utf-8') as f:
+        f.write(image_writer.rewrite_links(pipe_result.get_markdown(image_dir)))
+    if not save_json:
+        return
+
+    content_list = pipe_result.get_content_list(image_dir)
+    if isinstance(content_list, str):
+        content_list = json.loads(content_list)
+    for item in image_writer.rewrite_content_list(content_list):
+        if "page_idx" in item:
+            item["page_idx"] += page_offset
+
+    middle_json = json.loads(image_writer.rewrite_links(pipe_result.get_middle_json()))
+    for page in middle_json.get("pdf_info", []):
+        if "page_idx" in page:
+            page["page_idx"] += page_offset
+
+    model_json = infer_result.get_infer_res()
+    for page in model_json:
+        page_info = page.get("page_info", {})
+        if "page_no" in page_info:
+            page_info["page_no"] += page_offset
+
+    for suffix, data in (("_content_list.json", content_list), ("_middle.json", middle_json),
+                         ("_model.json", model_json)):
+        with open(prefix + suffix, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+
+
+def _concat_json_lists(paths, output_path, key=None):
+    """按顺序拼接各窗口的 JSON 列表并写入 output_path，同一时间只读入一个窗口
+
+    key 不为 None 时，列表是各文件中对象的 key 字段，其余字段取自第一个文件。
+    """
+    rest = {}
+    first_item = True
+    with open(output_path, 'w', encoding='utf-8') as out:
+        out.write("{" + json.dumps(key) + ": [" if key else "[")
+        for index, path in enumerate(paths):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if key:
+                if index == 0:
+                    rest = {name: value for name, value in data.items() if name != key}
+                data = data.get(key, [])
+            for item in data:
+                out.write(json.dumps(item, ensure_ascii=False) if first_item
+                          else ", " + json.dumps(item, ensure_ascii=False))
+                first_item = False
+        out.write("]")
+        if key:
+            for name, value in rest.items():
+                out.write(f", {json.dumps(name, ensure_ascii=False)}: {json.dumps(value, ensure_ascii=False)}")
+            out.write("}")
+
+
+def iter_markdown_windows(pdf_file_path, local_md_dir, image_dir="images", window_size=DEFAULT_WINDOW_SIZE, log=print,
+                          cancel_event=None, metrics=NO_METRICS, image_format=DEFAULT_IMAGE_FORMAT, image_quality=None):
+    """按页窗口逐段解析 PDF，每解析完一个窗口就产出该窗口的 Markdown
+
+    整篇文档只逐页分类一次，之后每个窗口的页单独组成数据集，按页路由调用 doc_analyze 和处理管道，
+    处理完就释放（见 iter_page_windows），调用方可以在后续页面仍在分析时开始处理已产出的内容。
+    不生成调试可视化、内容列表和中间 JSON，也不使用解析缓存。
+
+    参数:
+        pdf_file_path (str): PDF 文件路径
+        local_md_dir (str): 输出目录
+        image_dir (str): 图片子目录名，Markdown 中的图片引用使用该相对路径
+        window_size (int): 每个窗口的页数
+        log (callable): 日志输出函数
+        cancel_event (threading.Event): 设置后在下一个页段开始前抛出 Cancelled
+        metrics (RunMetrics): 运行指标
+        image_format (str): 图片保存格式，取值为 jpeg、webp
+        image_quality (int): 图片重新编码的质量（1-100），jpeg 为 None 时保留处理管道编码的图片
+
+    返回:
+        generator: 依次产出 (起始页, 结束页, Markdown 内容)，页码从 0 开始且包含结束页
+    """
+    with metrics.stage("parse.classify"):
+        needs_ocr = classify_pages(pdf_file_path)
+    metrics.count("pages", len(needs_ocr))
+    metrics.count("ocr_pages", sum(needs_ocr))
+    log(f"共{len(needs_ocr)}页，其中{sum(needs_ocr)}页需要OCR，每{window_size}页一个窗口")
+
+    with ContentAddressedImageWriter(os.path.join(local_md_dir, image_dir), image_format, image_quality,
+                                     metrics=metrics) as image_writer:
+        for start_page_id, end_page_id, infer_result, pipe_result in iter_page_windows(
+                pdf_file_path, image_writer, needs_ocr, window_size, log=log, cancel_event=cancel_event,
+                metrics=metrics):
+            with metrics.stage("parse.markdown"):
+                md_content = image_writer.rewrite_links(pipe_result.get_markdown(image_dir))
+            del infer_result, pipe_result
+            yield start_page_id, end_page_id, md_content
+
+if __name__ == "__main__":
+    # 创建命令行参数解析器
+    parser = argparse.ArgumentParser(description='解析 PDF 文件为 Markdown、内容列表和中间 JSON')
+    parser.add_argument('pdf_file', nargs='?', default="2024-tpami-asr-etr.pdf", help='PDF 文件路径')
+    parser.add_argument('--output_dir', default="output", help='输出目录 (默认为output)')
+    # 添加解析缓存参数
+    parser.add_argument('--cache_dir', default=DEFAULT_PARSE_CACHE_DIR,
+                        help=f'解析缓存目录 (默认为{DEFAULT_PARSE_CACHE_DIR})')
+    parser.add_argument('--cache_max_bytes', type=int, default=DEFAULT_PARSE_CACHE_MAX_BYTES,
+                        help='解析缓存大小上限，超出时淘汰最久未使用的条目 (默认为5GB)')
+    parser.add_argument('--no_cache', action='store_true', help='不使用解析缓存')
+    parser.add_argument('--refresh', action='store_true', help='忽略已有缓存，重新解析并更新缓存')
+    parser.add_argument('--document_mode', action='store_true',
+                        help='整篇文档统一使用 OCR 或文本模式，不逐页判断')
+    parser.add_argument('--artifact_profile', choices=ARTIFACT_PROFILES, default=DEFAULT_ARTIFACT_PROFILE,
+                        help='输出内容档位: minimal 只输出 Markdown 和图片，standard 另外输出 JSON，'
+                             f'debug 另外绘制可视化 PDF (默认为{DEFAULT_ARTIFACT_PROFILE})')
+    parser.add_argument('--image_format', choices=IMAGE_FORMATS, default=DEFAULT_IMAGE_FORMAT,
+                        help=f'提取出的图片的保存格式 (默认为{DEFAULT_IMAGE_FORMAT})')
+    parser.add_argument('--image_quality', type=int, default=None,
+                        help='图片重新编码的质量 1-100 (jpeg 默认不重新编码，webp 默认为80)')
+    parser.add_argument('--large_document_pages', type=int, default=LARGE_DOCUMENT_PAGES,
+                        help='页数达到该值时按页窗口分析并把中间结果写到磁盘，内存峰值不随页数增长；'
+                             f'0 表示不使用 (默认为{LARGE_DOCUMENT_PAGES})')
+    parser.add_argument('--window_size', type=int, default=LARGE_DOCUMENT_WINDOW_SIZE,
+                        help=f'大文档模式每个窗口的页数 (默认为{LARGE_DOCUMENT_WINDOW_SIZE})')
+    # 添加运行指标参数
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    metrics = metrics_from_args(args, "pdf_parse")
+    metrics.set_info(pdf=args.pdf_file)
+    parse_cache = None if args.no_cache else ParseCache(args.cache_dir, args.cache_max_bytes)
+    md_file_path = parse_pdf(args.pdf_file, args.output_dir, parse_cache=parse_cache, force_refresh=args.refresh,
+                             page_routing=not args.document_mode, artifact_profile=args.artifact_profile,
+                             metrics=metrics, large_document_pages=args.large_document_pages,
+                             large_document_window_size=args.window_size, image_format=args.image_format,
+                             image_quality=args.image_quality)
+    print(f"解析完成！Markdown 已保存到 {md_file_path}")
+    if args.metrics_file:
+        metrics.write_json(args.metrics_file)
+        print(f"运行指标已保存到 {args.metrics_file}")
@@ -1,38 +1,145 @@
+import time
+
+# 模块开始导入的时间，用于统计界面启动耗时
+IMPORT_STARTED = time.perf_counter()
+
 import os
 import re
 import json
-import time
+import importlib.util
+import queue
 import argparse
+import threading
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 from pathlib import Path
-from openai import OpenAI
-from dotenv import load_dotenv
+from contextlib import ExitStack, closing
 
-from magic_pdf.data.data_reader_writer import FileBasedDataWriter, FileBasedDataReader
-from magic_pdf.data.dataset import PymuDocDataset
-from magic_pdf.model.doc_analyze_by_custom_model import doc_analyze
-from magic_pdf.config.enums import SupportedPdfParseMethod
+# magic_pdf（连同 torch 和模型代码）和 openai 导入很慢，推迟到后台预加载线程或第一次使用时再导入，
+# 这里只导入轻量的模块，使窗口尽快出现
+from parse_options import (
+    ARTIFACT_PROFILES, DEFAULT_ARTIFACT_PROFILE, DEFAULT_IMAGE_FORMAT, DEFAULT_WINDOW_SIZE, LARGE_DOCUMENT_PAGES
+)
+from parse_cache import DEFAULT_PARSE_CACHE_DIR, DEFAULT_PARSE_CACHE_MAX_BYTES, ParseCache
+from concurrent_translate import (
+    DEFAULT_CONCURRENCY, DEFAULT_MAX_RETRIES, DEFAULT_RPM, DEFAULT_TPM, Cancelled, RateLimiter,
+    check_cancelled, format_failures, iter_in_background
+)
+from translation_cache import DEFAULT_CACHE_PATH, TranslationCache
+from translation_journal import TranslationJournal, journal_path_for
+from chunking import DEFAULT_MAX_INPUT_TOKENS, DEFAULT_MAX_OUTPUT_TOKENS
+from dedup import ParagraphRegistry
+from chunk_validation import DEFAULT_REPAIR_BUDGET
+from translation_engine import TranslationEngine, get_client
+from metrics import NO_METRICS, RunMetrics, serve_prometheus
+from batch_translate import warm_up_models
 
 # 配置文件路径
 CONFIG_FILE = os.path.join(os.path.expanduser("~"), ".pdf_translator_config.json")
 
+# 主线程检查工作线程消息的间隔（毫秒）
+POLL_INTERVAL_MS = 100
+
+# 多个目标语言之间的分隔符
+LANGUAGE_SEPARATORS = re.compile(r'[,，、;；]')
+
+# 任务状态
+JOB_WAITING = "等待中"
+JOB_RUNNING = "处理中"
+JOB_DONE = "完成"
+JOB_FAILED = "失败"
+JOB_CANCELLED = "已取消"
+
+def parse_languages(text):
+    """把"中文, 日文、英文"这样的输入拆成目标语言列表（去掉空白和重复项）"""
+    languages = []
+    for language in LANGUAGE_SEPARATORS.split(text):
+        language = language.strip()
+        if language and language not in languages:
+            languages.append(language)
+    return languages
+
+
 class PDFTranslator:
     def __init__(self, master):
         self.master = master
         self.master.title("PDF解析与翻译工具")
-        self.master.geometry("700x500")
+        self.master.geometry("700x650")
         self.master.resizable(True, True)
         
         # 加载配置
         self.config = self.load_config()
         
+        # 工作线程发给界面的消息（日志、状态、任务进度），由主线程定时取出处理
+        self.events = queue.SimpleQueue()
+        
+        # 任务队列：所有任务由一个工作线程依次处理，界面线程只负责显示
+        self.jobs = queue.Queue()
+        self.job_records = {}
+        self.next_job_id = 1
+        self.current_job = None
+        self.finished_jobs = []
+        
+        # 持久化翻译缓存
+        self.cache = None
+        if self.config.get("cache_enabled", True):
+            try:
+                self.cache = TranslationCache(self.config.get("cache_path", DEFAULT_CACHE_PATH))
+            except Exception as e:
+                print(f"打开翻译缓存出错: {e}")
+        
+        # 本轮任务（直到队列清空）中缓存了段落译文的段落，之后的任务和页窗口中再次出现时直接复用
+        self.paragraph_registry = ParagraphRegistry()
+        
+        # 所有任务累计的运行指标；配置了 metrics_port 时以 Prometheus 文本格式提供
+        self.total_metrics = RunMetrics("pdf_translator")
+        if self.config.get("metrics_port"):
+            try:
+                serve_prometheus(lambda: self.total_metrics, self.config["metrics_port"])
+            except OSError as e:
+                print(f"启动指标服务出错: {e}")
+        
         # 创建UI
         self.create_widgets()
         
         # 如果有保存的API密钥，则自动填充
         if self.config.get("api_key"):
             self.api_key_entry.insert(0, self.config["api_key"])
+        
+        # 模型预加载完成（或失败）后设置，工作线程在解析前等待它
+        self.models_ready = threading.Event()
+        
+        # 启动工作线程和消息轮询；窗口显示后再开始在后台预加载模型
+        threading.Thread(target=self.worker_loop, daemon=True).start()
+        self.master.after(POLL_INTERVAL_MS, self.poll_events)
+        self.master.after(POLL_INTERVAL_MS, self.start_warm_up)
+    
+    def start_warm_up(self):
+        """窗口已显示，记录启动耗时并在后台线程中导入 magic_pdf、加载模型"""
+        self.log(f"界面已就绪，启动用时{time.perf_counter() - IMPORT_STARTED:.2f}秒，正在后台加载模型...")
+        threading.Thread(target=self.warm_up, daemon=True).start()
+    
+    def warm_up(self):
+        """在后台线程中导入解析模块并预加载文本模式和OCR模式的模型"""
+        start = time.perf_counter()
+        try:
+            import pdf_parse  # noqa: F401  导入 magic_pdf 和 torch
+            if self.config.get("warm_up_models", True):
+                warm_up_models(self.log)
+            self.log(f"模型已就绪，用时{time.perf_counter() - start:.1f}秒")
+        except Exception as e:
+            # 预加载失败不影响使用，解析时会再次导入并加载
+            self.log(f"预加载模型失败: {e}")
+        finally:
+            self.models_ready.set()
+    
+    def wait_for_models(self, cancel_event):
+        """等待后台预加载完成，避免与预加载线程同时加载同一个模型"""
+        if not self.models_ready.is_set():
+            self.log("等待模型加载完成...")
+            self.update_status("正在加载模型...")
+            while not self.models_ready.wait(0.5):
+                check_cancelled(cancel_event)
     
     def load_config(self):
         """加载配置文件"""
@@ -81,12 +188,23 @@ class PDFTranslator:
         translate_frame = ttk.LabelFrame(main_frame, text="翻译设置", padding="10")
         translate_frame.pack(fill=tk.X, pady=5)
         
+        # 可以输入多个语言（用逗号或顿号分隔），解析一次后同时翻译成所有语言
         ttk.Label(translate_frame, text="目标语言:").grid(row=0, column=0, sticky=tk.W, padx=5, pady=5)
         self.target_lang_var = tk.StringVar(value="中文")
         ttk.Combobox(translate_frame, textvariable=self.target_lang_var, 
                     values=["中文", "英文", "日文", "韩文", "法文", "德文", "西班牙文", "俄文"]).grid(
                     row=0, column=1, sticky=tk.W, padx=5, pady=5)
         
+        ttk.Label(translate_frame, text="并发数:").grid(row=1, column=0, sticky=tk.W, padx=5, pady=5)
+        self.concurrency_var = tk.IntVar(value=self.config.get("concurrency", DEFAULT_CONCURRENCY))
+        ttk.Spinbox(translate_frame, from_=1, to=32, textvariable=self.concurrency_var, width=5).grid(
+                   row=1, column=1, sticky=tk.W, padx=5, pady=5)
+        
+        ttk.Label(translate_frame, text="每分钟请求数:").grid(row=2, column=0, sticky=tk.W, padx=5, pady=5)
+        self.rpm_var = tk.IntVar(value=self.config.get("rpm", DEFAULT_RPM))
+        ttk.Spinbox(translate_frame, from_=0, to=10000, textvariable=self.rpm_var, width=8).grid(
+                   row=2, column=1, sticky=tk.W, padx=5, pady=5)
+        
         # 输出设置
         output_frame = ttk.LabelFrame(main_frame, text="输出设置", padding="10")
         output_frame.pack(fill=tk.X, pady=5)
@@ -95,6 +213,19 @@ class PDFTranslator:
         ttk.Checkbutton(output_frame, text="保存到桌面", variable=self.save_to_desktop_var).grid(
                        row=0, column=0, sticky=tk.W, padx=5, pady=5)
         
+        self.refresh_parse_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(output_frame, text="重新解析（忽略解析缓存）", variable=self.refresh_parse_var).grid(
+                       row=0, column=1, sticky=tk.W, padx=5, pady=5)
+        
+        self.stream_var = tk.BooleanVar(value=self.config.get("stream", False))
+        ttk.Checkbutton(output_frame, text="边解析边翻译（不使用解析缓存）", variable=self.stream_var).grid(
+                       row=1, column=0, columnspan=2, sticky=tk.W, padx=5, pady=5)
+        
+        ttk.Label(output_frame, text="输出内容:").grid(row=2, column=0, sticky=tk.W, padx=5, pady=5)
+        self.artifact_profile_var = tk.StringVar(value=self.config.get("artifact_profile", DEFAULT_ARTIFACT_PROFILE))
+        ttk.Combobox(output_frame, textvariable=self.artifact_profile_var, values=list(ARTIFACT_PROFILES),
+                    state="readonly", width=10).grid(row=2, column=1, sticky=tk.W, padx=5, pady=5)
+        
         # 进度条
         progress_frame = ttk.Frame(main_frame)
         progress_frame.pack(fill=tk.X, pady=10)
@@ -106,6 +237,18 @@ class PDFTranslator:
         self.status_var = tk.StringVar(value="就绪")
         ttk.Label(progress_frame, textvariable=self.status_var).pack(anchor=tk.W, padx=5)
         
+        # 任务队列
+        jobs_frame = ttk.LabelFrame(main_frame, text="任务队列", padding="10")
+        jobs_frame.pack(fill=tk.X, pady=5)
+        
+        self.jobs_tree = ttk.Treeview(jobs_frame, columns=("file", "language", "state", "progress"),
+                                      show="headings", height=4)
+        for column, text, width in (("file", "文件", 330), ("language", "目标语言", 80),
+                                    ("state", "状态", 80), ("progress", "进度", 60)):
+            self.jobs_tree.heading(column, text=text)
+            self.jobs_tree.column(column, width=width, anchor=tk.W)
+        self.jobs_tree.pack(fill=tk.X)
+        
         # 日志区域
         log_frame = ttk.LabelFrame(main_frame, text="处理日志", padding="10")
         log_frame.pack(fill=tk.BOTH, expand=True, pady=5)
@@ -118,6 +261,14 @@ class PDFTranslator:
         button_frame.pack(fill=tk.X, pady=10)
         
         ttk.Button(button_frame, text="开始处理", command=self.start_process).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(button_frame, text="取消任务", command=self.cancel_jobs).pack(side=tk.RIGHT, padx=5)
+    
+    def get_parse_cache(self):
+        """按配置创建解析缓存，未启用时返回None"""
+        if not self.config.get("parse_cache_enabled", True):
+            return None
+        return ParseCache(self.config.get("parse_cache_dir", DEFAULT_PARSE_CACHE_DIR),
+                          self.config.get("parse_cache_max_bytes", DEFAULT_PARSE_CACHE_MAX_BYTES))
     
     def save_api_key(self):
         """保存API密钥到配置文件"""
@@ -128,7 +279,7 @@ class PDFTranslator:
         
         # 测试API密钥是否有效
         try:
-            client = OpenAI(api_key=api_key)
+            client = get_client(api_key, self.config.get("base_url"))
             # 简单测试API连接
             response = client.chat.completions.create(
                 model="gpt-3.5-turbo",
@@ -143,29 +294,50 @@ class PDFTranslator:
             messagebox.showerror("错误", f"API密钥无效: {str(e)}")
     
     def browse_file(self):
-        """浏览并选择PDF文件"""
-        file_path = filedialog.askopenfilename(
+        """浏览并选择PDF文件（可多选，多个路径用分号分隔）"""
+        file_paths = filedialog.askopenfilenames(
             title="选择PDF文件",
             filetypes=[("PDF文件", "*.pdf")]
         )
-        if file_path:
-            self.file_path_var.set(file_path)
+        if file_paths:
+            self.file_path_var.set(";".join(file_paths))
     
     def log(self, message):
-        """添加日志消息"""
-        self.log_text.insert(tk.END, f"{message}\n")
-        self.log_text.see(tk.END)
-        self.master.update()
+        """添加日志消息（可在任意线程中调用）"""
+        self.events.put(("log", message))
     
     def update_status(self, message, progress=None):
-        """更新状态和进度条"""
-        self.status_var.set(message)
-        if progress is not None:
-            self.progress_var.set(progress)
-        self.master.update()
+        """更新状态和进度条（可在任意线程中调用），进度同时记到当前任务上"""
+        job = self.current_job
+        self.events.put(("status", job["id"] if job else None, message, progress))
+    
+    def poll_events(self):
+        """在主线程中处理工作线程发来的消息，然后安排下一次轮询"""
+        try:
+            while True:
+                event = self.events.get_nowait()
+                kind = event[0]
+                if kind == "log":
+                    self.log_text.insert(tk.END, f"{event[1]}\n")
+                    self.log_text.see(tk.END)
+                elif kind == "status":
+                    _, job_id, message, progress = event
+                    self.status_var.set(message)
+                    if progress is not None:
+                        self.progress_var.set(progress)
+                        if job_id is not None:
+                            self.jobs_tree.set(job_id, "progress", f"{progress:.0f}%")
+                elif kind == "job":
+                    _, job_id, state = event
+                    self.jobs_tree.set(job_id, "state", state)
+                elif kind == "idle":
+                    self.show_summary()
+        except queue.Empty:
+            pass
+        self.master.after(POLL_INTERVAL_MS, self.poll_events)
     
     def start_process(self):
-        """开始处理PDF文件"""
+        """把选择的PDF文件加入任务队列"""
         # 检查API密钥
         api_key = self.api_key_entry.get().strip()
         if not api_key:
@@ -173,27 +345,110 @@ class PDFTranslator:
             return
         
         # 检查文件路径
-        pdf_file_path = self.file_path_var.get().strip()
-        if not pdf_file_path or not os.path.exists(pdf_file_path):
+        pdf_file_paths = [path.strip() for path in self.file_path_var.get().split(";") if path.strip()]
+        if not pdf_file_paths or not all(os.path.exists(path) for path in pdf_file_paths):
             messagebox.showerror("错误", "请选择有效的PDF文件")
             return
         
-        # 获取目标语言
-        target_language = self.target_lang_var.get()
-        
-        # 开始处理
-        try:
-            self.update_status("开始处理...", 0)
-            self.process_pdf(pdf_file_path, api_key, target_language)
-        except Exception as e:
-            self.log(f"处理过程中出错: {str(e)}")
-            messagebox.showerror("错误", f"处理失败: {str(e)}")
-            self.update_status("处理失败", 0)
+        # 获取目标语言（可以有多个）
+        target_languages = parse_languages(self.target_lang_var.get())
+        if not target_languages:
+            messagebox.showerror("错误", "请输入目标语言")
+            return
+        target_language = "、".join(target_languages)
+        
+        # 保存并发与限流设置
+        self.config["concurrency"] = self.concurrency_var.get()
+        self.config["rpm"] = self.rpm_var.get()
+        self.config["stream"] = self.stream_var.get()
+        self.config["artifact_profile"] = self.artifact_profile_var.get()
+        self.save_config()
+        
+        # 在主线程中读取界面选项，工作线程只使用任务中的副本
+        for pdf_file_path in pdf_file_paths:
+            job = {
+                "id": str(self.next_job_id),
+                "pdf_file_path": pdf_file_path,
+                "api_key": api_key,
+                "target_language": target_language,
+                "target_languages": target_languages,
+                "save_to_desktop": self.save_to_desktop_var.get(),
+                "refresh_parse": self.refresh_parse_var.get(),
+                "stream": self.stream_var.get(),
+                "artifact_profile": self.artifact_profile_var.get(),
+                "cancel_event": threading.Event(),
+            }
+            self.next_job_id += 1
+            self.job_records[job["id"]] = job
+            self.jobs_tree.insert("", tk.END, iid=job["id"],
+                                  values=(os.path.basename(pdf_file_path), target_language, JOB_WAITING, "0%"))
+            self.jobs.put(job)
+        self.log(f"已加入{len(pdf_file_paths)}个任务")
+    
+    def cancel_jobs(self):
+        """取消选中的任务；没有选中时取消正在处理的任务"""
+        job_ids = self.jobs_tree.selection()
+        if not job_ids and self.current_job is not None:
+            job_ids = [self.current_job["id"]]
+        for job_id in job_ids:
+            job = self.job_records[job_id]
+            if not job["cancel_event"].is_set():
+                job["cancel_event"].set()
+                self.log(f"正在取消: {os.path.basename(job['pdf_file_path'])}")
+    
+    def worker_loop(self):
+        """工作线程：依次处理任务队列中的任务"""
+        while True:
+            job = self.jobs.get()
+            if job["cancel_event"].is_set():
+                self.events.put(("job", job["id"], JOB_CANCELLED))
+            else:
+                self.current_job = job
+                self.events.put(("job", job["id"], JOB_RUNNING))
+                self.update_status("开始处理...", 0)
+                try:
+                    job["result"] = self.process_pdf(job)
+                    state = JOB_DONE
+                except Cancelled:
+                    self.log(f"已取消: {os.path.basename(job['pdf_file_path'])}")
+                    self.update_status("已取消")
+                    state = JOB_CANCELLED
+                except Exception as e:
+                    self.log(f"处理过程中出错: {str(e)}")
+                    self.update_status("处理失败")
+                    job["error"] = str(e)
+                    state = JOB_FAILED
+                self.current_job = None
+                self.finished_jobs.append(job)
+                self.events.put(("job", job["id"], state))
+            if self.jobs.empty():
+                # 队列清空后开始新的一轮，段落记录不跨轮保留
+                self.paragraph_registry = ParagraphRegistry()
+                self.events.put(("idle",))
+    
+    def show_summary(self):
+        """队列处理完后汇总显示结果"""
+        finished, self.finished_jobs = self.finished_jobs, []
+        succeeded = [job for job in finished if job.get("result")]
+        failed = [job for job in finished if job.get("error")]
+        if failed:
+            details = "\n".join(f"{os.path.basename(job['pdf_file_path'])}: {job['error']}" for job in failed)
+            messagebox.showerror("错误", f"{len(failed)}个任务处理失败:\n{details}")
+        partial = [job for job in succeeded if job.get("failed_chunks")]
+        if partial:
+            details = "\n".join(f"{os.path.basename(job['pdf_file_path'])}: {len(job['failed_chunks'])}个文本块"
+                                for job in partial)
+            messagebox.showwarning("部分失败", f"以下任务有文本块翻译失败，译文中保留了原文（详见日志）:\n{details}")
+        if succeeded:
+            paths = "\n".join(path for job in succeeded for path in job["result"])
+            messagebox.showinfo("成功", f"PDF已成功解析并翻译！\n结果保存在:\n{paths}")
     
-    def process_pdf(self, pdf_file_path, api_key, target_language):
-        """处理PDF文件：解析和翻译"""
+    def process_pdf(self, job):
+        """在工作线程中处理一个任务：解析和翻译，返回各目标语言的译文文件路径列表"""
+        pdf_file_path = job["pdf_file_path"]
+        
         # 设置输出目录
-        if self.save_to_desktop_var.get():
+        if job["save_to_desktop"]:
             desktop_path = os.path.join(os.path.expanduser("~"), "Desktop")
             output_dir = os.path.join(desktop_path, "pdf_translation_output")
         else:
@@ -207,181 +462,218 @@ class PDFTranslator:
         pdf_file_name = os.path.basename(pdf_file_path)
         name_without_suff = os.path.splitext(pdf_file_name)[0]
         
-        # 1. 解析PDF
-        self.log(f"开始解析PDF: {pdf_file_name}")
-        self.update_status("正在解析PDF...", 10)
-        
-        # 设置输出目录
-        local_image_dir = os.path.join(output_dir, "images")
-        local_md_dir = output_dir
-        image_dir = "images"
-        
-        # 创建文件写入器实例
-        image_writer = FileBasedDataWriter(local_image_dir)
-        md_writer = FileBasedDataWriter(local_md_dir)
-        
-        # 读取PDF文件内容
-        reader = FileBasedDataReader("")
-        pdf_bytes = reader.read(pdf_file_path)
-        
-        # 创建数据集实例
-        ds = PymuDocDataset(pdf_bytes)
-        
-        # 推理处理
-        self.log("正在进行文档分析...")
-        if ds.classify() == SupportedPdfParseMethod.OCR:
-            self.log("检测到图像型PDF，使用OCR模式")
-            infer_result = ds.apply(doc_analyze, ocr=True)
-            pipe_result = infer_result.pipe_ocr_mode(image_writer)
-        else:
-            self.log("检测到文本型PDF，使用文本模式")
-            infer_result = ds.apply(doc_analyze, ocr=False)
-            pipe_result = infer_result.pipe_txt_mode(image_writer)
-        
-        self.update_status("正在生成Markdown...", 30)
-        
-        # 保存分析结果
-        infer_result.draw_model(os.path.join(local_md_dir, f"{name_without_suff}_model.pdf"))
-        pipe_result.draw_layout(os.path.join(local_md_dir, f"{name_without_suff}_layout.pdf"))
-        pipe_result.draw_span(os.path.join(local_md_dir, f"{name_without_suff}_spans.pdf"))
-        
-        # 获取Markdown内容
-        md_content = pipe_result.get_markdown(image_dir)
-        
-        # 保存Markdown文件
-        md_file_path = os.path.join(local_md_dir, f"{name_without_suff}.md")
-        pipe_result.dump_md(md_writer, f"{name_without_suff}.md", image_dir)
-        
-        self.log(f"Markdown文件已保存: {md_file_path}")
-        
-        # 2. 翻译Markdown
-        self.log(f"开始翻译Markdown到{target_language}...")
-        self.update_status("正在翻译...", 50)
-        
-        # 初始化OpenAI客户端
-        client = OpenAI(api_key=api_key)
-        
-        # 读取Markdown文件
-        with open(md_file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # 提取并保护特殊元素
-        self.log("提取并保护特殊元素...")
-        modified_content, special_elements = self.extract_special_elements(content)
-        
-        # 将文本分成适合API调用的块
-        chunks = self.chunk_text(modified_content)
-        total_chunks = len(chunks)
-        self.log(f"文本已分割为{total_chunks}个块")
-        
-        # 翻译每个块
-        translated_chunks = []
-        for i, chunk in enumerate(chunks):
-            progress = 50 + (i / total_chunks) * 40
-            self.update_status(f"正在翻译第 {i+1}/{total_chunks} 块...", progress)
-            self.log(f"正在翻译第 {i+1}/{total_chunks} 块...")
-            
-            # 调用翻译函数处理当前块
-            translated_chunk = self.translate_text(client, chunk, target_language)
-            translated_chunks.append(translated_chunk)
-            
-            # 添加延迟以避免API限制
-            if i < total_chunks - 1:
-                time.sleep(1)
-        
-        # 合并翻译后的块
-        self.log("合并翻译结果...")
-        translated_content = "\n\n".join(translated_chunks)
-        
-        # 恢复特殊元素
-        self.log("恢复特殊元素...")
-        final_content = self.restore_special_elements(translated_content, special_elements)
-        
-        # 保存翻译后的文件
-        translated_file_path = os.path.join(local_md_dir, f"{name_without_suff}_{target_language}.md")
-        with open(translated_file_path, 'w', encoding='utf-8') as f:
-            f.write(final_content)
+        # 翻译引擎：API 客户端按密钥和服务地址在所有任务之间共享，复用已建立的连接
+        engine = TranslationEngine(api_key=job["api_key"], base_url=self.config.get("base_url"), cache=self.cache,
+                                   max_input_tokens=self.config.get("max_input_tokens", DEFAULT_MAX_INPUT_TOKENS),
+                                   max_output_tokens=self.config.get("max_output_tokens", DEFAULT_MAX_OUTPUT_TOKENS),
+                                   stream=self.config.get("stream_responses", True))
+        
+        # 本任务的运行指标，结束时（包括失败和取消）写入输出目录
+        metrics = RunMetrics(name_without_suff,
+                             profile_stages=self.config.get("profile_stages", []),
+                             trace_memory_stages=self.config.get("trace_memory_stages", []),
+                             profile_dir=os.path.join(output_dir, f"{name_without_suff}_profiles"))
+        metrics.set_info(pdf=pdf_file_path, language=job["target_languages"], model=engine.model, stream=job["stream"])
+        try:
+            translated_file_paths = self.run_pipeline(job, output_dir, engine, name_without_suff, metrics)
+        finally:
+            self.total_metrics.merge(metrics)
+            if self.config.get("metrics_enabled", True):
+                metrics_file_path = os.path.join(output_dir, f"{name_without_suff}_metrics.json")
+                metrics.write_json(metrics_file_path)
+                self.log(f"运行指标已保存: {metrics_file_path}")
         
         self.update_status("处理完成", 100)
-        self.log(f"翻译完成！结果已保存到: {translated_file_path}")
+        for translated_file_path in translated_file_paths:
+            self.log(f"翻译完成！结果已保存到: {translated_file_path}")
+        
+        if self.cache is not None:
+            stats = self.cache.stats()
+            self.log(f"翻译缓存: 命中 {stats['hits']} 次，未命中 {stats['misses']} 次")
         
-        # 显示成功消息
-        messagebox.showinfo("成功", f"PDF已成功解析并翻译！\n结果保存在: {translated_file_path}")
+        return translated_file_paths
     
-    def extract_special_elements(self, text):
-        """提取并保护特殊元素（公式、表格、代码块等）"""
-        special_elements = []
-        
-        patterns = [
-            r'\$\$.*?\$\$|\$.*?\$',
-            r'<html>.*?</html>',
-            r'(\|.*\|[\r\n]+)(\|[-:| ]+\|[\r\n]+)((\|.*\|[\r\n]+)+)',
-            r'```.*?```',
-            r'!\[.*?\]\(.*?\)'
-        ]
-        
-        combined_pattern = '|'.join(patterns)
-        matches = re.finditer(combined_pattern, text, re.DOTALL)
-        
-        modified_text = text
-        for i, match in enumerate(matches):
-            placeholder = f"[PROTECTED_ELEMENT_{i}]"
-            special_elements.append(match.group(0))
-            modified_text = modified_text.replace(match.group(0), placeholder, 1)
-        
-        return modified_text, special_elements
+    def run_pipeline(self, job, output_dir, engine, name_without_suff, metrics):
+        """解析并翻译一个任务的PDF，返回各目标语言的译文文件路径列表"""
+        translated_file_paths = {language: os.path.join(output_dir, f"{name_without_suff}_{language}.md")
+                                 for language in job["target_languages"]}
+        
+        # 断点日志：每种语言一个，逐块记录完成的译文，中断后重新处理同一文件时跳过已完成的块
+        journals = {language: TranslationJournal(journal_path_for(path))
+                    for language, path in translated_file_paths.items()}
+        try:
+            self.translate_pdf(job, output_dir, engine, name_without_suff, translated_file_paths, journals, metrics)
+        finally:
+            for journal in journals.values():
+                journal.close()
+        failed_languages = {failure["language"] for failure in job.get("failed_chunks", [])}
+        for language, journal in journals.items():
+            if language not in failed_languages:
+                journal.discard()
+        
+        return list(translated_file_paths.values())
     
-    def restore_special_elements(self, text, special_elements):
-        """恢复特殊元素"""
-        for i, element in enumerate(special_elements):
-            placeholder = f"[PROTECTED_ELEMENT_{i}]"
-            text = text.replace(placeholder, element, 1)
-        return text
+    def translate_pdf(self, job, output_dir, engine, name_without_suff, translated_file_paths, journals, metrics):
+        """按任务设置解析并翻译PDF，每种目标语言的译文写入 translated_file_paths 中对应的文件"""
+        pdf_file_path = job["pdf_file_path"]
+        pdf_file_name = os.path.basename(pdf_file_path)
+        target_language = job["target_language"]
+        target_languages = job["target_languages"]
+        cancel_event = job["cancel_event"]
+        
+        # 解析模块在后台预加载线程中已经导入，这里直接取用
+        self.wait_for_models(cancel_event)
+        from pdf_parse import parse_pdf
+        
+        if job["stream"]:
+            # 边解析边翻译
+            self.process_pdf_streaming(pdf_file_path, output_dir, engine, target_languages, name_without_suff,
+                                       cancel_event, metrics, journals)
+        else:
+            # 1. 解析PDF
+            self.log(f"开始解析PDF: {pdf_file_name}")
+            self.update_status("正在解析PDF...", 10)
+            
+            # 解析PDF（命中解析缓存时跳过文档分析）
+            md_file_path = parse_pdf(pdf_file_path, output_dir, "images",
+                                     parse_cache=self.get_parse_cache(),
+                                     force_refresh=job["refresh_parse"],
+                                     page_routing=self.config.get("page_routing", True),
+                                     artifact_profile=job["artifact_profile"],
+                                     log=self.log, cancel_event=cancel_event, metrics=metrics,
+                                     large_document_pages=self.config.get("large_document_pages",
+                                                                          LARGE_DOCUMENT_PAGES),
+                                     image_format=self.config.get("image_format", DEFAULT_IMAGE_FORMAT),
+                                     image_quality=self.config.get("image_quality"))
+            
+            self.log(f"Markdown文件已保存: {md_file_path}")
+            
+            # 2. 翻译Markdown
+            self.log(f"开始翻译Markdown到{target_language}...")
+            self.update_status("正在翻译...", 50)
+            
+            # 读取Markdown文件
+            with open(md_file_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            
+            # 译文边翻译边按顺序写入各语言的文件
+            with ExitStack() as stack, metrics.stage("translate"):
+                outputs = {language: stack.enter_context(open(path, 'w', encoding='utf-8'))
+                           for language, path in translated_file_paths.items()}
+                self.translate_markdown(engine, content, target_languages, (50, 90), cancel_event, metrics, journals,
+                                        outputs)
     
-    def chunk_text(self, text, max_length=4000):
-        """将文本分成适合API调用的块"""
-        paragraphs = re.split(r'\n\s*\n', text)
-        
-        chunks = []
-        current_chunk = ""
+    def process_pdf_streaming(self, pdf_file_path, output_dir, engine, target_languages, name_without_suff,
+                              cancel_event=None, metrics=NO_METRICS, journals=None):
+        """边解析边翻译：后台线程按页窗口解析，主线程把已解析完的窗口翻译成所有目标语言，并按页序追加写入结果"""
+        import fitz
+        from pdf_parse import iter_markdown_windows
+        window_size = self.config.get("stream_window_size", DEFAULT_WINDOW_SIZE)
+        # 进度条的 10% 到 90% 按页数分给各窗口，每个窗口的翻译进度在其中推进
+        with fitz.open(pdf_file_path) as doc:
+            page_count = max(1, doc.page_count)
+        md_file_path = os.path.join(output_dir, f"{name_without_suff}.md")
+        
+        self.log(f"开始边解析边翻译: {os.path.basename(pdf_file_path)}")
+        self.update_status("正在解析第一个窗口...", 10)
+        start_time = time.perf_counter()
+        
+        with ExitStack() as stack:
+            # 翻译出错或取消时关闭后台解析，释放解析线程、PDF 文档和图片写出线程
+            windows = stack.enter_context(closing(iter_in_background(
+                iter_markdown_windows(pdf_file_path, output_dir, "images", window_size, log=self.log,
+                                      cancel_event=cancel_event, metrics=metrics,
+                                      image_format=self.config.get("image_format", DEFAULT_IMAGE_FORMAT),
+                                      image_quality=self.config.get("image_quality")))))
+            md_file = stack.enter_context(open(md_file_path, 'w', encoding='utf-8'))
+            translated_files = {
+                language: stack.enter_context(open(os.path.join(output_dir, f"{name_without_suff}_{language}.md"),
+                                                   'w', encoding='utf-8'))
+                for language in target_languages
+            }
+            for index, (start_page_id, end_page_id, md_content) in enumerate(windows):
+                check_cancelled(cancel_event)
+                pages = f"第{start_page_id + 1}-{end_page_id + 1}页"
+                self.log(f"{pages}解析完成，开始翻译")
+                progress_range = (10 + 80 * start_page_id / page_count, 10 + 80 * (end_page_id + 1) / page_count)
+                self.update_status(f"正在翻译{pages}...", progress_range[0])
+                
+                separator = "\n\n" if index else ""
+                md_file.write(separator + md_content)
+                for translated_file in translated_files.values():
+                    translated_file.write(separator)
+                with metrics.stage("translate"):
+                    self.translate_markdown(engine, md_content, target_languages, progress_range, cancel_event,
+                                            metrics=metrics, journals=journals, outputs=translated_files)
+                
+                elapsed = time.perf_counter() - start_time
+                if index == 0:
+                    metrics.set_info(first_window_seconds=round(elapsed, 3))
+                    self.log(f"首个窗口的译文已写入，用时{elapsed:.1f}秒")
+                self.log(f"{pages}翻译完成，累计用时{elapsed:.1f}秒")
         
-        for paragraph in paragraphs:
-            if len(current_chunk) + len(paragraph) > max_length and current_chunk:
-                chunks.append(current_chunk)
-                current_chunk = paragraph
-            else:
-                if current_chunk:
-                    current_chunk += "\n\n" + paragraph
-                else:
-                    current_chunk = paragraph
-        
-        if current_chunk:
-            chunks.append(current_chunk)
-        
-        return chunks
+        self.log(f"Markdown文件已保存: {md_file_path}")
     
-    def translate_text(self, client, text, target_language="中文"):
-        """使用OpenAI API翻译文本"""
-        try:
-            response = client.chat.completions.create(
-                model="gpt-4-turbo",
-                messages=[
-                    {"role": "system", "content": f"你是一个专业的学术翻译器。请将以下文本翻译成{target_language}，保持学术风格和专业术语的准确性。保留所有原始格式，包括标题层级、列表和段落结构。不要翻译占位符标记（如[PROTECTED_ELEMENT_X]）。"},
-                    {"role": "user", "content": text}
-                ],
-                temperature=0.1,
-                max_tokens=4096
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            self.log(f"翻译过程中出错: {e}")
-            return text
+    def translate_markdown(self, engine, content, target_languages, progress_range=None, cancel_event=None,
+                           metrics=NO_METRICS, journals=None, outputs=None):
+        """把一段Markdown内容翻译成所有目标语言，返回 {目标语言: 恢复了特殊元素的译文}
+        
+        特殊元素保护、去重和分块只做一次，所有语言的请求一起调度；提供断点日志时跳过其中已完成的块。
+        提供 outputs（{目标语言: 文件}）时译文边翻译边按顺序写入，返回空字典。
+        """
+        # 流式接收回复时按收到的令牌数显示进度，命中缓存的块没有令牌流，按完成的块数补上
+        fractions = {"chunks": 0.0, "tokens": 0.0}
+        
+        def report(message):
+            progress = None
+            if progress_range is not None:
+                progress = progress_range[0] + max(fractions.values()) * (progress_range[1] - progress_range[0])
+            self.update_status(message, progress)
+        
+        def on_chunk_done(done, total):
+            fractions["chunks"] = done / total
+            report(f"已翻译 {done}/{total} 块...")
+        
+        def on_tokens(received, expected):
+            # 预计的输出令牌数只是估算，全部块完成前最多显示到 99%
+            fractions["tokens"] = min(received / expected, 0.99)
+            report(f"已接收 {received} 令牌（预计约 {expected}）...")
+        
+        # 并发翻译每个块，由限流器控制请求速率
+        final_contents, failures, chunks = engine.translate_markdown(
+            content,
+            target_languages,
+            concurrency=self.config.get("concurrency", DEFAULT_CONCURRENCY),
+            limiter=RateLimiter(rpm=self.config.get("rpm", DEFAULT_RPM), tpm=self.config.get("tpm", DEFAULT_TPM)),
+            on_chunk_done=on_chunk_done,
+            cancel_event=cancel_event,
+            max_retries=self.config.get("max_retries", DEFAULT_MAX_RETRIES),
+            metrics=metrics,
+            journals=journals,
+            dedup=self.config.get("dedup", True),
+            registry=self.paragraph_registry,
+            validate=self.config.get("validate", True),
+            repair_budget=self.config.get("repair_budget", DEFAULT_REPAIR_BUDGET),
+            log=self.log,
+            outputs=outputs,
+            on_tokens=on_tokens,
+        )
+        
+        # 失败的块保留原文，记录到当前任务中，结束时一并报告
+        for language, language_failures in failures.items():
+            if not language_failures:
+                continue
+            self.log(f"{language}: 有{len(language_failures)}个文本块重试后仍翻译失败，保留原文:")
+            for line in format_failures(language_failures, chunks):
+                self.log(f"  {line}")
+            if self.current_job is not None:
+                self.current_job.setdefault("failed_chunks", []).extend(
+                    dict(failure, language=language) for failure in language_failures)
+        return final_contents
 
 def main():
-    # 检查依赖 
-    try:
-        import magic_pdf
-    except ImportError:
+    # 检查依赖（只查找不导入，导入留给后台预加载线程）
+    if importlib.util.find_spec("magic_pdf") is None:
         print("缺少必要的依赖，正在尝试安装...")
         # 在打包的环境中，我们应该避免使用os.system来安装包
         try:
@@ -0,0 +1,34 @@
+"""
+根据保存的解析结果绘制调试可视化 PDF
+
+以 standard 或 debug 档位解析时会保存 {name}_middle.json 和 {name}_model.json，
+之后可以随时用本脚本绘制模型结果、布局和文本片段的可视化，不需要重新分析文档。
+
+用法:
+    python render_debug.py paper.pdf output/paper_middle.json --model_json output/paper_model.json
+    python render_debug.py paper.pdf output/paper_middle.json --kinds layout spans --output_dir debug
+"""
+import os
+import argparse
+
+from pdf_parse import VISUALIZATION_KINDS, render_visualizations
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='根据保存的中间 JSON 绘制调试可视化 PDF')
+    parser.add_argument('pdf_file', help='原始 PDF 文件路径')
+    parser.add_argument('middle_json', help='中间 JSON 文件路径（{name}_middle.json）')
+    parser.add_argument('--model_json', default=None,
+                        help='模型推理结果 JSON 文件路径，默认为中间 JSON 旁边的 {name}_model.json')
+    parser.add_argument('--kinds', nargs='+', choices=VISUALIZATION_KINDS, default=list(VISUALIZATION_KINDS),
+                        help='要绘制的种类 (默认为全部)')
+    parser.add_argument('--output_dir', default=None, help='输出目录 (默认与中间 JSON 相同)')
+    args = parser.parse_args()
+
+    model_json = args.model_json
+    if model_json is None and args.middle_json.endswith("_middle.json"):
+        model_json = args.middle_json[:-len("_middle.json")] + "_model.json"
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    for path in render_visualizations(args.pdf_file, args.middle_json, model_json, args.output_dir, args.kinds):
+        print(f"已生成: {path}")
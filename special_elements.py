@@ -0,0 +1,88 @@
+"""
+特殊元素（公式、表格、代码块、图片）的保护与恢复
+
+翻译前用占位符替换特殊元素，翻译后再把占位符还原。
+提取时一次扫描记录所有匹配的起止位置，再一次性拼接出替换后的文本；
+恢复时用单个正则替换回调还原所有占位符。两者都是线性时间。
+"""
+import re
+
+# 占位符格式及其匹配模式
+PLACEHOLDER_TEMPLATE = "[PROTECTED_ELEMENT_{}]"
+PLACEHOLDER_PATTERN = re.compile(r'\[PROTECTED_ELEMENT_(\d+)\]')
+
+# 正则表达式模式 - 用于匹配不同类型的特殊元素
+# 每个模式内部的分支互斥，且不会跨越整篇文档匹配，避免灾难性回溯
+_PATTERNS = [
+    # 代码块 - 被三个反引号包围的代码块（放在最前面，代码中的 $ 不会被当作公式）
+    r'(?s:```.*?```)',
+    # HTML 表格 - 完整的 HTML 表格标签
+    r'(?s:<html>.*?</html>)',
+    # 块级公式 $$...$$，可以跨行，遇到下一个 $$ 即结束
+    r'\$\$(?:[^$]|\$(?!\$))*\$\$',
+    # 行内公式 $...$，不跨行，允许 \$ 转义
+    r'\$(?:[^$\\\n]|\\.)+\$',
+    # Markdown 表格 - 从行首开始的表头、分隔行和至少一行表格内容，每行都不跨行
+    r'^\|[^\n]*\|[ \t]*\r?\n\|[-:| ]+\|[ \t]*(?:\r?\n\|[^\n]*\|[ \t]*)+',
+    # 图片链接 - Markdown 格式的图片引用
+    r'!\[[^\]\n]*\]\([^)\n]*\)',
+]
+
+SPECIAL_ELEMENT_PATTERN = re.compile('|'.join(_PATTERNS), re.MULTILINE)
+
+
+def find_special_spans(text):
+    """查找所有特殊元素的位置
+
+    参数:
+        text (str): 原始 Markdown 文本
+
+    返回:
+        list: (起始位置, 结束位置) 列表，按出现顺序排列且互不重叠
+    """
+    return [match.span() for match in SPECIAL_ELEMENT_PATTERN.finditer(text)]
+
+
+def extract_special_elements(text):
+    """提取并保护特殊元素（公式、表格、代码块等）
+
+    用占位符替换特殊元素，以防止这些元素在翻译过程中被修改。
+    按记录下的位置一次性重建文本，每个占位符都对应原文中的准确位置。
+
+    参数:
+        text (str): 原始 Markdown 文本
+
+    返回:
+        tuple: (修改后的文本, 特殊元素列表)
+    """
+    special_elements = []
+    parts = []
+    last_end = 0
+    for start, end in find_special_spans(text):
+        parts.append(text[last_end:start])
+        parts.append(PLACEHOLDER_TEMPLATE.format(len(special_elements)))
+        special_elements.append(text[start:end])
+        last_end = end
+    parts.append(text[last_end:])
+    return "".join(parts), special_elements
+
+
+def restore_special_elements(text, special_elements):
+    """恢复特殊元素
+
+    将翻译后的文本中的占位符替换回原始的特殊元素，编号无效的占位符保持不变。
+
+    参数:
+        text (str): 包含占位符的翻译后文本
+        special_elements (list): 原始特殊元素列表
+
+    返回:
+        str: 恢复了特殊元素的完整文本
+    """
+    def replace(match):
+        index = int(match.group(1))
+        if index < len(special_elements):
+            return special_elements[index]
+        return match.group(0)
+
+    return PLACEHOLDER_PATTERN.sub(replace, text)
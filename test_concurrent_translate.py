@@ -0,0 +1,52 @@
+"""
+并发翻译的测试
+
+在本地模拟的 OpenAI 兼容服务上翻译同一组文本块，验证输出顺序与输入一致，
+并且并发数 N 的总耗时明显短于逐块翻译。
+
+用法:
+    python -m pytest test_concurrent_translate.py
+"""
+import time
+
+import pytest
+
+from concurrent_translate import RateLimiter, translate_chunks
+from fake_openai_server import FakeOpenAIServer
+from translation_engine import TranslationEngine
+
+# 模拟服务每个请求的延迟秒数
+LATENCY = 0.2
+CHUNKS = [f"Paragraph {i}: the quick brown fox jumps over the lazy dog." for i in range(8)]
+
+
+@pytest.fixture(scope="module")
+def engine():
+    with FakeOpenAIServer(latency=LATENCY) as server:
+        engine = TranslationEngine(api_key="fake", base_url=server.base_url)
+        # 导入 openai、创建客户端和建立连接不计入耗时
+        engine.translate_text("warm up")
+        yield engine
+
+
+def translate(engine, concurrency):
+    """返回 (译文列表, 耗时秒数)"""
+    start = time.perf_counter()
+    translated = translate_chunks(CHUNKS, engine.translate_text, concurrency=concurrency,
+                                  limiter=RateLimiter(rpm=0, tpm=0))
+    return translated, time.perf_counter() - start
+
+
+@pytest.mark.parametrize("concurrency", [1, 4, 8])
+def test_output_order_is_preserved(engine, concurrency):
+    # 模拟服务原样返回，译文应与原文逐块对应
+    translated, _ = translate(engine, concurrency)
+    assert translated == CHUNKS
+
+
+def test_concurrency_is_faster_than_serial(engine):
+    _, serial = translate(engine, 1)
+    _, parallel = translate(engine, 4)
+    # 逐块翻译至少需要每块一个延迟；4 个并发大约需要两轮延迟，留出余量只要求快一倍以上
+    assert serial >= len(CHUNKS) * LATENCY
+    assert parallel < serial / 2
@@ -1,207 +1,157 @@
 import os
-import re
+import sys
 import json
-import time
 import argparse
-from openai import OpenAI
-from dotenv import load_dotenv
+from contextlib import ExitStack
 
+from concurrent_translate import (
+    DEFAULT_CONCURRENCY, DEFAULT_MAX_RETRIES, DEFAULT_RPM, DEFAULT_TPM, Cancelled, RateLimiter, format_failures
+)
+from translation_cache import DEFAULT_CACHE_PATH, TranslationCache
+from translation_journal import TranslationJournal, journal_path_for
+from chunking import DEFAULT_MAX_INPUT_TOKENS, DEFAULT_MAX_OUTPUT_TOKENS
+from chunk_validation import DEFAULT_REPAIR_BUDGET
+from translation_engine import TranslationEngine
+from cost_estimate import add_estimate_arguments, estimate_files, print_estimates, summarize_estimates
+from metrics import NO_METRICS, add_metrics_arguments, metrics_from_args
 
-# 加载环境变量中的 API 密钥
-# 使用 python-dotenv 库从 .env 文件中读取环境变量
-load_dotenv()
 
-# 获取 OpenAI API 密钥
-# 从环境变量中获取 API 密钥，如果未设置则抛出错误
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError("请设置 OPENAI_API_KEY 环境变量")
+def output_path_for_language(output_file, target_language):
+    """多语言翻译时每种语言的输出文件路径
 
-# 初始化 OpenAI 客户端
-client = OpenAI(api_key=api_key)
-
-def extract_special_elements(text):
-    """提取并保护特殊元素（公式、表格、代码块等）
-    
-    该函数识别并提取 Markdown 文本中的特殊元素，用占位符替换它们，
-    以防止这些元素在翻译过程中被修改。
-    
-    参数:
-        text (str): 原始 Markdown 文本
-        
-    返回:
-        tuple: (修改后的文本, 特殊元素列表)
-    """
-    # 用于存储特殊元素和它们的占位符
-    special_elements = []
-    
-    # 正则表达式模式 - 用于匹配不同类型的特殊元素
-    patterns = [
-        # 数学公式 (包括行内公式 $...$ 和块级公式 $$...$$)
-        r'\$\$.*?\$\$|\$.*?\$',
-        # HTML 表格 - 匹配完整的 HTML 表格标签
-        r'<html>.*?</html>',
-        # Markdown 表格 - 匹配表头、分隔行和表格内容
-        r'(\|.*\|[\r\n]+)(\|[-:| ]+\|[\r\n]+)((\|.*\|[\r\n]+)+)',
-        # 代码块 - 匹配被三个反引号包围的代码块
-        r'```.*?```',
-        # 图片链接 - 匹配 Markdown 格式的图片引用
-        r'!\[.*?\]\(.*?\)'
-    ]
-    
-    # 合并所有模式，使用 | 操作符创建一个大的正则表达式
-    combined_pattern = '|'.join(patterns)
-    
-    # 查找所有匹配项，使用 re.DOTALL 允许匹配跨越多行的内容
-    matches = re.finditer(combined_pattern, text, re.DOTALL)
-    
-    # 替换文本 - 将特殊元素替换为占位符
-    modified_text = text
-    for i, match in enumerate(matches):
-        # 为每个特殊元素创建唯一的占位符
-        placeholder = f"[PROTECTED_ELEMENT_{i}]"
-        # 保存原始特殊元素
-        special_elements.append(match.group(0))
-        # 在文本中用占位符替换特殊元素（只替换第一次出现）
-        modified_text = modified_text.replace(match.group(0), placeholder, 1)
-    
-    return modified_text, special_elements
-
-def restore_special_elements(text, special_elements):
-    """恢复特殊元素
-    
-    将翻译后的文本中的占位符替换回原始的特殊元素。
-    
-    参数:
-        text (str): 包含占位符的翻译后文本
-        special_elements (list): 原始特殊元素列表
-        
-    返回:
-        str: 恢复了特殊元素的完整文本
-    """
-    # 遍历所有特殊元素，将占位符替换回原始内容
-    for i, element in enumerate(special_elements):
-        placeholder = f"[PROTECTED_ELEMENT_{i}]"
-        text = text.replace(placeholder, element, 1)
-    return text
-
-def chunk_text(text, max_length=4000):
-    """将文本分成适合 API 调用的块
-    
-    将长文本分割成较小的块，以适应 API 的最大输入长度限制。
-    分割时尽量保持段落的完整性。
-    
-    参数:
-        text (str): 需要分割的文本
-        max_length (int): 每个块的最大长度，默认为4000字符
-        
-    返回:
-        list: 文本块列表
+    output_file 中含有 {language} 时替换为语言名，否则在扩展名前加上 _语言名。
     """
-    # 按段落分割文本（通过空行识别段落）
-    paragraphs = re.split(r'\n\s*\n', text)
-    
-    chunks = []
-    current_chunk = ""
-    
-    for paragraph in paragraphs:
-        # 如果添加这个段落会超出最大长度，先保存当前块
-        if len(current_chunk) + len(paragraph) > max_length and current_chunk:
-            chunks.append(current_chunk)
-            current_chunk = paragraph
-        else:
-            # 将段落添加到当前块，保持段落之间有空行
-            if current_chunk:
-                current_chunk += "\n\n" + paragraph
-            else:
-                current_chunk = paragraph
-    
-    # 添加最后一个块（确保不遗漏任何内容）
-    if current_chunk:
-        chunks.append(current_chunk)
-    
-    return chunks
+    if "{language}" in output_file:
+        return output_file.replace("{language}", target_language)
+    root, ext = os.path.splitext(output_file)
+    return f"{root}_{target_language}{ext or '.md'}"
 
-def translate_text(text, target_language="中文"):
-    """使用 OpenAI API 翻译文本
-    
-    调用 OpenAI API 将文本翻译成目标语言。
-    
-    参数:
-        text (str): 需要翻译的文本
-        target_language (str): 目标语言，默认为"中文"
-        
-    返回:
-        str: 翻译后的文本，如果翻译失败则返回原文
-    """
-    try:
-        # 调用 OpenAI 的聊天完成 API
-        response = client.chat.completions.create(
-            model="gpt-4-turbo",  # 使用 GPT-4 Turbo 模型进行翻译
-            messages=[
-                # 系统提示，指导 AI 如何进行翻译
-                {"role": "system", "content": f"你是一个专业的学术翻译器。请将以下文本翻译成{target_language}，保持学术风格和专业术语的准确性。保留所有原始格式，包括标题层级、列表和段落结构。不要翻译占位符标记（如[PROTECTED_ELEMENT_X]）。"},
-                # 用户提示，包含需要翻译的文本
-                {"role": "user", "content": text}
-            ],
-            temperature=0.1,  # 低温度值，使输出更加确定性和一致
-            max_tokens=4096   # 最大输出令牌数
-        )
-        # 返回 LLM 生成的翻译内容
-        return response.choices[0].message.content
-    except Exception as e:
-        # 如果翻译过程中出错，打印错误信息并返回原文
-        print(f"翻译过程中出错: {e}")
-        return text
 
-
-def translate_markdown_file(input_file, output_file, target_language="中文"):
+def translate_markdown_file(input_file, output_file, target_language="中文",
+                            concurrency=DEFAULT_CONCURRENCY, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM,
+                            cache=None, max_input_tokens=DEFAULT_MAX_INPUT_TOKENS,
+                            max_output_tokens=DEFAULT_MAX_OUTPUT_TOKENS, on_chunk_done=None, cancel_event=None,
+                            metrics=NO_METRICS, max_retries=DEFAULT_MAX_RETRIES, resume=True, dedup=True,
+                            registry=None, validate=True, repair_budget=DEFAULT_REPAIR_BUDGET, engine=None,
+                            stream=False, raise_errors=False):
     """翻译整个 Markdown 文件
     
     读取、处理并翻译整个 Markdown 文件，保留特殊元素不变。
+    target_language 为列表时，特殊元素保护、去重和分块只做一次（按各语言中最小的令牌预算分块），
+    所有语言的请求在同一个限流器下一起调度，每种语言写入一个输出文件。
     
     参数:
         input_file (str): 输入文件路径
-        output_file (str): 输出文件路径
-        target_language (str): 目标语言，默认为"中文"
+        output_file (str): 输出文件路径；多语言时按 output_path_for_language() 生成每种语言的路径
+        target_language (str 或 list): 目标语言或目标语言列表，默认为"中文"
+        concurrency (int): 同时在途的翻译请求数（所有语言合计）
+        rpm (int): 每分钟请求数上限，0 表示不限制
+        tpm (int): 每分钟令牌数上限，0 表示不限制
+        cache (TranslationCache): 翻译缓存，为 None 时不使用缓存
+        max_input_tokens (int): 每个请求的输入令牌上限
+        max_output_tokens (int): 每个请求的输出令牌上限
+        on_chunk_done (callable): 每完成一块时回调 on_chunk_done(已完成数, 总数)，默认打印进度
+        cancel_event (threading.Event): 设置后停止翻译并抛出 Cancelled，不写入输出文件（流式模式下保留已写出的部分）
+        metrics (RunMetrics): 运行指标，记录各阶段耗时、文本块数和 API 调用情况
+        max_retries (int): 每个文本块最多重试次数
+        resume (bool): 为 True 时把完成的块逐块写入 输出文件.journal，重新运行时跳过日志中已完成的块；
+                       为 False 时丢弃已有的日志，从头翻译
+        dedup (bool): 为 True 时重复出现的段落只翻译一次
+        registry (ParagraphRegistry): 批量处理时记录本批次中缓存了段落译文的段落，之后的文档直接复用这些译文
+        validate (bool): 为 True 时检查每块译文的占位符、标题层级和列表项是否与原文一致，
+                         不一致的块用严格提示词或拆分后重新翻译
+        repair_budget (int): 重新翻译不合格的块最多使用的额外请求数（所有语言合计）
+        engine (TranslationEngine): 翻译引擎，为 None 时按 cache 和令牌上限创建（使用环境变量中的 API 密钥）
+        stream (bool): 为 True 时按令牌流接收回复，每个块完成后按原文顺序追加写入输出文件，
+                       不在内存中保留全部译文
+        raise_errors (bool): 为 True 时读写文件或调用 API 出错直接抛出异常（如批量处理需要把原因写入清单），
+                             为 False 时打印错误并返回 None
+    
+    返回:
+        list: 重试后仍然失败的文本块（这些块在输出文件中保留原文），全部成功时为空列表；
+              读取或写入文件出错时返回 None。
+              target_language 为列表时返回 {目标语言: 失败的文本块列表}
     """
+    multiple = not isinstance(target_language, str)
+    languages = list(target_language) if multiple else [target_language]
+    output_files = {language: output_path_for_language(output_file, language) if multiple else output_file
+                    for language in languages}
     try:
         # 读取输入文件
         with open(input_file, 'r', encoding='utf-8') as f:
             content = f.read()
         
-        # 提取并保护特殊元素（公式、表格、代码块等）
-        modified_content, special_elements = extract_special_elements(content)
+        if engine is None:
+            engine = TranslationEngine(cache=cache, max_input_tokens=max_input_tokens,
+                                       max_output_tokens=max_output_tokens, stream=stream)
         
-        # 将文本分成适合 API 调用的块
-        chunks = chunk_text(modified_content)
+        # 每种语言各有一个断点日志，跳过上次运行已完成的块
+        journals = {}
+        for language in languages:
+            journal_path = journal_path_for(output_files[language])
+            if not resume and os.path.exists(journal_path):
+                os.remove(journal_path)
+            journals[language] = TranslationJournal(journal_path)
         
-        # 翻译每个块
-        translated_chunks = []
-        for i, chunk in enumerate(chunks):
-            print(f"正在翻译第 {i+1}/{len(chunks)} 块...")
-            # 调用翻译函数处理当前块
-            translated_chunk = translate_text(chunk, target_language)
-            translated_chunks.append(translated_chunk)
-            # 添加延迟以避免 API 限制（除了最后一块）
-            if i < len(chunks) - 1:
-                time.sleep(1)
+        # 所有语言的块一起并发翻译，由同一个限流器控制请求速率（结果保持原有顺序）；
+        # 流式模式下译文边翻译边写入输出文件
+        with ExitStack() as stack:
+            outputs = None
+            if stream:
+                outputs = {language: stack.enter_context(open(output_files[language], 'w', encoding='utf-8'))
+                           for language in languages}
+            try:
+                final_contents, failures, chunks = engine.translate_markdown(
+                    content,
+                    languages,
+                    concurrency=concurrency,
+                    limiter=RateLimiter(rpm=rpm, tpm=tpm),
+                    on_chunk_done=on_chunk_done or (lambda done, total: print(f"已翻译 {done}/{total} 块...")),
+                    cancel_event=cancel_event,
+                    max_retries=max_retries,
+                    metrics=metrics,
+                    journals=journals,
+                    dedup=dedup,
+                    registry=registry,
+                    validate=validate,
+                    repair_budget=repair_budget,
+                    outputs=outputs,
+                )
+            finally:
+                for journal in journals.values():
+                    journal.close()
         
-        # 合并翻译后的块，用空行连接
-        translated_content = "\n\n".join(translated_chunks)
-        
-        # 恢复特殊元素（将占位符替换回原始内容）
-        final_content = restore_special_elements(translated_content, special_elements)
+        for language in languages:
+            # 写入输出文件（流式模式下已经写完）
+            if not stream:
+                with open(output_files[language], 'w', encoding='utf-8') as f:
+                    f.write(final_contents[language])
+            
+            if failures[language]:
+                print(f"{language}: 有 {len(failures[language])} 个文本块重试后仍翻译失败，输出中保留了这些块的原文:")
+                for line in format_failures(failures[language], chunks):
+                    print(f"  {line}")
+                print(f"结果已保存到 {output_files[language]}，重新运行将只翻译失败的块")
+            else:
+                # 全部完成后不再需要断点日志
+                journals[language].discard()
+                print(f"翻译完成！结果已保存到 {output_files[language]}")
         
-        # 写入输出文件
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(final_content)
+        # 打印缓存命中统计
+        if engine.cache is not None:
+            stats = engine.cache.stats()
+            print(f"翻译缓存: 命中 {stats['hits']} 次，未命中 {stats['misses']} 次")
         
-        print(f"翻译完成！结果已保存到 {output_file}")
+        return failures if multiple else failures[target_language]
         
+    except Cancelled:
+        raise
     except Exception as e:
+        if raise_errors:
+            raise
         # 捕获并打印处理过程中的任何错误
         print(f"处理文件时出错: {e}")
+        return None
 
 if __name__ == "__main__":
     # 创建命令行参数解析器
@@ -209,9 +159,49 @@ if __name__ == "__main__":
     # 添加必需的输入文件参数
     parser.add_argument('input_file', help='输入 Markdown 文件路径')
     # 添加可选的输出文件参数
-    parser.add_argument('--output_file', help='输出 Markdown 文件路径 (默认为 input_file_translated.md)')
+    parser.add_argument('--output_file', help='输出 Markdown 文件路径 (默认为 input_file_translated.md；'
+                                              '多个目标语言时可以用 {language} 表示语言名，'
+                                              '否则在扩展名前加上 _语言名)')
     # 添加可选的目标语言参数
-    parser.add_argument('--language', default='中文', help='目标语言 (默认为中文)')
+    parser.add_argument('--language', nargs='+', default=['中文'],
+                        help='目标语言，可以指定多个，如 --language 中文 日语 English (默认为中文)')
+    # 添加并发与限流参数
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'同时在途的翻译请求数 (默认为{DEFAULT_CONCURRENCY})')
+    parser.add_argument('--rpm', type=int, default=DEFAULT_RPM,
+                        help=f'每分钟请求数上限，0 表示不限制 (默认为{DEFAULT_RPM})')
+    parser.add_argument('--tpm', type=int, default=DEFAULT_TPM,
+                        help='每分钟令牌数上限，0 表示不限制 (默认不限制)')
+    # 添加翻译缓存参数
+    parser.add_argument('--cache_path', default=DEFAULT_CACHE_PATH,
+                        help=f'翻译缓存文件路径 (默认为{DEFAULT_CACHE_PATH})')
+    parser.add_argument('--no_cache', action='store_true', help='不使用翻译缓存')
+    # 添加令牌预算参数
+    parser.add_argument('--max_input_tokens', type=int, default=DEFAULT_MAX_INPUT_TOKENS,
+                        help=f'每个请求的输入令牌上限 (默认为{DEFAULT_MAX_INPUT_TOKENS})')
+    parser.add_argument('--max_output_tokens', type=int, default=DEFAULT_MAX_OUTPUT_TOKENS,
+                        help=f'每个请求的输出令牌上限 (默认为{DEFAULT_MAX_OUTPUT_TOKENS})')
+    # 添加重试参数
+    parser.add_argument('--max_retries', type=int, default=DEFAULT_MAX_RETRIES,
+                        help=f'每个文本块失败后最多重试次数 (默认为{DEFAULT_MAX_RETRIES})')
+    parser.add_argument('--no_resume', action='store_true',
+                        help='忽略上次中断留下的断点日志，从头翻译')
+    parser.add_argument('--no_dedup', action='store_true', help='不对重复段落去重')
+    parser.add_argument('--no_validate', action='store_true', help='不检查译文中的占位符和标题、列表结构')
+    parser.add_argument('--repair_budget', type=int, default=DEFAULT_REPAIR_BUDGET,
+                        help=f'重新翻译结构不合格的块最多使用的额外请求数 (默认为{DEFAULT_REPAIR_BUDGET})')
+    # 添加服务地址参数
+    parser.add_argument('--base_url', default=None,
+                        help='OpenAI 兼容服务的地址，如 http://127.0.0.1:8000/v1 (默认读取 OPENAI_BASE_URL 环境变量，'
+                             '都没有时使用 OpenAI 官方服务)')
+    parser.add_argument('--stream', action='store_true',
+                        help='按令牌流接收回复，每块完成后按顺序追加写入输出文件，不在内存中保留全部译文')
+    # 添加估算参数
+    parser.add_argument('--dry_run', action='store_true',
+                        help='只分块并估算请求数、令牌数、费用和耗时，不调用 API，不需要 API 密钥')
+    add_estimate_arguments(parser)
+    # 添加运行指标参数
+    add_metrics_arguments(parser)
     
     # 解析命令行参数
     args = parser.parse_args()
@@ -221,5 +211,50 @@ if __name__ == "__main__":
     # 如果未指定输出文件，则使用默认命名规则
     output_file = args.output_file or f"{os.path.splitext(input_file)[0]}_translated.md"
     
+    # 只估算时不创建客户端
+    if args.dry_run:
+        estimates = estimate_files([input_file], args.language, args.max_input_tokens, args.max_output_tokens,
+                                   dedup=not args.no_dedup)
+        total = summarize_estimates(estimates, args.model, args.price, args.concurrency, args.rpm, args.tpm,
+                                    args.request_latency, args.output_tokens_per_second)
+        print_estimates(estimates, total, show_documents=False)
+        sys.exit(1 if total["documents"] == 0 else 0)
+    
+    # 打开翻译缓存
+    cache = None if args.no_cache else TranslationCache(args.cache_path)
+    
+    # 创建翻译引擎（API 客户端在第一次请求时创建，之后复用连接）
+    engine = TranslationEngine(base_url=args.base_url, model=args.model, cache=cache,
+                               max_input_tokens=args.max_input_tokens, max_output_tokens=args.max_output_tokens,
+                               stream=args.stream)
+    # 没有 API 密钥时在开始翻译前报错
+    try:
+        engine.client
+    except ValueError as e:
+        parser.error(str(e))
+    
+    # 创建运行指标
+    metrics = metrics_from_args(args, "translate_md")
+    # 只有一个目标语言时保持原来的输出文件名
+    target_language = args.language[0] if len(args.language) == 1 else args.language
+    metrics.set_info(input_file=input_file, language=args.language, model=engine.model, stream=args.stream)
+    
     # 调用翻译函数处理文件
-    translate_markdown_file(input_file, output_file, args.language)
\ No newline at end of file
+    with metrics.stage("translate"):
+        failures = translate_markdown_file(input_file, output_file, target_language,
+                                           concurrency=args.concurrency, rpm=args.rpm, tpm=args.tpm,
+                                           cache=cache, max_input_tokens=args.max_input_tokens,
+                                           max_output_tokens=args.max_output_tokens, metrics=metrics,
+                                           max_retries=args.max_retries, resume=not args.no_resume,
+                                           dedup=not args.no_dedup, validate=not args.no_validate,
+                                           repair_budget=args.repair_budget, engine=engine,
+                                           stream=args.stream)
+    
+    # 保存运行指标
+    if args.metrics_file:
+        metrics.write_json(args.metrics_file)
+        print(f"运行指标已保存到 {args.metrics_file}")
+    
+    # 有文本块翻译失败或处理出错时以非零状态退出
+    if failures is None or any(failures.values() if isinstance(failures, dict) else failures):
+        sys.exit(1)
\ No newline at end of file
@@ -0,0 +1,168 @@
+"""
+基于 SQLite 的持久化翻译缓存（翻译记忆）
+
+以 (规范化后的原文, 目标语言, 模型, 提示词版本) 的哈希为键保存译文，
+重复翻译相同的文本块时直接返回缓存结果，不再调用 API。
+缓存总大小超过上限时按最近最少使用（LRU）淘汰。
+
+用法:
+    python translation_cache.py
+    python translation_cache.py --invalidate_model gpt-4-turbo
+    python translation_cache.py --invalidate_prompt_version 1
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+
+# 翻译提示词的版本号，修改系统提示词时需要递增，使旧译文自动失效
+PROMPT_VERSION = "1"
+
+# 默认缓存文件路径和大小上限（字节）
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".pdf_translator_cache.sqlite3")
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+
+def normalize_text(text):
+    """规范化原文：统一换行符，去掉首尾空白和行尾空白"""
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").strip().split("\n")
+    return "\n".join(line.rstrip() for line in lines)
+
+
+class TranslationCache:
+    """持久化翻译缓存，可以被多个翻译线程共享"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS translations (
+                key TEXT PRIMARY KEY,
+                target_language TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                translation TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON translations (last_access)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_model_prompt ON translations (model, prompt_version)")
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM translations").fetchone()[0]
+
+    @staticmethod
+    def make_key(text, target_language, model, prompt_version=PROMPT_VERSION):
+        """计算缓存键"""
+        payload = "\x00".join([normalize_text(text), target_language, model, prompt_version])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, text, target_language, model, prompt_version=PROMPT_VERSION, validator=None):
+        """查询译文，未命中时返回 None
+
+        提供 validator 时，validator(原文, 译文) 返回非空的问题列表的条目按未命中计算并返回 None，
+        命中统计与调用方记录的一致。
+        """
+        key = self.make_key(text, target_language, model, prompt_version)
+        with self._lock:
+            row = self.conn.execute("SELECT translation FROM translations WHERE key = ?", (key,)).fetchone()
+            if row is None or (validator is not None and validator(text, row[0])):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute("UPDATE translations SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+            return row[0]
+
+    def put(self, text, target_language, model, translation, prompt_version=PROMPT_VERSION):
+        """保存译文，超出大小上限时淘汰最久未使用的条目"""
+        key = self.make_key(text, target_language, model, prompt_version)
+        size = len(translation.encode("utf-8"))
+        with self._lock:
+            old = self.conn.execute("SELECT size FROM translations WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, target_language, model, prompt_version, translation, size, time.time()),
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        """按 LRU 顺序删除条目直到总大小不超过上限（调用方持有锁）"""
+        while self.total_bytes > self.max_bytes:
+            rows = self.conn.execute(
+                "SELECT key, size FROM translations ORDER BY last_access LIMIT 100"
+            ).fetchall()
+            if not rows:
+                self.total_bytes = 0
+                break
+            for key, size in rows:
+                self.conn.execute("DELETE FROM translations WHERE key = ?", (key,))
+                self.total_bytes -= size
+                if self.total_bytes <= self.max_bytes:
+                    break
+
+    def invalidate(self, model=None, prompt_version=None):
+        """删除指定模型和/或提示词版本的条目，两者都为 None 时清空缓存
+
+        返回:
+            int: 删除的条目数
+        """
+        conditions, params = [], []
+        if model is not None:
+            conditions.append("model = ?")
+            params.append(model)
+        if prompt_version is not None:
+            conditions.append("prompt_version = ?")
+            params.append(prompt_version)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            deleted = self.conn.execute(f"DELETE FROM translations{where}", params).rowcount
+            self.conn.commit()
+            self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM translations").fetchone()[0]
+        return deleted
+
+    def stats(self):
+        """返回命中率和缓存占用统计"""
+        with self._lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "total_bytes": self.total_bytes,
+        }
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='查看和管理持久化翻译缓存')
+    parser.add_argument('--cache_path', default=DEFAULT_CACHE_PATH, help='缓存文件路径')
+    parser.add_argument('--invalidate_model', help='删除指定模型的所有译文')
+    parser.add_argument('--invalidate_prompt_version', help='删除指定提示词版本的所有译文')
+    parser.add_argument('--clear', action='store_true', help='清空缓存')
+    args = parser.parse_args()
+
+    cache = TranslationCache(args.cache_path)
+    if args.invalidate_model or args.invalidate_prompt_version:
+        deleted = cache.invalidate(args.invalidate_model, args.invalidate_prompt_version)
+        print(f"已删除 {deleted} 条译文")
+    elif args.clear:
+        print(f"已删除 {cache.invalidate()} 条译文")
+    stats = cache.stats()
+    print(f"缓存文件: {args.cache_path}")
+    print(f"条目数: {stats['entries']}，占用: {stats['total_bytes'] / 1024 / 1024:.1f} MB")
+    cache.close()
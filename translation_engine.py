@@ -0,0 +1,461 @@
+"""
+共享的翻译引擎
+
+translate_md.py、图形界面、批量处理和按内容块翻译共用这里的翻译核心：特殊元素保护、去重、分块、
+调用 API、结构校验和断点续译。
+
+API 客户端在第一次发出请求时才创建（导入本模块不需要 API 密钥，也不会导入 openai），
+并按 (API 密钥, 服务地址) 在进程内复用：同一个客户端内部维护 keep-alive 的 HTTP 连接池，
+所有请求、所有任务复用已经建立的 TCP/TLS 连接，不再为每个任务重新握手。
+服务地址可以指向任意 OpenAI 兼容的服务（如本地部署的模型）。
+
+流式模式下按令牌流接收回复（可以按实际收到的令牌数显示进度），每个块完成后立即恢复占位符，
+按原文顺序追加写入输出文件，不必等全部块翻译完再拼接和写盘。
+"""
+import os
+import time
+import threading
+
+from concurrent_translate import (
+    DEFAULT_CONCURRENCY, DEFAULT_MAX_RETRIES, RateLimiter, RetryPolicy, TranslationFailed,
+    translate_chunks_for_languages
+)
+from translation_cache import PROMPT_VERSION
+from translation_journal import plan_hash
+from special_elements import extract_special_elements, restore_special_elements
+from chunking import (
+    DEFAULT_MAX_INPUT_TOKENS, DEFAULT_MAX_OUTPUT_TOKENS, chunk_text, summarize_chunks, token_budget
+)
+from dedup import (
+    PARAGRAPH_PROMPT_VERSION, deduplicate_paragraphs, pack_repeated, paragraph_key, record_dedup_stats,
+    restore_repeated, unpack_repeated
+)
+from chunk_validation import (
+    DEFAULT_REPAIR_BUDGET, STRICT_PROMPT_VERSION, RepairBudget, ValidatedTranslator, find_problems,
+    strict_system_prompt
+)
+from metrics import NO_METRICS
+
+# 翻译使用的模型
+DEFAULT_MODEL = "gpt-4-turbo"
+
+# 进程内复用的客户端，键为 (API 密钥, 服务地址)
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def default_system_prompt(target_language):
+    """翻译 Markdown 文本使用的系统提示词"""
+    return (f"你是一个专业的学术翻译器。请将以下文本翻译成{target_language}，保持学术风格和专业术语的准确性。"
+            f"保留所有原始格式，包括标题层级、列表和段落结构。不要翻译占位符标记（如[PROTECTED_ELEMENT_X]）。")
+
+
+def get_client(api_key=None, base_url=None):
+    """返回进程内共享的 OpenAI 客户端，第一次调用时创建
+
+    参数:
+        api_key (str): API 密钥，为 None 时读取环境变量（及 .env 文件）中的 OPENAI_API_KEY
+        base_url (str): OpenAI 兼容服务的地址，为 None 时读取 OPENAI_BASE_URL，都没有时使用官方服务
+
+    返回:
+        OpenAI: 客户端，重试由 translate_chunks 统一处理，关闭了客户端自带的重试
+    """
+    if api_key is None or base_url is None:
+        try:
+            from dotenv import load_dotenv
+            load_dotenv()
+        except ImportError:
+            pass
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("请设置 OPENAI_API_KEY 环境变量")
+    base_url = base_url or os.getenv("OPENAI_BASE_URL") or None
+
+    key = (api_key, base_url)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            from openai import OpenAI
+            client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+            _clients[key] = client
+    return client
+
+
+class _TokenProgress:
+    """统计流式回复中收到的令牌数，可以被多个翻译线程共享
+
+    每收到约 1% 的预计输出令牌回调一次 on_tokens(已收到的令牌数, 预计输出令牌数)，避免回调过于频繁。
+    """
+
+    def __init__(self, expected, on_tokens):
+        self.expected = max(1, expected)
+        self.on_tokens = on_tokens
+        self.received = 0
+        self._step = max(1, self.expected // 100)
+        self._reported = 0
+        self._lock = threading.Lock()
+
+    def add(self, count=1):
+        with self._lock:
+            self.received += count
+            if self.received - self._reported < self._step:
+                return
+            self._reported = received = self.received
+        self.on_tokens(received, self.expected)
+
+
+class _OrderedOutput:
+    """按原文顺序写出一种语言的译文
+
+    块可以按任意顺序完成，前面的块都写出后才写出这一块，未轮到的块暂存。
+    重复段落的块排在最前面，它们的译文拆回各个段落后保留下来，用于填回后面各块中的占位符；
+    其余块写出后即丢弃。fan_out(重复段落各块的译文) 返回各重复段落的译文。
+    """
+
+    def __init__(self, output, repeated_count, special_elements, fan_out):
+        self.output = output
+        self.repeated_count = repeated_count
+        self.special_elements = special_elements
+        self.fan_out = fan_out
+        self.repeated_chunks = []
+        # 重复段落都有缓存译文时没有需要等待的块
+        self.repeated = fan_out([]) if repeated_count == 0 else []
+        self.pending = {}
+        self.next_index = 0
+
+    def add(self, index, text):
+        self.pending[index] = text
+        while self.next_index in self.pending:
+            text = self.pending.pop(self.next_index)
+            if self.next_index < self.repeated_count:
+                self.repeated_chunks.append(text)
+                if len(self.repeated_chunks) == self.repeated_count:
+                    self.repeated = self.fan_out(self.repeated_chunks)
+                    self.repeated_chunks = []
+            else:
+                text = restore_repeated(text, self.repeated, len(self.special_elements))
+                text = restore_special_elements(text, self.special_elements)
+                separator = "\n\n" if self.next_index > self.repeated_count else ""
+                self.output.write(separator + text)
+                if hasattr(self.output, "flush"):
+                    self.output.flush()
+            self.next_index += 1
+
+
+class TranslationEngine:
+    """翻译引擎，可以被多个线程和多个任务共享
+
+    参数:
+        api_key (str): API 密钥，为 None 时读取 OPENAI_API_KEY
+        base_url (str): OpenAI 兼容服务的地址，为 None 时读取 OPENAI_BASE_URL
+        model (str): 翻译使用的模型
+        cache (TranslationCache): 翻译缓存，为 None 时不使用缓存
+        max_input_tokens (int): 每个请求的输入令牌上限
+        max_output_tokens (int): 每个请求的输出令牌上限
+        stream (bool): 为 True 时按令牌流接收回复
+    """
+
+    def __init__(self, api_key=None, base_url=None, model=DEFAULT_MODEL, cache=None,
+                 max_input_tokens=DEFAULT_MAX_INPUT_TOKENS, max_output_tokens=DEFAULT_MAX_OUTPUT_TOKENS,
+                 stream=False):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.cache = cache
+        self.max_input_tokens = max_input_tokens
+        self.max_output_tokens = max_output_tokens
+        self.stream = stream
+
+    @property
+    def client(self):
+        """共享的 API 客户端，第一次使用时创建"""
+        return get_client(self.api_key, self.base_url)
+
+    def translate_text(self, text, target_language="中文", metrics=NO_METRICS, system_prompt=None,
+                       prompt_version=PROMPT_VERSION, on_tokens=None, validator=find_problems):
+        """翻译一段文本
+
+        提供缓存时先查询缓存，命中则不调用 API，翻译成功后写入缓存。调用失败时抛出异常，由调用方决定是否重试。
+        只有通过 validator 检查的译文才会写入缓存，未通过检查的缓存译文按未命中处理，
+        不合格的译文不会在之后的运行中被原样重放。
+
+        参数:
+            text (str): 需要翻译的文本
+            target_language (str): 目标语言，默认为"中文"
+            metrics (RunMetrics): 运行指标，记录缓存命中、API 延迟、令牌用量和失败次数
+            system_prompt (str): 系统提示词，为 None 时使用 default_system_prompt()
+            prompt_version (str): 提示词版本，作为缓存键的一部分，使用其他提示词时需要区分
+            on_tokens (callable): 流式模式下每收到一段回复时在翻译线程中回调 on_tokens(令牌数)
+            validator (callable): validator(原文, 译文) 返回问题列表，默认检查占位符、标题和列表项（find_problems）
+
+        返回:
+            str: 翻译后的文本
+        """
+        if self.cache is not None:
+            cached = self.cache.get(text, target_language, self.model, prompt_version, validator)
+            metrics.count("cache_hits" if cached is not None else "cache_misses")
+            if cached is not None:
+                return cached
+
+        start = time.perf_counter()
+        request = dict(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system_prompt or default_system_prompt(target_language)},
+                {"role": "user", "content": text}
+            ],
+            temperature=0.1,  # 低温度值，使输出更加确定性和一致
+            max_tokens=self.max_output_tokens
+        )
+        try:
+            if self.stream:
+                translated, usage = self._create_streaming(request, start, metrics, on_tokens)
+            else:
+                response = self.client.chat.completions.create(**request)
+                translated, usage = response.choices[0].message.content, response.usage
+        except Exception:
+            # 记录失败并交给调用方重试（失败结果不写入缓存）
+            metrics.count("api_errors")
+            raise
+
+        metrics.observe("api_latency_seconds", time.perf_counter() - start)
+        metrics.count("api_requests")
+        if usage is not None:
+            metrics.count("prompt_tokens", usage.prompt_tokens)
+            metrics.count("completion_tokens", usage.completion_tokens)
+
+        if self.cache is not None and not validator(text, translated):
+            self.cache.put(text, target_language, self.model, translated, prompt_version)
+        return translated
+
+    def _create_streaming(self, request, start, metrics, on_tokens):
+        """按令牌流接收回复，返回 (完整回复, 令牌用量)；服务不返回用量时令牌用量为 None"""
+        parts, usage = [], None
+        stream = self.client.chat.completions.create(**request, stream=True,
+                                                     stream_options={"include_usage": True})
+        with stream:
+            for event in stream:
+                if event.usage is not None:
+                    usage = event.usage
+                if not event.choices or not event.choices[0].delta.content:
+                    continue
+                if not parts:
+                    metrics.observe("api_first_token_seconds", time.perf_counter() - start)
+                parts.append(event.choices[0].delta.content)
+                if on_tokens is not None:
+                    # 每个增量大约是一个令牌
+                    on_tokens(1)
+        return "".join(parts), usage
+
+    def chunk_text(self, text, target_languages=("中文",)):
+        """按令牌预算分块，预算取各目标语言中最小的，保证每种语言的译文都不超出输出上限"""
+        budget = min(token_budget(language, self.max_input_tokens, self.max_output_tokens)
+                     for language in target_languages)
+        return chunk_text(text, budget)
+
+    def lookup_paragraph(self, paragraph, target_languages):
+        """查询段落在各目标语言下缓存的译文，返回 {目标语言: 译文}，有语言没有缓存时返回 None"""
+        translations = {}
+        for language in target_languages:
+            cached = self.cache.get(paragraph, language, self.model, PARAGRAPH_PROMPT_VERSION, find_problems)
+            if cached is None:
+                return None
+            translations[language] = cached
+        return translations
+
+    def prepare_markdown(self, content, target_languages, metrics=NO_METRICS, dedup=True, registry=None):
+        """保护特殊元素、去重并分块，不调用 API
+
+        registry 中记录的段落只用来查询缓存的段落译文，没有缓存时照常留在原处翻译，不会增加请求数。
+
+        返回:
+            tuple: (文本块列表, 特殊元素列表, 重复段落列表, {段落序号: 缓存的译文}, 重复段落的块数, 去重统计)；
+                   需要翻译的重复段落按令牌预算打包成块放在最前面（按顺序写出时先拿到它们的译文），
+                   不去重时去重统计为 None
+        """
+        # 提取并保护特殊元素（公式、表格、代码块等）
+        with metrics.stage("translate.extract"):
+            modified_content, special_elements = extract_special_elements(content)
+
+        # 重复的段落换成占位符，每个不同的段落只翻译一次
+        repeated, known, dedup_stats = [], {}, None
+        if dedup:
+            lookup = None
+            if self.cache is not None:
+                lookup = lambda paragraph: self.lookup_paragraph(paragraph, target_languages)
+            with metrics.stage("translate.dedup"):
+                modified_content, repeated, known, dedup_stats = deduplicate_paragraphs(
+                    modified_content, len(special_elements), registry, lookup)
+            record_dedup_stats(metrics, dedup_stats)
+
+        # 所有语言共用一套分块，重复段落和其他文本一样按令牌预算打包
+        with metrics.stage("translate.chunk"):
+            repeated_chunks = self.chunk_text(pack_repeated(repeated, len(special_elements), known),
+                                              target_languages)
+            chunks = repeated_chunks + self.chunk_text(modified_content, target_languages)
+        return chunks, special_elements, repeated, known, len(repeated_chunks), dedup_stats
+
+    def fan_out_repeated(self, language, translated_chunks, repeated, known, base_index, registry=None,
+                         failed=False):
+        """把重复段落所在块的译文拆回各个段落，填入有缓存译文的段落
+
+        各块都翻译成功时，新翻译的段落译文按段落写入缓存并记录到 registry，供本批次之后的文档复用。
+
+        返回:
+            list: 第 i 项是第 i 个重复段落的译文
+        """
+        translations, found = unpack_repeated(translated_chunks, repeated, base_index)
+        for index, cached in known.items():
+            translations[index] = cached[language]
+        if self.cache is not None and not failed:
+            found = [index for index in sorted(found)
+                     if translations[index] and not find_problems(repeated[index], translations[index])]
+            for index in found:
+                self.cache.put(repeated[index], language, self.model, translations[index], PARAGRAPH_PROMPT_VERSION)
+            if registry is not None:
+                registry.update(paragraph_key(repeated[index]) for index in found)
+        return translations
+
+    def translate_markdown(self, content, target_languages, concurrency=DEFAULT_CONCURRENCY, limiter=None,
+                           on_chunk_done=None, cancel_event=None, max_retries=DEFAULT_MAX_RETRIES,
+                           metrics=NO_METRICS, journals=None, dedup=True, registry=None, validate=True,
+                           repair_budget=DEFAULT_REPAIR_BUDGET, log=print, outputs=None, on_tokens=None):
+        """把一段 Markdown 翻译成所有目标语言
+
+        特殊元素保护、去重和分块只做一次，所有语言的请求在同一个限流器下一起调度。
+        提供 outputs 时每个块完成后立即恢复占位符，按原文顺序写入对应的输出（失败的块在最后补上原文），
+        已经写出的译文不再保留在内存中。
+
+        参数:
+            content (str): Markdown 内容
+            target_languages (list): 目标语言列表
+            concurrency (int): 同时在途的翻译请求数（所有语言合计）
+            limiter (RateLimiter): 限流器，为 None 时不限流
+            on_chunk_done (callable): 每完成一块时回调 on_chunk_done(已完成数, 总数)
+            cancel_event (threading.Event): 设置后停止翻译并抛出 Cancelled
+            max_retries (int): 每个文本块最多重试次数
+            metrics (RunMetrics): 运行指标
+            journals (dict): {目标语言: TranslationJournal}，提供时跳过其中已完成的块并逐块记录译文
+            dedup (bool): 为 True 时重复出现的段落只翻译一次
+            registry (ParagraphRegistry): 跨文档的段落记录
+            validate (bool): 为 True 时校验每块译文的结构，不合格的块定向重新翻译
+            repair_budget (int): 重新翻译不合格的块最多使用的额外请求数（所有语言合计）
+            log (callable): 输出进度信息的函数
+            outputs (dict): {目标语言: 可写的文件对象}，提供时译文边翻译边写入
+            on_tokens (callable): 流式模式下按收到的令牌回调 on_tokens(已收到的令牌数, 预计输出令牌数)
+
+        返回:
+            tuple: ({目标语言: 译文}, {目标语言: 重试后仍失败的文本块列表}, 文本块列表)；
+                   失败的块在译文中保留原文；提供 outputs 时译文字典为空
+        """
+        target_languages = list(target_languages)
+        chunks, special_elements, repeated, known, repeated_count, dedup_stats = self.prepare_markdown(
+            content, target_languages, metrics, dedup, registry)
+        if dedup_stats is not None and dedup_stats["saved_tokens"]:
+            log(f"去重: {dedup_stats['paragraphs']} 个段落中有 {dedup_stats['repeated_paragraphs']} 个重复，"
+                f"节省约 {dedup_stats['saved_tokens']} 令牌（{dedup_stats['dedup_ratio']:.1%}）")
+        metrics.count("chunks", len(chunks) * len(target_languages))
+        metrics.count("special_elements", len(special_elements))
+        expected_tokens = 0
+        for language in target_languages:
+            plan = summarize_chunks(chunks, language)
+            expected_tokens += plan["predicted_output_tokens"]
+            log(f"{language}: 文本已分割为 {plan['requests']} 块，输入约 {plan['input_tokens']} 令牌，"
+                f"预计输出约 {plan['predicted_output_tokens']} 令牌")
+        log(f"共 {len(chunks) * len(target_languages)} 个请求，并发数 {concurrency}")
+
+        # 从断点日志恢复上次已完成的块
+        completed, plan_ids = {}, {}
+        if journals is not None:
+            plan_ids = {language: plan_hash(chunks, language, self.model, self.max_output_tokens)
+                        for language in target_languages}
+            completed = {language: journals[language].completed(plan_ids[language])
+                         for language in target_languages}
+            for language, done in completed.items():
+                if done:
+                    metrics.count("resumed_chunks", len(done))
+                    log(f"{language}: 从断点日志恢复了 {len(done)}/{len(chunks)} 块，只翻译其余的块")
+
+        failures = {language: [] for language in target_languages}
+
+        def fan_out(language, translated_chunks):
+            # 重复段落的块有失败时（块中保留的是原文）不缓存段落译文
+            failed = any(failure["index"] < repeated_count for failure in failures[language])
+            return self.fan_out_repeated(language, translated_chunks, repeated, known, len(special_elements),
+                                         registry, failed)
+
+        # 边翻译边按顺序写出，从断点日志恢复的块先交给写出器
+        writers = {}
+        if outputs is not None:
+            writers = {language: _OrderedOutput(outputs[language], repeated_count, special_elements,
+                                                 lambda translated_chunks, language=language:
+                                                 fan_out(language, translated_chunks))
+                       for language in target_languages}
+            for language, done in completed.items():
+                for index, text in done.items():
+                    writers[language].add(index, text)
+
+        def on_result(language, index, text):
+            if journals is not None:
+                journals[language].record(plan_ids[language], index, text)
+            if writers:
+                writers[language].add(index, text)
+
+        # 流式模式下按收到的令牌数报告进度
+        progress = _TokenProgress(expected_tokens, on_tokens) if self.stream and on_tokens else None
+        token_callback = progress.add if progress is not None else None
+
+        # 译文结构不合格的块只对这一块重新翻译，修复失败时保留原文
+        translate = lambda chunk, language: self.translate_text(chunk, language, metrics, on_tokens=token_callback)
+        if validate:
+            translate = ValidatedTranslator(
+                translate,
+                lambda chunk, language: self.translate_text(chunk, language, metrics,
+                                                            strict_system_prompt(language), STRICT_PROMPT_VERSION,
+                                                            token_callback),
+                RepairBudget(repair_budget),
+                metrics,
+            )
+
+        with metrics.stage("translate.api"):
+            try:
+                translated = translate_chunks_for_languages(
+                    chunks,
+                    target_languages,
+                    translate,
+                    concurrency=concurrency,
+                    limiter=limiter or RateLimiter(rpm=0, tpm=0),
+                    on_chunk_done=on_chunk_done,
+                    cancel_event=cancel_event,
+                    retry_policy=RetryPolicy(max_retries),
+                    metrics=metrics,
+                    completed=completed,
+                    on_result=on_result if journals is not None or writers else None,
+                    keep_results=not writers,
+                )
+            except TranslationFailed as e:
+                # 其余块照常输出，失败的块保留原文
+                translated, failures = e.results, e.failures
+
+        if validate and translate.budget.used:
+            log(f"校验: 有译文结构与原文不一致的块，已用 {translate.budget.used} 个额外请求重新翻译")
+
+        if writers:
+            # 失败的块保留原文，补上后写出其后暂存的块
+            with metrics.stage("translate.restore"):
+                for language in target_languages:
+                    for failure in failures[language]:
+                        writers[language].add(failure["index"], translated[language][failure["index"]])
+            return {}, failures, chunks
+
+        # 先填回重复段落的译文，再恢复特殊元素（将占位符替换回原始内容）
+        final_contents = {}
+        with metrics.stage("translate.restore"):
+            for language in target_languages:
+                translated_chunks = translated[language]
+                translated_content = "\n\n".join(translated_chunks[repeated_count:])
+                repeated_translations = fan_out(language, translated_chunks[:repeated_count])
+                translated_content = restore_repeated(translated_content, repeated_translations,
+                                                      len(special_elements))
+                final_contents[language] = restore_special_elements(translated_content, special_elements)
+        return final_contents, failures, chunks
@@ -0,0 +1,106 @@
+"""
+翻译断点日志
+
+翻译过程中每完成一个文本块，就把译文追加写入日志文件并立即落盘（fsync），
+程序崩溃、被取消或网络中断后重新运行同一输入时，只翻译日志中还没有的块。
+
+日志是追加写入的 JSON Lines 文件，每行记录一个块：
+    {"plan": 分块计划的哈希, "index": 块序号, "text": 译文}
+分块计划的哈希由全部原文块、目标语言、模型、提示词版本和输出令牌上限计算，
+任何一项变化都会得到不同的哈希，旧记录不会被误用。同一个日志可以保存多个计划的记录
+（例如边解析边翻译时每个页窗口各有一个计划）。崩溃时写到一半的最后一行在打开日志时被截掉，
+之后追加的记录从新的一行开始。
+"""
+import os
+import json
+import hashlib
+import threading
+
+from translation_cache import PROMPT_VERSION
+
+# 日志文件的后缀
+JOURNAL_SUFFIX = ".journal"
+
+
+def plan_hash(chunks, target_language, model, max_output_tokens):
+    """计算分块计划的哈希
+
+    参数:
+        chunks (list): 原文块列表
+        target_language (str): 目标语言
+        model (str): 翻译模型
+        max_output_tokens (int): 每个请求的输出令牌上限
+
+    返回:
+        str: 十六进制哈希
+    """
+    digest = hashlib.sha256()
+    for part in (target_language, model, PROMPT_VERSION, str(max_output_tokens), str(len(chunks))):
+        digest.update(part.encode("utf-8") + b"\x00")
+    for chunk in chunks:
+        digest.update(hashlib.sha256(chunk.encode("utf-8")).digest())
+    return digest.hexdigest()
+
+
+def journal_path_for(output_file):
+    """输出文件对应的日志文件路径"""
+    return output_file + JOURNAL_SUFFIX
+
+
+class TranslationJournal:
+    """追加写入、逐块落盘的翻译日志，可以被多个翻译线程共享
+
+    参数:
+        path (str): 日志文件路径，不存在时创建
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            self._load()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _load(self):
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                # 截掉崩溃时写到一半的最后一行，否则下一条记录会接在它后面，两行都无法解析
+                data = data[:data.rfind(b"\n") + 1]
+                f.truncate(len(data))
+        for line in data.decode("utf-8", errors="replace").splitlines():
+            try:
+                entry = json.loads(line)
+                self.entries.setdefault(entry["plan"], {})[entry["index"]] = entry["text"]
+            except (ValueError, KeyError, TypeError):
+                # 无法解析的行
+                continue
+
+    def completed(self, plan):
+        """返回该计划已完成的块 {序号: 译文}"""
+        with self._lock:
+            return dict(self.entries.get(plan, {}))
+
+    def record(self, plan, index, text):
+        """记录一个完成的块，返回前已写入磁盘"""
+        line = json.dumps({"plan": plan, "index": index, "text": text}, ensure_ascii=False)
+        with self._lock:
+            self.entries.setdefault(plan, {})[index] = text
+            self._file.write(line + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def discard(self):
+        """全部完成后删除日志"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)